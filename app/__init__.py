@@ -1,16 +1,17 @@
 import os
 
 from logging import getLogger
-from flask_sqlalchemy import SQLAlchemy
 from flask import Flask, request, session
 from flask import Flask, render_template
 from flask_admin import Admin
 from flask_admin.contrib.sqla import ModelView
+from db_tuning import TunedSQLAlchemy
 
 LOG = getLogger(__name__)
 
 app = Flask(__name__, static_folder='files')
-db = SQLAlchemy(app)
+# SQLite PRAGMAs of the config's SQLITE_PROFILE, see db_tuning.py.
+db = TunedSQLAlchemy(app)
 
 ####################### Flask Admin #######################
 admin = Admin(
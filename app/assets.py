@@ -0,0 +1,221 @@
+"""
+Fingerprinted, precompressed static files.
+
+asset_url('js/app.js') gives /static/js/app.<hash>.js, the hash being the
+first HASH_LENGTH hex digits of the md5 of the file. A fingerprinted URL
+never changes content, so it is served with a one year immutable
+Cache-Control and the tablets never ask for it again; the file's next
+version has another URL. Plain URLs are still served, with no-cache and
+an ETag so that they revalidate.
+
+build() (run at startup and by `flask assets`) fingerprints every file of
+the asset roots and writes .gz (and .br when the brotli module is there)
+siblings of the compressible ones. send_asset() serves the smallest of
+them the client accepts, with Vary: Accept-Encoding.
+
+The manifest.appcache version line is replaced by a hash of all the
+fingerprints it lists, so it changes whenever one of them does.
+"""
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from logging import getLogger
+
+from flask import url_for, request, send_file, abort, current_app
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOG = getLogger(__name__)
+
+HASH_LENGTH = 12
+ONE_YEAR = 365 * 24 * 3600
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.html', '.txt', '.ico', '.ttf', '.eot', '.appcache')
+# Smaller than this is not worth a compressed sibling.
+MIN_COMPRESS_SIZE = 256
+# Directories whose files are named after their content already (see thumbnails.py).
+CONTENT_ADDRESSED = ('thumbs/',)
+APPCACHE = 'manifest.appcache'
+APPCACHE_VERSION = re.compile(r'^\d{4}-\d{2}-\d{2}:v\d+$|^# version: [0-9a-f]+$', re.M)
+
+HASHED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)?$' % HASH_LENGTH)
+
+# path -> ((mtime, size), fingerprint)
+_fingerprints = {}
+
+# Endpoint -> directory served by it, filled by register().
+roots = {}
+
+
+def register(endpoint, directory):
+    roots[endpoint] = directory
+
+
+def fingerprint(path):
+    """Content hash of a file, None if there is no such file."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_mtime, st.st_size)
+    cached = _fingerprints.get(path)
+    if cached is None or cached[0] != stamp:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(65536), b''):
+                md5.update(block)
+        cached = _fingerprints[path] = (stamp, md5.hexdigest()[:HASH_LENGTH])
+    return cached[1]
+
+
+def hashed_name(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return '%s.%s%s' % (stem, digest, ext)
+
+
+def split_hashed_name(filename):
+    """(original filename, hash) of a fingerprinted name, (filename, None) otherwise."""
+    match = HASHED_NAME.match(filename)
+    if match is None:
+        return filename, None
+    return match.group('stem') + (match.group('ext') or ''), match.group('hash')
+
+
+def asset_url(filename, endpoint='send_dist'):
+    """URL of a static file with its fingerprint, the plain URL if the file is missing."""
+    path = safe_join(roots[endpoint], filename)
+    digest = fingerprint(path) if path else None
+    if digest is not None and filename != APPCACHE:
+        filename = hashed_name(filename, digest)
+    return url_for(endpoint, filename=filename)
+
+
+########################## Build ##########################
+def _walk(directory):
+    for parent, dirs, files in os.walk(directory):
+        for name in files:
+            if name.endswith(('.gz', '.br', '.tmp')):
+                continue
+            yield os.path.join(parent, name)
+
+
+def _write_atomic(path, data):
+    # Every gunicorn worker builds at startup, each writes a file of its own.
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as fp:
+        fp.write(data)
+    os.rename(tmp_path, path)
+
+
+def _compressed(path, data):
+    """Write the compressed siblings of a file that are missing or older than it."""
+    written = 0
+    mtime = os.path.getmtime(path)
+    variants = [('.gz', _gzip)]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress))
+    for suffix, compress in variants:
+        sibling = path + suffix
+        if os.path.exists(sibling) and os.path.getmtime(sibling) >= mtime:
+            continue
+        packed = compress(data)
+        if len(packed) < len(data):
+            _write_atomic(sibling, packed)
+            written += 1
+    return written
+
+
+def _gzip(data):
+    from StringIO import StringIO
+    out = StringIO()
+    # mtime=0 keeps the bytes, and so the ETag, the same across builds.
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as fp:
+        fp.write(data)
+    return out.getvalue()
+
+
+def build(directory):
+    """Fingerprint a directory's files and precompress them, returns (files, compressed)."""
+    files = compressed = 0
+    for path in _walk(directory):
+        fingerprint(path)
+        files += 1
+        if path.endswith(COMPRESSIBLE) and os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+            with open(path, 'rb') as fp:
+                compressed += _compressed(path, fp.read())
+    return files, compressed
+
+
+def build_all():
+    for endpoint, directory in sorted(roots.items()):
+        files, compressed = build(directory)
+        LOG.info('Assets of %s: %d file(s), %d compressed', directory, files, compressed)
+
+
+########################## Serving ##########################
+def _accepted_variant(path):
+    """(path, Content-Encoding) of the best variant the request accepts."""
+    accepted = request.accept_encodings
+    mtime = os.path.getmtime(path)
+    for suffix, encoding in (('.br', 'br'), ('.gz', 'gzip')):
+        sibling = path + suffix
+        if accepted[encoding] and os.path.exists(sibling) and os.path.getmtime(sibling) >= mtime:
+            return sibling, encoding
+    return path, None
+
+
+def appcache_manifest(directory):
+    """manifest.appcache with a version line that follows the files it caches."""
+    with open(os.path.join(directory, APPCACHE)) as fp:
+        text = fp.read()
+    versions = hashlib.md5()
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.endswith(':') and line[:-1].isupper():
+            section = line[:-1]
+        elif section == 'CACHE' and line and not line.startswith('#'):
+            versions.update('%s=%s\n' % (line, fingerprint(os.path.join(directory, line))))
+    return APPCACHE_VERSION.sub('# version: %s' % versions.hexdigest()[:HASH_LENGTH], text, count=1)
+
+
+def send_asset(directory, filename):
+    """Serve a file of an asset root, see the module docstring."""
+    original, digest = split_hashed_name(filename)
+    path = safe_join(directory, original)
+    if path is None or not os.path.isfile(path):
+        # A real file that only looks fingerprinted.
+        original, digest = filename, None
+        path = safe_join(directory, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+    current = fingerprint(path)
+    if original == APPCACHE:
+        response = current_app.response_class(appcache_manifest(directory), mimetype='text/cache-manifest')
+        response.cache_control.no_cache = True
+        response.set_etag(hashlib.md5(response.get_data()).hexdigest())
+        return response.make_conditional(request)
+
+    variant, encoding = _accepted_variant(path)
+    mimetype = mimetypes.guess_type(original)[0] or 'application/octet-stream'
+    response = send_file(variant, mimetype=mimetype, add_etags=False, conditional=False)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if original.endswith(COMPRESSIBLE):
+        response.vary.add('Accept-Encoding')
+
+    # Werkzeug's CacheControl has no 'immutable', the header is written as a whole.
+    response.headers.pop('Expires', None)
+    if digest == current or original.startswith(CONTENT_ADDRESSED):
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % ONE_YEAR
+    else:
+        # Unversioned (or outdated) URL, check back every time.
+        response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(current + ('-' + encoding if encoding else ''))
+    return response.make_conditional(request)
@@ -1,5 +1,5 @@
 import datetime
-from app import app, db
+from app import app, db, db_migrate
 from app.model import Color, Machine, Product, Shift, Order, ProductionEntry, Role, User
 from colour import Color as HtmlColor
 from flask_security.utils import encrypt_password
@@ -9,6 +9,7 @@ from datetime import time
 def build_sample_db(user_datastore):
     db.drop_all()
     db.create_all()
+    db_migrate.stamp(db.engine)
     print "####### Creating test data ########"
     create_shift()
     db.session.commit()
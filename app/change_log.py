@@ -0,0 +1,238 @@
+"""
+Row change log of the live tables, for incremental backups.
+
+SQLite triggers append every insert, update and delete of the TRACKED_TABLES
+to change_log, in the writer's transaction, whoever writes: the ORM, the
+batch API, the jobs' plain SQL. Each row holds the key of the old row and
+the new row as JSON:
+
+    seq  table_name  op  old_key      new_row
+    41   order       U   {"id": 7}    {"id": 7, "name": ..., ...}
+
+ship() moves the log into gzipped NDJSON segment files (see db_backup.py)
+every minute, so a crash loses at most the changes since the last segment;
+db_backup.restore() replays the segments over the last full backup.
+
+The app ships from the daemon thread of `shipper`, in one process at a time:
+the one holding the flock of SHIP_LOCK in the segment directory. The other
+gunicorn workers try again every interval and take over when it exits.
+
+The triggers list the columns the tables have when they are created. A
+migration that adds columns to a tracked table must call create_triggers()
+again.
+
+The triggers need the JSON1 functions of SQLite (built in from 3.38, an
+option before). Without them create_triggers() installs none and warns:
+a trigger calling a missing function would fail every write to its table.
+There are no incremental backups then, only the full ones.
+"""
+import os
+import fcntl
+import threading
+import time
+from logging import getLogger
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+from app import db
+import db_backup
+
+LOG = getLogger(__name__)
+
+TRACKED_TABLES = (
+    'order', 'production_entry', 'production_hourly_count', 'users_production_entries',
+    'team', 'user_team', 'user_team_standbys', 'team_request', 'user', 'roles_users',
+    'role', 'product', 'product_color', 'color', 'machine', 'shift'
+)
+
+# Log rows per segment file.
+SEGMENT_ROWS = 50000
+# Held by the process shipping a segment directory.
+SHIP_LOCK = 'ship.lock'
+
+change_log_table = db.Table(
+    'change_log',
+    db.Column('seq', db.Integer, primary_key=True),
+    db.Column('table_name', db.String, nullable=False),
+    db.Column('op', db.String(1), nullable=False),
+    db.Column('old_key', db.String),
+    db.Column('new_row', db.String),
+    # seq is never reused, it orders the changes across segments.
+    sqlite_autoincrement=True
+)
+
+OPS = (('insert', 'I'), ('update', 'U'), ('delete', 'D'))
+
+TRIGGER_SQL = """
+CREATE TRIGGER "%(name)s" AFTER %(event)s ON "%(table)s"
+BEGIN
+    INSERT INTO change_log (table_name, op, old_key, new_row) VALUES ('%(table)s', '%(op)s', %(old)s, %(new)s);
+END
+"""
+
+
+def _json_object(prefix, columns):
+    return 'json_object(%s)' % ', '.join("'%s', %s.\"%s\"" % (c, prefix, c) for c in columns)
+
+
+def trigger_name(table, op):
+    return 'change_log_%s_%s' % (table, op)
+
+
+def key_columns(connection, table):
+    """The primary key of a table, all its columns when it has none (m-m tables)."""
+    info = [(row[1], row[5]) for row in connection.execute('PRAGMA table_info("%s")' % table)]
+    key = [name for name, pk in sorted(info, key=lambda c: c[1]) if pk]
+    return key or [name for name, pk in info]
+
+
+def json_available(connection):
+    """Whether this SQLite has json_object(), which the triggers call."""
+    try:
+        connection.execute("SELECT json_object('a', 1)")
+    except DBAPIError:
+        return False
+    return True
+
+
+def create_triggers(connection, tables=TRACKED_TABLES):
+    """(Re)create the change log triggers of the tables, with their current columns."""
+    if not json_available(connection):
+        LOG.warning('SQLite %s has no JSON1 functions, no change log for incremental backups',
+                    connection.execute('SELECT sqlite_version()').scalar())
+        drop_triggers(connection, tables)
+        return
+    for table in tables:
+        columns = [row[1] for row in connection.execute('PRAGMA table_info("%s")' % table)]
+        if not columns:
+            continue
+        key = key_columns(connection, table)
+        for op, code in OPS:
+            name = trigger_name(table, op)
+            connection.execute('DROP TRIGGER IF EXISTS "%s"' % name)
+            connection.execute(TRIGGER_SQL % dict(
+                name=name, event=op.upper(), table=table, op=code,
+                old=_json_object('OLD', key) if op != 'insert' else 'NULL',
+                new=_json_object('NEW', columns) if op != 'delete' else 'NULL'
+            ))
+
+
+def drop_triggers(connection, tables=TRACKED_TABLES):
+    for table in tables:
+        for op, code in OPS:
+            connection.execute('DROP TRIGGER IF EXISTS "%s"' % trigger_name(table, op))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_triggers(metadata, connection, **kwargs):
+    if connection.dialect.name == 'sqlite':
+        create_triggers(connection)
+
+
+def pending(connection):
+    return connection.execute('SELECT count(*) FROM change_log').scalar()
+
+
+def _make_dir(segment_dir):
+    if not os.path.isdir(segment_dir):
+        try:
+            os.makedirs(segment_dir)
+        except OSError:
+            pass  # Made by another worker meanwhile.
+
+
+def try_ship_lock(segment_dir):
+    """
+    The open SHIP_LOCK file of segment_dir, locked for this process until it
+    is closed, or None when another process ships it.
+    """
+    _make_dir(segment_dir)
+    lock_file = open(os.path.join(segment_dir, SHIP_LOCK), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def ship(engine, segment_dir, segment_rows=SEGMENT_ROWS):
+    """
+    Move the change log into segment files of segment_dir, returns the
+    segments written. A segment is complete on disk before its rows leave the
+    log; a crash in between only ships them again, restore() skips them.
+    Callers hold the SHIP_LOCK, see try_ship_lock().
+    """
+    _make_dir(segment_dir)
+    written = []
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                'SELECT seq, table_name, op, old_key, new_row FROM change_log ORDER BY seq LIMIT ?', segment_rows
+            ).fetchall()
+        if not rows:
+            break
+        started = time.time()
+        written.append(db_backup.write_segment(segment_dir, rows))
+        with engine.begin() as connection:
+            connection.execute('DELETE FROM change_log WHERE seq <= ?', rows[-1][0])
+        LOG.info('Shipped changes %d-%d to %s in %.3f s', rows[0][0], rows[-1][0], written[-1],
+                 time.time() - started)
+        if len(rows) < segment_rows:
+            break
+    return written
+
+
+class ChangeShipper(object):
+    """
+    Ships the change log of an engine every `interval` seconds from a daemon
+    thread, while this process holds the SHIP_LOCK of the segment directory.
+    The thread is started by start().
+    """
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.engine = None
+        self.segment_dir = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, engine, segment_dir):
+        with self._lock:
+            self.engine, self.segment_dir = engine, segment_dir
+            self._stop.clear()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='change-shipper')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def release(self):
+        """Let another process ship."""
+        with self._lock:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def check(self):
+        """One round, returns the segments written, None while another process ships."""
+        with self._lock:
+            if self._lock_file is None:
+                self._lock_file = try_ship_lock(self.segment_dir)
+            if self._lock_file is None:
+                return None
+            return ship(self.engine, self.segment_dir)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                LOG.exception('Shipping the change log failed')
+
+
+shipper = ChangeShipper()
@@ -0,0 +1,171 @@
+"""
+Table change tracking.
+
+Every committed transaction bumps a generation number for each table it
+wrote to. In-process caches (dashboard snapshot, ...) remember the
+generations they were built from and only rebuild when one has moved, so
+an unchanged read costs a dictionary lookup instead of a query.
+
+When a notification file is configured (CHANGE_NOTIFY_FILE) the generations
+are also published there, so a commit in one gunicorn worker invalidates the
+caches of all the others. Readers only stat() the file; it is rewritten
+atomically by rename under an flock, so no broker is needed.
+
+Writes done with plain SQL outside of the ORM session (bulk jobs) must
+call bump() themselves once their transaction is committed.
+"""
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from itertools import chain
+from logging import getLogger
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+LOG = getLogger(__name__)
+
+_lock = threading.Lock()
+_generations = {}
+_notify_file = None
+_file_stamp = None
+
+SESSION_KEY = 'changed_tables'
+
+
+def set_notify_file(path):
+    """Share generations with other processes through the given file."""
+    global _notify_file, _file_stamp
+    _notify_file = path
+    _file_stamp = None
+
+
+def generation(*tables):
+    """Return the current generation tuple for the given table names."""
+    _load_published()
+    return tuple(_generations.get(t, 0) for t in tables)
+
+
+def bump(*tables):
+    """Mark the given tables as changed."""
+    with _lock:
+        if _notify_file:
+            try:
+                _publish(tables)
+                return
+            except (IOError, OSError, ValueError) as ex:
+                LOG.warning('Failed to publish table changes to %s: %s', _notify_file, ex)
+
+        for t in tables:
+            _generations[t] = _generations.get(t, 0) + 1
+
+
+def touch(session, *tables):
+    """Record tables written with plain SQL inside a session's transaction."""
+    session.info.setdefault(SESSION_KEY, set()).update(tables)
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+def _read_published():
+    try:
+        with open(_notify_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _merge(published):
+    for t, g in published.items():
+        if g > _generations.get(t, 0):
+            _generations[t] = g
+
+
+def _load_published():
+    """Pick up generations bumped by other processes."""
+    global _file_stamp
+    if not _notify_file:
+        return
+
+    stamp = _stamp(_notify_file)
+    if stamp == _file_stamp:
+        return
+
+    published = _read_published()
+    with _lock:
+        _merge(published)
+        _file_stamp = stamp
+
+
+@contextmanager
+def _file_lock():
+    with open(_notify_file + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _publish(tables):
+    global _file_stamp
+    with _file_lock():
+        published = _read_published()
+        _merge(published)
+        for t in tables:
+            _generations[t] = _generations.get(t, 0) + 1
+            published[t] = _generations[t]
+
+        tmp_file = '%s.%d.tmp' % (_notify_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(published, f)
+        os.rename(tmp_file, _notify_file)
+        _file_stamp = _stamp(_notify_file)
+
+
+def _tables_of(obj):
+    state = inspect(obj)
+    tables = set(t.name for t in state.mapper.tables)
+    # m-m collections write to their secondary table.
+    for rel in state.mapper.relationships:
+        if rel.secondary is not None and state.attrs[rel.key].history.has_changes():
+            tables.add(rel.secondary.name)
+    return tables
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_tables(session, flush_context):
+    tables = session.info.setdefault(SESSION_KEY, set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tables.update(_tables_of(obj))
+
+
+def _collect_bulk_tables(context):
+    mapper = getattr(context, 'mapper', None)
+    if mapper is not None:
+        tables = context.session.info.setdefault(SESSION_KEY, set())
+        tables.update(t.name for t in mapper.tables)
+
+
+event.listen(Session, 'after_bulk_update', _collect_bulk_tables)
+event.listen(Session, 'after_bulk_delete', _collect_bulk_tables)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_committed_tables(session):
+    tables = session.info.pop(SESSION_KEY, None)
+    if tables:
+        bump(*tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_tables(session):
+    session.info.pop(SESSION_KEY, None)
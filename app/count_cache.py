@@ -0,0 +1,132 @@
+"""
+Cached row counts for the admin list views.
+
+Every list render asks for a count(*) of its (filtered) query. CountQuery
+keeps the result per SQL statement and parameters together with the change
+generations of the tables it reads (see changes.py), so the count is only
+run again after one of those tables had a commit. Without a filter that is
+an exact counter refreshed once per change.
+
+A view can also set an estimate threshold: filtered counts over a table
+bigger than that are extrapolated from the most recent ESTIMATE_SAMPLE rows
+and shown as "about N".
+"""
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Query, scoped_session
+from sqlalchemy.sql.util import find_tables
+
+from app import db
+import changes
+
+CACHE_SIZE = 512
+# Rows by id sampled for an estimate, and the matches needed to trust it.
+ESTIMATE_SAMPLE = 10000
+ESTIMATE_MIN_HITS = 100
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+class Estimate(int):
+    """An approximate count, still usable as a number by the pager."""
+    def __unicode__(self):
+        return u'about {:,}'.format(int(self))
+
+    def __str__(self):
+        return 'about {:,}'.format(int(self))
+
+
+def _get(key):
+    with _lock:
+        if key in _cache:
+            _cache[key] = value = _cache.pop(key)
+            return value
+    return None
+
+
+def _put(key, value):
+    with _lock:
+        _cache[key] = value
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+class CountQuery(Query):
+    """A count query whose scalar() is cached, see count_query()."""
+    _count_base = None
+    _count_pk = None
+    _estimate_threshold = None
+
+    def as_base(self):
+        """This query as the unfiltered count of its view, e.g. after the view's own criteria."""
+        query = self._clone()
+        query._count_base = query
+        return query
+
+    def _cache_key(self):
+        """(sql, params, generations), None when a table is not change-tracked."""
+        statement = self.statement
+        tables = set(find_tables(statement, include_joins=True))
+        if not all(getattr(t, 'metadata', None) is db.metadata for t in tables):
+            return None
+        compiled = statement.compile()
+        return (
+            unicode(compiled),
+            repr(sorted(compiled.params.items())),
+            changes.generation(*sorted(t.name for t in tables))
+        )
+
+    def scalar(self):
+        key = self._cache_key()
+        if key is None:
+            return super(CountQuery, self).scalar()
+
+        count = _get(key)
+        if count is None:
+            count = self._estimate() if self._is_filtered() else None
+            if count is None:
+                count = super(CountQuery, self).scalar()
+            _put(key, count)
+        return count
+
+    def _is_filtered(self):
+        base = self._count_base
+        return base is not None and unicode(self.statement) != unicode(base.statement)
+
+    def _estimate(self):
+        """Extrapolate a filtered count over a big table, None to count it exactly."""
+        if not self._estimate_threshold or self._count_pk is None:
+            return None
+        total = self._count_base.scalar()
+        if total <= self._estimate_threshold:
+            return None
+
+        pk = self._count_pk
+        newest = self.session.query(func.max(pk)).scalar() or 0
+        sample = Query.scalar(self._count_base.filter(pk > newest - ESTIMATE_SAMPLE))
+        hits = Query.scalar(self.filter(pk > newest - ESTIMATE_SAMPLE))
+        if not sample or hits < ESTIMATE_MIN_HITS:
+            return None
+        return Estimate(total * hits // sample)
+
+
+def count_query(session, model, column=None, estimate_threshold=None):
+    """
+    A cached `SELECT count(column or *)` over a model. Flask-Admin adds its
+    search and filter criteria to it like to any other query.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    query = CountQuery([func.count(column if column is not None else '*')], session=session)
+    query = query.select_from(model)
+    query._count_pk = getattr(model, 'id', None)
+    query._estimate_threshold = estimate_threshold
+    return query.as_base()
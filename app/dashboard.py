@@ -0,0 +1,149 @@
+"""
+Production dashboard data for the shop floor screens.
+
+The dashboard is built from a single query over the stored order counters and kept as an
+in-process snapshot. The snapshot is only rebuilt when one of the tables it
+reads from has committed a change, so the 30 second polls of every screen
+are served from memory and answered with 304 when nothing moved.
+
+Screens that support it subscribe to event_stream() instead of polling and
+get per-order deltas pushed as Server-Sent Events.
+"""
+import time
+import hashlib
+import threading
+
+from flask import json
+from sqlalchemy import case
+from model import Order, Product, Machine
+from thumbnails import thumbnail_name
+import changes
+
+
+def dashboard_query(session):
+    """In progress orders with their progress, one row per order."""
+    # Integer ceil(completed * 100 / quantity), same as ROUND_UP before.
+    percent = case(
+        [(Order.quantity > 0, (Order.completed * 100 + Order.quantity - 1) / Order.quantity)],
+        else_=0
+    )
+    return (
+        session.query(
+            Order.id, Product.photo, Order.quantity, Order.completed, Order.total_bad,
+            percent.label('percent'),
+            Machine.id.label('machine_id'), Machine.name.label('machine_name'),
+            Product.name.label('product_name')
+        )
+        .join(Product, Order.product_id == Product.id)
+        .join(Machine, Order.assigned_machine_id == Machine.id)
+        .filter(Order.status == 'IN_PROGRESS')
+        .order_by(Order.id)
+    )
+
+
+def build_dashboard(session):
+    data = []
+    for row in dashboard_query(session):
+        data.append(dict(
+            id=row.id,
+            # The screens show a card sized thumbnail, not the upload.
+            photo=thumbnail_name(row.photo, 'card') if row.photo else None,
+            quantity=row.quantity,
+            completed=row.completed,
+            total_bad=row.total_bad,
+            percent=row.percent,
+            machine_product='[%s] %s - %s' % (str(row.machine_id), row.machine_name, row.product_name)
+        ))
+    return data
+
+
+class DashboardSnapshot(object):
+    """Versioned, lazily rebuilt copy of the dashboard payload."""
+
+    # Tables the dashboard query reads from.
+    TABLES = ('order', 'product', 'machine')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self.version = 0
+        self.data = []
+        self.payload = '[]'
+        self.etag = None
+
+    def is_stale(self):
+        return changes.generation(*self.TABLES) != self._generation
+
+    def refresh(self, session):
+        """Rebuild the snapshot if a watched table changed since the last build."""
+        if not self.is_stale():
+            return self
+
+        with self._lock:
+            # Read the generation before querying so a commit racing the
+            # rebuild leaves the snapshot stale instead of losing the change.
+            generation = changes.generation(*self.TABLES)
+            if generation == self._generation:
+                return self
+
+            data = build_dashboard(session)
+            payload = json.dumps(data)
+            etag = hashlib.md5(payload).hexdigest()
+            if etag != self.etag:
+                self.data = data
+                self.payload = payload
+                self.etag = etag
+                self.version += 1
+            self._generation = generation
+
+        return self
+
+
+snapshot = DashboardSnapshot()
+
+
+def _sse(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+
+
+def event_stream(snapshot, session, poll_interval=1.0, keepalive=15, max_age=300):
+    """
+    Server-Sent Events for one dashboard client.
+
+    Sends the full snapshot first and then only the orders that changed
+    since the last event. All clients of a worker share the same snapshot,
+    so a change is queried once and fanned out to every stream. The stream
+    ends after `max_age` seconds and the browser reconnects by itself, which
+    keeps a worker thread from being pinned forever by a dead tablet.
+    """
+    sent = None
+    started = last_event = time.time()
+    yield 'retry: 5000\n\n'
+
+    while True:
+        snapshot.refresh(session)
+        # Don't hold a read transaction open between polls, it would pin
+        # the WAL and hide newer commits from this connection.
+        session.remove()
+
+        current = dict((o['id'], o) for o in snapshot.data)
+        ids = [o['id'] for o in snapshot.data]
+        if sent is None:
+            yield _sse('snapshot', dict(version=snapshot.version, orders=snapshot.data))
+            sent = current
+            last_event = time.time()
+        else:
+            changed = [o for o in snapshot.data if sent.get(o['id']) != o]
+            removed = [i for i in sent if i not in current]
+            if changed or removed:
+                yield _sse('delta', dict(version=snapshot.version, ids=ids, changed=changed, removed=removed))
+                sent = current
+                last_event = time.time()
+            elif time.time() - last_event >= keepalive:
+                yield ': keepalive\n\n'
+                last_event = time.time()
+
+        if time.time() - started >= max_age:
+            return
+
+        time.sleep(poll_interval)
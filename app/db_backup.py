@@ -1,18 +1,47 @@
 #!/usr/bin/env python
 """
-This script creates a timestamped database backup,
-and cleans backups older than a set number of dates
+This script creates a timestamped, compressed database backup,
+and cleans backups older than a set number of days
 
-"""    
+The copy is taken online: with the sqlite3 backup API, a few pages per
+step and a pause between steps, where the sqlite3 module has it (Python
+3.7+), otherwise with VACUUM INTO, which reads one snapshot and in WAL
+mode does not block the writers either. Both see the commits still in the
+WAL. The copy is checked with PRAGMA integrity_check and then compressed
+(gzip, or zstd when the zstandard module is installed) next to the older
+backups:
+
+    <backup_dir>/<db file name>-YYYYmmdd-HHMMSS.gz
+
+Also run by the backup job of config.JOBS, see scheduler.backup_job().
+
+Between two full backups the changes of the live tables are shipped as
+segments of the change log (see change_log.py), gzipped NDJSON, one change
+per line in seq order:
+
+    <segment_dir>/changes-<first seq>-<last seq>-YYYYmmdd-HHMMSS.ndjson.gz
+
+restore() replays them over a full backup: from the change_log position the
+backup was taken at (its AUTOINCREMENT counter) to the last segment, or to a
+given seq.
+"""
 
 from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import sqlite3
+import gzip
+import json
+import os
+import re
 import shutil
+import sqlite3
 import time
-import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 DESCRIPTION = """
               Create a timestamped SQLite database backup, and
@@ -22,39 +51,276 @@ DESCRIPTION = """
 # How old a file needs to be in order
 # to be considered for being removed
 NO_OF_DAYS = 7
+# The newest backups of each database kept whatever their age.
+KEEP_LAST = 3
+# Pages copied per backup step, and the pause that lets writers in between.
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.05
+CHUNK_SIZE = 1 << 20
 
-def sqlite3_backup(dbfile, backupdir):
-    """Create timestamped database copy"""
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+BACKUP_FILE = re.compile(r'^(?P<source>.+)-(?P<stamp>\d{8}-\d{6})(?:\.gz|\.zst)?$')
+SEGMENT_FILE = re.compile(r'^changes-(?P<first>\d+)-(?P<last>\d+)-(?P<stamp>\d{8}-\d{6})\.ndjson\.gz$')
 
-    if not os.path.isdir(backupdir):
-        raise Exception("Backup directory does not exist: {}".format(backupdir))
 
-    backup_file = os.path.join(backupdir, os.path.basename(dbfile) +
-                               time.strftime("-%Y%m%d-%H%M%S"))
+class BackupError(Exception):
+    pass
 
+
+def compressions():
+    """Compression methods available here."""
+    return [c for c in ('gzip', 'zstd', 'none') if c != 'zstd' or zstandard is not None]
+
+
+def online_copy(dbfile, copy_file, pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """Copy a live database into copy_file without holding off its writers."""
+    source = sqlite3.connect(dbfile)
+    try:
+        if hasattr(source, 'backup'):
+            target = sqlite3.connect(copy_file)
+            try:
+                source.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(sleep))
+            finally:
+                target.close()
+        elif sqlite3.sqlite_version_info >= (3, 27, 0):
+            # No backup API in this sqlite3 module, copy one read snapshot.
+            source.execute('VACUUM INTO ?', (copy_file,))
+        else:
+            raise BackupError('SQLite {} has neither the backup API nor VACUUM INTO'.format(sqlite3.sqlite_version))
+    finally:
+        source.close()
+
+
+def integrity_check(dbfile):
+    """Problems PRAGMA integrity_check finds in a database file, [] if none."""
     connection = sqlite3.connect(dbfile)
-    cursor = connection.cursor()
+    try:
+        rows = [row[0] for row in connection.execute('PRAGMA integrity_check')]
+    finally:
+        connection.close()
+    return [] if rows == ['ok'] else rows
+
+
+def _open_compressed(path, compression):
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', 6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise BackupError('zstd compression needs the zstandard module')
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+def compress(copy_file, backup_file, compression='gzip'):
+    """Stream a file into its compressed backup, which appears complete or not at all."""
+    tmp_file = backup_file + '.tmp'
+    with open(copy_file, 'rb') as source:
+        with _open_compressed(tmp_file, compression) as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+    os.rename(tmp_file, backup_file)
+
+
+def sqlite3_backup(dbfile, backupdir, compression='gzip', pages=PAGES_PER_STEP, sleep=STEP_SLEEP):
+    """Create a verified, compressed, timestamped database copy, returns its path"""
+
+    if not os.path.isdir(backupdir):
+        raise BackupError("Backup directory does not exist: {}".format(backupdir))
+    if compression not in EXTENSIONS:
+        raise BackupError("Unknown compression {}, expected one of {}".format(compression, ', '.join(compressions())))
 
-    # Lock database before making a backup
-    cursor.execute('begin immediate')
-    # Make new backup file
-    shutil.copyfile(dbfile, backup_file)
+    backup_file = os.path.join(backupdir, os.path.basename(dbfile) +
+                               time.strftime("-%Y%m%d-%H%M%S") + EXTENSIONS[compression])
+    copy_file = backup_file + '.copy'
     print ("\nCreating {}...".format(backup_file))
-    # Unlock database
-    connection.rollback()
+    try:
+        online_copy(dbfile, copy_file, pages, sleep)
+        problems = integrity_check(copy_file)
+        if problems:
+            raise BackupError("Backup of {} failed the integrity check: {}".format(dbfile, '; '.join(problems[:5])))
+        compress(copy_file, backup_file, compression)
+    finally:
+        for path in (copy_file, backup_file + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+    return backup_file
+
+
+def list_backups(backup_dir):
+    """{database file name: [(stamp, backup file name), ...] newest first}"""
+    backups = {}
+    for filename in os.listdir(backup_dir):
+        match = BACKUP_FILE.match(filename)
+        if match:
+            backups.setdefault(match.group('source'), []).append((match.group('stamp'), filename))
+    for files in backups.values():
+        files.sort(reverse=True)
+    return backups
 
-def clean_data(backup_dir):
-    """Delete files older than NO_OF_DAYS days"""
+
+def clean_data(backup_dir, days=NO_OF_DAYS, keep_last=KEEP_LAST):
+    """Delete backups older than `days` days, keeping the newest keep_last of each database"""
 
     print ("\n------------------------------")
     print ("Cleaning up old backups")
 
-    for filename in os.listdir(backup_dir):
-        backup_file = os.path.join(backup_dir, filename)
-        if os.stat(backup_file).st_ctime < (time.time() - NO_OF_DAYS * 86400):
-            if os.path.isfile(backup_file):
+    oldest = time.strftime('%Y%m%d-%H%M%S', time.localtime(time.time() - days * 86400))
+    removed = []
+    for source, files in list_backups(backup_dir).items():
+        for stamp, filename in files[keep_last:]:
+            if stamp < oldest:
+                backup_file = os.path.join(backup_dir, filename)
                 os.remove(backup_file)
-                print ("Deleting {}...".format(ibackup_file))
+                removed.append(backup_file)
+                print ("Deleting {}...".format(backup_file))
+    return removed
+
+
+########################## Change log segments ##########################
+def write_segment(segment_dir, rows):
+    """
+    Write (seq, table, op, old key JSON, new row JSON) rows of the change log
+    to a new segment file, returns its path.
+    """
+    segment_file = os.path.join(segment_dir, 'changes-%012d-%012d%s.ndjson.gz' % (
+        rows[0][0], rows[-1][0], time.strftime("-%Y%m%d-%H%M%S")))
+    # Unique per process, a second shipper never writes into this one's file.
+    tmp_file = '%s.%d.tmp' % (segment_file, os.getpid())
+    with gzip.open(tmp_file, 'wb', 6) as target:
+        for seq, table, op, old_key, new_row in rows:
+            line = '{"seq": %d, "table": %s, "op": "%s", "old": %s, "new": %s}\n' % (
+                seq, json.dumps(table), op, old_key or 'null', new_row or 'null')
+            target.write(line.encode('utf-8'))
+    os.rename(tmp_file, segment_file)
+    return segment_file
+
+
+def list_segments(segment_dir):
+    """[(first seq, last seq, stamp, segment file name), ...] oldest first"""
+    segments = []
+    for filename in os.listdir(segment_dir) if os.path.isdir(segment_dir) else ():
+        match = SEGMENT_FILE.match(filename)
+        if match:
+            segments.append((int(match.group('first')), int(match.group('last')), match.group('stamp'), filename))
+    return sorted(segments)
+
+
+def read_segment(segment_file):
+    with gzip.open(segment_file, 'rb') as source:
+        for line in source:
+            yield json.loads(line.decode('utf-8'))
+
+
+def prune_segments(segment_dir, before_stamp):
+    """
+    Delete the segments written before `before_stamp`, the stamp of the
+    oldest full backup kept: every change in them is in that backup.
+    """
+    removed = []
+    for first, last, stamp, filename in list_segments(segment_dir):
+        if stamp < before_stamp:
+            segment_file = os.path.join(segment_dir, filename)
+            os.remove(segment_file)
+            removed.append(segment_file)
+    return removed
+
+
+def decompress(backup_file, target_file):
+    with open(target_file, 'wb') as target:
+        if backup_file.endswith('.gz'):
+            with gzip.open(backup_file, 'rb') as source:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+        elif backup_file.endswith('.zst'):
+            if zstandard is None:
+                raise BackupError('zstd backups need the zstandard module')
+            with open(backup_file, 'rb') as source:
+                zstandard.ZstdDecompressor().copy_stream(source, target)
+        else:
+            with open(backup_file, 'rb') as source:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+
+def change_log_position(connection):
+    """seq of the last change a database has, None if it has no change log."""
+    if not connection.execute("SELECT count(*) FROM sqlite_master WHERE name = 'change_log'").fetchone()[0]:
+        return None
+    row = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def replay(connection, change):
+    """Apply one change: remove the old row by its key, (re)insert the new one."""
+    table = change['table']
+    if change['old'] is not None:
+        key = sorted(change['old'].items())
+        connection.execute(
+            'DELETE FROM "%s" WHERE rowid = (SELECT rowid FROM "%s" WHERE %s LIMIT 1)' % (
+                table, table, ' AND '.join('"%s" IS ?' % k for k, v in key)),
+            [v for k, v in key])
+    if change['new'] is not None:
+        columns = sorted(change['new'].items())
+        connection.execute(
+            'INSERT OR REPLACE INTO "%s" (%s) VALUES (%s)' % (
+                table, ', '.join('"%s"' % c for c, v in columns), ', '.join('?' * len(columns))),
+            [v for c, v in columns])
+
+
+def restore(backup_file, segment_dir, target_file, until=None):
+    """
+    Restore a full backup to target_file and replay the change log segments
+    of segment_dir over it, up to seq `until` (all by default). target_file
+    only appears once complete. Returns (segments, changes) replayed.
+    """
+    if os.path.exists(target_file):
+        raise BackupError("Restore target already exists: {}".format(target_file))
+    tmp_file = target_file + '.tmp'
+    decompress(backup_file, tmp_file)
+    try:
+        connection = sqlite3.connect(tmp_file)
+        try:
+            position = change_log_position(connection)
+            if position is None:
+                raise BackupError("{} has no change log to continue from".format(backup_file))
+            # The replayed rows are as they were, no cascades or checks.
+            connection.execute('PRAGMA foreign_keys = OFF')
+
+            segments = changes = 0
+            for first, last, stamp, filename in list_segments(segment_dir):
+                if last <= position:
+                    continue
+                if until is not None and first > until:
+                    break
+                if first > position + 1:
+                    raise BackupError("Changes {}-{} are missing from {}".format(position + 1, first - 1, segment_dir))
+                for change in read_segment(os.path.join(segment_dir, filename)):
+                    if change['seq'] <= position:
+                        # Shipped twice, see change_log.ship().
+                        continue
+                    if until is not None and change['seq'] > until:
+                        break
+                    replay(connection, change)
+                    position = change['seq']
+                    changes += 1
+                segments += 1
+
+            # Replaying logged the changes again; the restored database
+            # carries on from the last change it has.
+            connection.execute('DELETE FROM change_log')
+            connection.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+            connection.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (position,))
+            connection.commit()
+        finally:
+            connection.close()
+
+        problems = integrity_check(tmp_file)
+        if problems:
+            raise BackupError("Restored {} failed the integrity check: {}".format(target_file, '; '.join(problems[:5])))
+        os.rename(tmp_file, target_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    print ("\nRestored {} from {} and {} change(s) in {} segment(s)".format(target_file, backup_file, changes, segments))
+    return segments, changes
+
 
 def get_arguments():
     """Parse the commandline arguments from the user"""
@@ -65,11 +331,20 @@ def get_arguments():
     parser.add_argument('backup_dir',
                          help='the directory where the backup'
                               'file should be saved')
+    parser.add_argument('--compression', choices=compressions(), default='gzip')
+    parser.add_argument('--pages', type=int, default=PAGES_PER_STEP,
+                        help='pages copied per step of the backup API')
+    parser.add_argument('--sleep', type=float, default=STEP_SLEEP,
+                        help='seconds between the steps')
+    parser.add_argument('--days', type=int, default=NO_OF_DAYS,
+                        help='remove backups older than this many days')
+    parser.add_argument('--keep-last', type=int, default=KEEP_LAST,
+                        help='backups of the database always kept')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = get_arguments()
-    sqlite3_backup(args.db_file, args.backup_dir)
-    #clean_data(args.backup_dir)
+    sqlite3_backup(args.db_file, args.backup_dir, args.compression, args.pages, args.sleep)
+    clean_data(args.backup_dir, args.days, args.keep_last)
 
     print ("\nBackup update has been successful.")
@@ -0,0 +1,281 @@
+"""
+Versioned schema migrations for existing databases.
+
+`PRAGMA user_version` holds the number of migrations applied to a database.
+New databases are created from the models with db.create_all() and stamped
+with the latest version; existing ones are brought up to date by upgrade(),
+which runs every migration above the stored version in order.
+
+pysqlite commits before DDL statements, so a migration is not atomic. Each
+one must therefore be safe to re-run (check before ALTER, CREATE ... IF NOT
+EXISTS) so that a crash half way through is fixed by running upgrade() again.
+"""
+import re
+from logging import getLogger
+
+from sqlalchemy.schema import CreateTable
+
+LOG = getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(func):
+    """Register `func(connection)` as the next schema migration."""
+    MIGRATIONS.append(func)
+    return func
+
+
+def head():
+    return len(MIGRATIONS)
+
+
+def current_version(connection):
+    return connection.execute('PRAGMA user_version').scalar()
+
+
+def set_version(connection, version):
+    connection.execute('PRAGMA user_version = %d' % int(version))
+
+
+def stamp(engine):
+    """Mark a database created from the current models as fully migrated."""
+    with engine.connect() as connection:
+        set_version(connection, head())
+
+
+def upgrade(engine):
+    """Apply all pending migrations, returns the number applied."""
+    applied = 0
+    with engine.connect() as connection:
+        if not connection.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table'").scalar():
+            # Empty database, it gets created from the models and stamped.
+            return applied
+
+        version = current_version(connection)
+        foreign_keys = connection.execute('PRAGMA foreign_keys').scalar()
+        for number, func in enumerate(MIGRATIONS[version:], version + 1):
+            LOG.info('Applying migration %d: %s', number, func.__name__)
+            with connection.begin():
+                func(connection)
+                set_version(connection, number)
+            # Table rebuilds turn them off, see rebuild_table().
+            connection.execute('PRAGMA foreign_keys = %d' % foreign_keys)
+            applied += 1
+    return applied
+
+
+########################## Helpers ###########################
+def table_exists(connection, table):
+    return connection.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?", table
+    ).scalar() > 0
+
+
+def column_names(connection, table):
+    return [row[1] for row in connection.execute('PRAGMA table_info("%s")' % table)]
+
+
+def add_column(connection, table, name, ddl):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if name not in column_names(connection, table):
+        connection.execute('ALTER TABLE "%s" ADD COLUMN %s %s' % (table, name, ddl))
+
+
+def index_exists(connection, name):
+    return connection.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'index' AND name = ?", name
+    ).scalar() > 0
+
+
+def create_index(connection, name, table, columns, unique=False):
+    connection.execute('CREATE %sINDEX IF NOT EXISTS %s ON "%s" (%s)' % (
+        'UNIQUE ' if unique else '', name, table, ', '.join(columns)
+    ))
+
+
+def create_indexes(connection, table):
+    """Create the missing indexes of a model table."""
+    for index in table.indexes:
+        if not index_exists(connection, index.name):
+            index.create(connection)
+
+
+def table_sql(connection, table):
+    return connection.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", table
+    ).scalar()
+
+
+def rebuild_table(connection, table):
+    """
+    Recreate a table as its model defines it, for what ALTER TABLE cannot
+    change, keeping the rows of the columns both have. Its indexes and
+    triggers go with the old table: recreate them afterwards.
+
+    The old table is dropped with foreign keys off, or its rows would take
+    their children along (ON DELETE CASCADE) or fail the drop. SQLite only
+    turns them off outside a transaction, so call it before any other write
+    of the migration; upgrade() turns them on again.
+
+    A crash after the copy is dropped is resumed by renaming the copy.
+    """
+    name, copy = table.name, table.name + '_rebuild'
+    connection.execute('PRAGMA foreign_keys = OFF')
+    if connection.execute('PRAGMA foreign_keys').scalar():
+        raise RuntimeError('Cannot rebuild %s inside a transaction' % name)
+
+    if table_exists(connection, name):
+        connection.execute('DROP TABLE IF EXISTS "%s"' % copy)
+        ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+        connection.execute(re.sub(r'CREATE TABLE "?%s"?' % re.escape(name), 'CREATE TABLE "%s"' % copy, ddl, 1))
+        columns = ', '.join('"%s"' % c for c in column_names(connection, name) if c in table.c)
+        connection.execute('INSERT INTO "%s" (%s) SELECT %s FROM "%s"' % (copy, columns, columns, name))
+        connection.execute('DROP TABLE "%s"' % name)
+    # Legacy: leave the views alone, the TEMP history views refer to the
+    # table being renamed into place.
+    connection.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        connection.execute('ALTER TABLE "%s" RENAME TO "%s"' % (copy, name))
+    finally:
+        connection.execute('PRAGMA legacy_alter_table = OFF')
+
+    result = connection.execute('PRAGMA foreign_key_check("%s")' % name)
+    problems = result.fetchall() if result.returns_rows else []
+    if problems:
+        raise RuntimeError('Rebuilt %s has rows with missing parents: %r' % (name, problems[:10]))
+
+
+def raise_sequence(connection, table, value):
+    """Let the AUTOINCREMENT ids of a table start above `value`."""
+    if not connection.execute('UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?', value, table).rowcount:
+        connection.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', table, value)
+
+
+######################### Migrations ##########################
+@migration
+def add_order_progress_counters(connection):
+    """Stored completed/total_bad counters replace the correlated SUM() subqueries."""
+    from model import refresh_order_progress
+    add_column(connection, 'order', 'completed', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(connection, 'order', 'total_bad', 'INTEGER NOT NULL DEFAULT 0')
+    create_index(connection, 'ix_order_completed', 'order', ['completed'])
+    create_index(connection, 'ix_production_entry_order_id', 'production_entry', ['order_id'])
+    refresh_order_progress(connection)
+
+
+@migration
+def add_production_hourly_counts(connection):
+    """Normalized production_hourly_count rows, backfilled from the num_hourly_* strings."""
+    from model import ProductionHourlyCount, hourly_count_rows
+    table = ProductionHourlyCount.__table__
+    table.create(connection, checkfirst=True)
+    create_indexes(connection, table)
+
+    connection.execute(table.delete())
+    entries = connection.execute(
+        'SELECT id, num_hourly_good, num_hourly_bad, num_hourly_damage FROM production_entry'
+    )
+    while True:
+        batch = entries.fetchmany(500)
+        if not batch:
+            break
+        rows = []
+        for e in batch:
+            try:
+                rows.extend(hourly_count_rows(*e))
+            except ValueError:
+                LOG.warning('Skipping unparsable hourly counts of production entry %d', e[0])
+        if rows:
+            connection.execute(table.insert(), rows)
+
+
+@migration
+def add_team_request_status(connection):
+    """Status and progress of the background team generation job."""
+    add_column(connection, 'team_request', 'status', "VARCHAR(7) NOT NULL DEFAULT 'DONE'")
+    add_column(connection, 'team_request', 'num_days', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(connection, 'team_request', 'num_days_done', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(connection, 'team_request', 'num_teams', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(connection, 'team_request', 'error', 'VARCHAR')
+    create_index(connection, 'ix_team_request_status', 'team_request', ['status'])
+
+
+@migration
+def add_team_unique_slot(connection):
+    """One team per date, shift and machine; duplicates from overlapping requests are dropped."""
+    duplicates = '(SELECT id FROM team WHERE id NOT IN (SELECT min(id) FROM team GROUP BY date, shift_id, machine_id))'
+    connection.execute('DELETE FROM user_team WHERE team_id IN %s' % duplicates)
+    connection.execute('DELETE FROM user_team_standbys WHERE team_id IN %s' % duplicates)
+    connection.execute('DELETE FROM team WHERE id IN %s' % duplicates)
+    create_index(connection, 'ux_team_date_shift_machine', 'team', ['date', 'shift_id', 'machine_id'], unique=True)
+
+
+@migration
+def add_user_name_search_indexes(connection):
+    """Indexes of the lead/assembler autocomplete, see staff_cache.py."""
+    create_index(connection, 'ix_user_name_nocase', 'user', ['name COLLATE NOCASE'])
+    create_index(connection, 'ix_roles_users_role_user', 'roles_users', ['role_id', 'user_id'])
+
+
+@migration
+def add_change_log(connection):
+    """Trigger-fed change log of the live tables, for incremental backups."""
+    from change_log import change_log_table, create_triggers
+    change_log_table.create(connection, checkfirst=True)
+    create_triggers(connection)
+
+
+@migration
+def add_hot_query_indexes(connection):
+    """Indexes of the active order/entry/team lists, the order strips, the reports and the m-m loads."""
+    create_index(connection, 'ix_order_status', 'order', ['status'])
+    create_index(connection, 'ix_order_machine_status', 'order', ['assigned_machine_id', 'status'])
+    create_index(connection, 'ix_production_entry_date_shift', 'production_entry', ['date', 'shift_id'])
+    create_index(connection, 'ix_roles_users_user_role', 'roles_users', ['user_id', 'role_id'])
+    create_index(connection, 'ix_users_production_entries_entry_user', 'users_production_entries',
+                 ['production_entry_id', 'user_id'])
+    create_index(connection, 'ix_user_team_team_user', 'user_team', ['team_id', 'user_id'])
+    create_index(connection, 'ix_user_team_standbys_team_user', 'user_team_standbys', ['team_id', 'user_id'])
+    create_index(connection, 'ix_product_color_product_color', 'product_color', ['product_id', 'color_id'])
+
+
+@migration
+def add_team_request_owner(connection):
+    """Worker and heartbeat of a running team request, see roster.release_stale_requests()."""
+    from change_log import create_triggers
+    add_column(connection, 'team_request', 'worker_id', 'VARCHAR')
+    add_column(connection, 'team_request', 'heartbeat_at', 'DATETIME')
+    # The change log triggers list the columns of the table.
+    create_triggers(connection, ['team_request'])
+
+
+@migration
+def add_hourly_count_history(connection):
+    """Archived hourly counts, in the live database and every history partition."""
+    import history
+    from model import ProductionHourlyCountHistory
+    table = ProductionHourlyCountHistory.__table__
+    table.create(connection, checkfirst=True)
+    create_indexes(connection, table)
+    history.upgrade_partitions()
+
+
+@migration
+def add_order_entry_autoincrement(connection):
+    """
+    Order and production entry ids are never reused, so archived ids stay
+    unique in history: the tables get AUTOINCREMENT, which needs a rebuild,
+    and their sequences start above every id archived so far.
+    """
+    import history
+    from change_log import create_triggers
+    from model import Order, ProductionEntry
+    for model, history_table in ((Order, 'order_history'), (ProductionEntry, 'production_entry_history')):
+        table = model.__table__
+        if 'AUTOINCREMENT' not in (table_sql(connection, table.name) or '').upper():
+            rebuild_table(connection, table)
+        create_indexes(connection, table)
+        create_triggers(connection, [table.name])
+        archived = connection.execute('SELECT max(id) FROM %s' % history_table).scalar() or 0
+        raise_sequence(connection, table.name, max(archived, history.max_id(history_table)))
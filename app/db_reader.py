@@ -0,0 +1,102 @@
+"""
+Read-only engine and session for the pages that only read.
+
+In WAL mode SQLite serves readers next to the one writer, but only on
+connections that are not busy writing. The History views, the exports, the
+dashboard and the reports opt in to `session` (or engine()) and read on a
+pool of their own connections, which cannot write: the database is opened
+with mode=ro where the sqlite3 module supports URIs, and every connection
+also has PRAGMA query_only. Forms, the batch API and the scheduler jobs keep
+db.session.
+
+The reader engine follows the app's database URI, so the tests and the
+benchmarks get one for their database too. Databases that are not a SQLite
+file (e.g. in memory) are read through db.engine.
+"""
+import os
+import sqlite3
+import threading
+from logging import getLogger
+
+from flask import _app_ctx_stack
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from app import app, db
+import db_tuning
+
+LOG = getLogger(__name__)
+
+POOL_SIZE = 5
+
+_lock = threading.Lock()
+# writer database path -> reader engine
+_engines = {}
+
+
+def read_only_pragmas(pragmas):
+    """A profile's PRAGMAs for a reader: no journal or checkpoint changes, no writes."""
+    pragmas = dict((k, v) for k, v in pragmas.items() if k not in ('journal_mode', 'wal_autocheckpoint'))
+    pragmas['query_only'] = 'ON'
+    return pragmas
+
+
+def connect_read_only(path):
+    """A sqlite3 connection that cannot write to `path`, shared between the pool's threads."""
+    try:
+        return sqlite3.connect('file:%s?mode=ro' % path, uri=True, check_same_thread=False)
+    except TypeError:
+        # No URI filenames in this sqlite3 module, query_only does it alone.
+        return sqlite3.connect(path, check_same_thread=False)
+
+
+def _create_engine(path):
+    engine = create_engine(
+        'sqlite:///' + path, creator=lambda: connect_read_only(path), poolclass=QueuePool,
+        pool_size=app.config.get('SQLITE_READER_POOL_SIZE', POOL_SIZE), max_overflow=POOL_SIZE
+    )
+    name, pragmas = db_tuning.profile_pragmas(app.config)
+    db_tuning.configure(engine, '%s, read-only' % name, read_only_pragmas(pragmas))
+    LOG.info('Read-only engine for %s', path)
+    return engine
+
+
+def engine():
+    """The reader engine of the app's current database."""
+    writer = db.engine
+    path = writer.url.database
+    if writer.dialect.name != 'sqlite' or not path or path == ':memory:' or not os.path.exists(path):
+        return writer
+
+    reader = _engines.get(path)
+    if reader is None:
+        with _lock:
+            reader = _engines.get(path)
+            if reader is None:
+                reader = _engines[path] = _create_engine(path)
+    return reader
+
+
+def dispose():
+    with _lock:
+        for reader in _engines.values():
+            reader.dispose()
+        _engines.clear()
+
+
+class ReaderSession(Session):
+    """A session bound to the reader engine of the app's database, whatever the mapper."""
+
+    def get_bind(self, mapper=None, clause=None):
+        return engine()
+
+
+# Scoped like db.session and removed with the app context.
+session = scoped_session(sessionmaker(class_=ReaderSession, autoflush=False),
+                         scopefunc=_app_ctx_stack.__ident_func__)
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    session.remove()
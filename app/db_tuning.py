@@ -0,0 +1,207 @@
+"""
+SQLite settings of the app's engines, and WAL checkpoints.
+
+The PRAGMAs of every new connection come from a named profile of the
+config (SQLITE_PROFILES, the one in use named by SQLITE_PROFILE):
+
+    safe       WAL with synchronous=NORMAL. A crash of the app loses
+               nothing, a power cut at most the last commits, never the file.
+    fast       synchronous=OFF, as the app ran before: a power cut can
+               corrupt the database.
+    bulk-load  fast with big caches and no automatic checkpoints, for
+               imports and archive runs; the checkpointer keeps the WAL down,
+               configure() starts it whatever the entry point (server, CLI
+               command, script).
+
+TunedSQLAlchemy applies the profile to each engine Flask-SQLAlchemy makes,
+whatever the database URI (tests and benchmarks switch it).
+
+A long read (a history export, a report) keeps SQLite from recycling the
+WAL, so it grows past wal_autocheckpoint. WalCheckpointer watches its size
+from a daemon thread: over WAL_CHECKPOINT_PASSIVE_BYTES it copies what the
+readers allow back into the database, over WAL_CHECKPOINT_TRUNCATE_BYTES it
+also tries to empty the file. It never waits on the readers or the writer.
+"""
+import os
+import threading
+import sqlite3
+from logging import getLogger
+from weakref import WeakKeyDictionary
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+
+LOG = getLogger(__name__)
+
+DEFAULT_PROFILE = 'safe'
+# journal_mode waits for busy_timeout, the rest go in this order after it.
+PRAGMA_ORDER = (
+    'busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+    'temp_store', 'wal_autocheckpoint', 'foreign_keys', 'query_only'
+)
+
+# PRAGMAs that read back as numbers, by value.
+PRAGMA_NAMES = {
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY')
+}
+
+# engine -> name of the profile applied to it
+_engines = WeakKeyDictionary()
+
+
+def profile_pragmas(config, name=None):
+    """(name, PRAGMAs) of a config profile, the config's SQLITE_PROFILE by default."""
+    name = name or config.get('SQLITE_PROFILE') or DEFAULT_PROFILE
+    profiles = config.get('SQLITE_PROFILES')
+    if not profiles:
+        # No profiles configured, SQLite's own defaults.
+        return None, {}
+    if name not in profiles:
+        raise ValueError('Unknown SQLite profile %r, expected one of %s' % (name, ', '.join(sorted(profiles))))
+    pragmas = profiles[name]
+    unknown = set(pragmas) - set(PRAGMA_ORDER)
+    if unknown:
+        raise ValueError('Unsupported PRAGMA(s) in SQLite profile %r: %s' % (name, ', '.join(sorted(unknown))))
+    return name, pragmas
+
+
+def pragma_statements(pragmas):
+    return ['PRAGMA %s=%s' % (p, pragmas[p]) for p in PRAGMA_ORDER if p in pragmas]
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for statement in pragma_statements(pragmas):
+            cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+def configure(engine, name, pragmas):
+    """Run a profile's PRAGMAs on every new connection of a SQLite engine, once per engine."""
+    if engine.dialect.name != 'sqlite' or engine in _engines:
+        return
+    _engines[engine] = name
+
+    def set_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+    event.listen(engine, 'connect', set_pragmas)
+
+    database = engine.url.database
+    if str(pragmas.get('wal_autocheckpoint')) == '0' and database and database != ':memory:':
+        # Nothing else checkpoints the WAL of this engine.
+        checkpointer.start(database)
+
+
+def profile_of(engine):
+    return _engines.get(engine)
+
+
+class TunedSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose engines get the SQLite profile of the app config."""
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(TunedSQLAlchemy, self).get_engine(app, bind)
+        if engine not in _engines:
+            configure(engine, *profile_pragmas(self.get_app(app).config))
+        return engine
+
+
+def report(engine):
+    """(PRAGMA, effective value) of a connection of the engine, in PRAGMA_ORDER."""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        settings = []
+        for pragma in PRAGMA_ORDER:
+            row = cursor.execute('PRAGMA %s' % pragma).fetchone()
+            value = row[0] if row else None
+            if pragma in PRAGMA_NAMES and value in range(len(PRAGMA_NAMES[pragma])):
+                value = PRAGMA_NAMES[pragma][value]
+            settings.append((pragma, value))
+        cursor.close()
+        return settings
+    finally:
+        connection.close()
+
+
+########################## WAL checkpoints ##########################
+def wal_size(database):
+    try:
+        return os.path.getsize(database + '-wal')
+    except OSError:
+        return 0
+
+
+def checkpoint(database, mode='PASSIVE'):
+    """
+    Run wal_checkpoint(mode) on a connection of its own that does not wait
+    for locks, returns (busy, WAL pages, pages checkpointed).
+    """
+    connection = sqlite3.connect(database, timeout=0)
+    try:
+        return tuple(connection.execute('PRAGMA wal_checkpoint(%s)' % mode).fetchone())
+    finally:
+        connection.close()
+
+
+class WalCheckpointer(object):
+    """
+    Checkpoints the WAL of a database file from a daemon thread when it has
+    grown over passive_bytes / truncate_bytes, checking every `interval`
+    seconds. The thread is started by start().
+    """
+    def __init__(self, interval=30, passive_bytes=16 << 20, truncate_bytes=64 << 20):
+        self.interval = interval
+        self.passive_bytes = passive_bytes
+        self.truncate_bytes = truncate_bytes
+        self.database = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, database):
+        with self._lock:
+            self.database = database
+            self._stop.clear()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='wal-checkpointer')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        """One size check, returns (mode, result) of the checkpoint run or None."""
+        database = self.database
+        size = wal_size(database) if database else 0
+        if self.truncate_bytes and size > self.truncate_bytes:
+            mode = 'TRUNCATE'
+        elif self.passive_bytes and size > self.passive_bytes:
+            mode = 'PASSIVE'
+        else:
+            return None
+
+        try:
+            result = checkpoint(database, mode)
+        except sqlite3.Error as ex:
+            # Busy in TRUNCATE or the file went away, next time.
+            LOG.warning('WAL checkpoint(%s) of %s failed: %s', mode, database, ex)
+            return None
+        LOG.info('WAL checkpoint(%s) of %s (%d bytes): busy=%d, %d/%d pages', mode, database, size,
+                 result[0], result[2], result[1])
+        return mode, result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                LOG.exception('WAL checkpointer failed')
+
+
+checkpointer = WalCheckpointer()
@@ -0,0 +1,111 @@
+"""
+Streaming CSV / NDJSON exports.
+
+Rows are read in batches of EXPORT_BATCH and written out as they come, so
+an export of the whole history holds one batch in memory and its first
+bytes leave before the query is done. Used by the /api/export/<table>
+endpoint and by the admin views with export_streaming.
+"""
+import csv
+import json
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from sqlalchemy import select
+
+EXPORT_BATCH = 1000
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def export_tables():
+    """Tables of /api/export by name."""
+    from model import (OrderHistoryAll, ProductionEntryHistoryAll, ProductionEntry,
+                       ProductionHourlyCount)
+    return {
+        'order_history': OrderHistoryAll.__table__,
+        'production_entry_history': ProductionEntryHistoryAll.__table__,
+        'production_entry': ProductionEntry.__table__,
+        'production_hourly_count': ProductionHourlyCount.__table__
+    }
+
+
+def _value(value):
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    # Related models and the like, as the admin shows them.
+    return unicode(value)
+
+
+class _Echo(object):
+    """File-like object whose write() hands the line back to the csv writer's caller."""
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    value = _value(value)
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def csv_lines(columns, rows):
+    """A header line and one CSV line per row."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow([_cell(c) for c in columns])
+    for row in rows:
+        yield writer.writerow([_cell(v) for v in row])
+
+
+def ndjson_lines(columns, rows):
+    """One JSON object per row and line."""
+    for row in rows:
+        yield json.dumps(dict(zip(columns, [_value(v) for v in row]))) + '\n'
+
+
+def lines(fmt, columns, rows):
+    return csv_lines(columns, rows) if fmt == 'csv' else ndjson_lines(columns, rows)
+
+
+def gzipped(chunks, batch=EXPORT_BATCH):
+    """Gzip a stream of strings, flushing every `batch` chunks so it keeps flowing."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for n, chunk in enumerate(chunks):
+        data = compressor.compress(chunk)
+        if n % batch == 0:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def fetch_batches(result, batch=EXPORT_BATCH):
+    """Rows of a result, fetched `batch` at a time."""
+    try:
+        while True:
+            rows = result.fetchmany(batch)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        result.close()
+
+
+def stream_table(engine, table, fmt='csv'):
+    """Lines of a whole table in primary key order, read on its own connection."""
+    columns = [c.name for c in table.columns]
+    query = select([table]).order_by(*table.primary_key.columns)
+    connection = engine.connect()
+    try:
+        for line in lines(fmt, columns, fetch_batches(connection.execute(query))):
+            yield line
+    finally:
+        connection.close()
@@ -0,0 +1,102 @@
+"""
+Formatted list cells of the admin views.
+
+Rendering a list page runs the column formatters (color boxes, thumbnails,
+entry links, ...) of every cell again although most rows did not change
+since the last render. The cells are kept here per row, for the view, the
+roles of the user and the column:
+
+    (table, pk) -> {(endpoint, roles, column): (version, value)}
+
+A cell is reused while its version is the same. The version is the row's
+updated_at, when it has one, with the change generations (see changes.py)
+of its table and of the tables its cells read, e.g. the product and colors
+of an order. The whole row is dropped when the ORM updates or deletes it,
+and the least recently used rows go first over MAX_ROWS.
+
+Cells must not depend on the time of the render; timestamp_formatter leaves
+"x ago" to the browser for that.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from jinja2 import Markup
+from sqlalchemy import event, inspect
+
+from app import db
+
+MAX_ROWS = 5000
+
+# What get() returns for a cell it does not have.
+MISSING = object()
+
+_lock = threading.Lock()
+_rows = OrderedDict()
+
+
+def clear():
+    with _lock:
+        _rows.clear()
+
+
+def size():
+    return len(_rows)
+
+
+def get(row_key, cell_key, version):
+    """Cached value of a cell, MISSING if there is none of that version."""
+    with _lock:
+        cells = _rows.get(row_key)
+        if cells is None:
+            return MISSING
+        _rows[row_key] = _rows.pop(row_key)
+        cached = cells.get(cell_key)
+    if cached is None or cached[0] != version:
+        return MISSING
+    return cached[1]
+
+
+def put(row_key, cell_key, version, value):
+    with _lock:
+        cells = _rows.pop(row_key, None) or {}
+        cells[cell_key] = (version, value)
+        _rows[row_key] = cells
+        while len(_rows) > MAX_ROWS:
+            _rows.popitem(last=False)
+
+
+def evict(row_key):
+    with _lock:
+        _rows.pop(row_key, None)
+
+
+def cacheable(value):
+    """
+    A value that outlives the request: markup and plain values as they are,
+    anything else (a related model, ...) as the escaped text it renders to.
+    """
+    if value is None or isinstance(value, (Markup, basestring, bool, int, long, float,
+                                           Decimal, date, datetime, time)):
+        return value
+    return Markup.escape(unicode(value))
+
+
+def row_key(model):
+    """(table, primary key) of a loaded model, None for a pending one."""
+    state = inspect(model)
+    if state.identity is None:
+        return None
+    identity = state.identity
+    return (state.mapper.local_table.name, identity[0] if len(identity) == 1 else identity)
+
+
+def _evict_row(mapper, connection, target):
+    key = row_key(target)
+    if key is not None:
+        evict(key)
+
+
+event.listen(db.Model, 'after_update', _evict_row, propagate=True)
+event.listen(db.Model, 'after_delete', _evict_row, propagate=True)
@@ -0,0 +1,247 @@
+"""
+Per-year history partitions.
+
+Archived orders, production entries and their hourly counts are moved out
+of the live database
+into history-YYYY.db files in HISTORY_DIR, by the year the order finished
+(see scheduler.archive_orders). The live database, its page cache and its
+backups only keep what is in use.
+
+Every pooled connection attaches the partition files as history_YYYY when
+it is checked out and gets TEMP views spanning all of them:
+
+    order_history_all, production_entry_history_all, production_hourly_count_all
+
+each the UNION ALL of the partitions, the history tables of the live
+database (rows archived before partitioning) and the COMPLETED orders not
+archived yet; production_hourly_count_all has the hourly counts of every
+live entry too. The History admin views read them through the read-only
+OrderHistoryAll / ProductionEntryHistoryAll models, the production reports
+through ProductionHourlyCountAll.
+
+SQLite attaches at most 10 databases to a connection, so only the most
+recent MAX_ATTACHED years are visible through the views.
+"""
+import os
+import re
+import sqlite3
+import threading
+from logging import getLogger
+
+from sqlalchemy import event
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.pool import Pool
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+LOG = getLogger(__name__)
+
+MAX_ATTACHED = 10
+
+ORDER_HISTORY_COLUMNS = (
+    'id', 'name', 'quantity', 'product_id', 'product_name', 'raw_material_quantity',
+    'estimated_time_to_complete', 'machine_id', 'machine_name', 'photo',
+    'order_created_at', 'production_start_at', 'production_end_at', 'note'
+)
+
+ENTRY_HISTORY_COLUMNS = (
+    'id', 'date', 'shift_name', 'order_id', 'lead', 'assemblers', 'num_hourly_good',
+    'num_hourly_bad', 'num_good', 'num_bad', 'machine_id', 'photo'
+)
+
+# Live orders and entries in the shape of the history tables, in
+# ORDER_HISTORY_COLUMNS / ENTRY_HISTORY_COLUMNS order.
+LIVE_ORDER_HISTORY = """
+SELECT o.id, o.name, o.quantity, o.product_id, p.name, CAST(o.raw_material_quantity AS INTEGER),
+       o.estimated_time_to_complete, o.assigned_machine_id, m.name, p.photo,
+       o.created_at, o.production_start_at, o.production_end_at, o.note
+FROM main."order" o
+JOIN main.product p ON p.id = o.product_id
+LEFT JOIN main.machine m ON m.id = o.assigned_machine_id
+"""
+
+LIVE_ENTRY_HISTORY = """
+SELECT e.id, e.date, s.name, e.order_id, lead.name,
+       COALESCE((SELECT group_concat(a.name, ',')
+                 FROM main.users_production_entries upe
+                 JOIN main.user a ON a.id = upe.user_id
+                 WHERE upe.production_entry_id = e.id), ''),
+       e.num_hourly_good, e.num_hourly_bad, e.num_good, e.num_bad, o.assigned_machine_id, p.photo
+FROM main.production_entry e
+JOIN main."order" o ON o.id = e.order_id
+JOIN main.product p ON p.id = o.product_id
+JOIN main.shift s ON s.id = e.shift_id
+LEFT JOIN main.user lead ON lead.id = e.user_id
+"""
+
+HOURLY_HISTORY_COLUMNS = (
+    'entry_id', 'hour_index', 'date', 'shift_id', 'machine_id', 'good', 'bad', 'damage'
+)
+
+LIVE_HOURLY_HISTORY = """
+SELECT h.entry_id, h.hour_index, e.date, e.shift_id, o.assigned_machine_id, h.good, h.bad, h.damage
+FROM main.production_hourly_count h
+JOIN main.production_entry e ON e.id = h.entry_id
+JOIN main."order" o ON o.id = e.order_id
+"""
+
+_directory = None
+_lock = threading.Lock()
+_years = (None, ())
+
+PARTITION_FILE = re.compile(r'^history-(\d{4})\.db$')
+
+
+def set_directory(path):
+    """Keep history partitions in `path`, None keeps history in the live database."""
+    global _directory, _years
+    _directory = path
+    _years = (None, ())
+
+
+def enabled():
+    return _directory is not None
+
+
+def partition_path(year):
+    return os.path.join(_directory, 'history-%d.db' % int(year))
+
+
+def partition_schema(year):
+    return 'history_%d' % int(year)
+
+
+def years():
+    """Years with a partition file, oldest first."""
+    global _years
+    try:
+        stamp = os.stat(_directory).st_mtime
+    except (OSError, TypeError):
+        return ()
+    if _years[0] != stamp:
+        found = sorted(int(m.group(1)) for m in map(PARTITION_FILE.match, os.listdir(_directory)) if m)
+        _years = (stamp, tuple(found))
+    return _years[1]
+
+
+def _history_tables():
+    from model import OrderHistory, ProductionEntryHistory, ProductionHourlyCountHistory
+    return [OrderHistory.__table__, ProductionEntryHistory.__table__, ProductionHourlyCountHistory.__table__]
+
+
+def _create_tables(connection, existing=()):
+    dialect = sqlite.dialect()
+    for table in _history_tables():
+        if table.name in existing:
+            continue
+        connection.execute(str(CreateTable(table).compile(dialect=dialect)))
+        for index in table.indexes:
+            connection.execute(str(CreateIndex(index).compile(dialect=dialect)))
+
+
+def ensure_partition(year):
+    """Create the partition file of a year, with the history tables, if missing."""
+    global _years
+    path = partition_path(year)
+    with _lock:
+        if os.path.exists(path):
+            return path
+        if not os.path.isdir(_directory):
+            os.makedirs(_directory)
+
+        tmp_path = path + '.tmp'
+        connection = sqlite3.connect(tmp_path)
+        try:
+            _create_tables(connection)
+            connection.commit()
+        finally:
+            connection.close()
+        # Appear complete or not at all to the other processes.
+        os.rename(tmp_path, path)
+        _years = (None, ())
+        LOG.info('Created history partition %s', path)
+    return path
+
+
+def upgrade_partitions():
+    """Add the history tables missing from the partitions made by an older version."""
+    upgraded = []
+    with _lock:
+        for year in years():
+            connection = sqlite3.connect(partition_path(year))
+            try:
+                existing = set(row[0] for row in
+                               connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+                if set(t.name for t in _history_tables()) - existing:
+                    _create_tables(connection, existing)
+                    connection.commit()
+                    upgraded.append(year)
+            finally:
+                connection.close()
+    return upgraded
+
+
+def max_id(table):
+    """The highest id of a history table over all partitions, 0 when empty."""
+    high = 0
+    for year in years():
+        connection = sqlite3.connect(partition_path(year))
+        try:
+            high = max(high, connection.execute('SELECT max(id) FROM %s' % table).fetchone()[0] or 0)
+        finally:
+            connection.close()
+    return high
+
+
+def _view_sql(name, table, columns, live, attached):
+    columns = ', '.join(columns)
+    parts = ['SELECT %s FROM main.%s' % (columns, table)]
+    parts.extend('SELECT %s FROM %s.%s' % (columns, partition_schema(y), table) for y in attached)
+    parts.append(live)
+    return 'CREATE TEMP VIEW %s AS %s' % (name, '\nUNION ALL\n'.join(parts))
+
+
+def attach_partitions(dbapi_connection, connection_record, *args):
+    """Attach new partitions to a pooled connection and (re)build its TEMP views."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    current = years()[-MAX_ATTACHED:]
+    if connection_record.info.get('history_years') == current:
+        return
+
+    cursor = dbapi_connection.cursor()
+    # The TEMP views are writes too for a query_only reader (see db_reader.py).
+    query_only = cursor.execute('PRAGMA query_only').fetchone()[0]
+    try:
+        if query_only:
+            cursor.execute('PRAGMA query_only=OFF')
+        schemas = set(row[1] for row in cursor.execute('PRAGMA database_list'))
+        cursor.execute('DROP VIEW IF EXISTS temp.order_history_all')
+        cursor.execute('DROP VIEW IF EXISTS temp.production_entry_history_all')
+        cursor.execute('DROP VIEW IF EXISTS temp.production_hourly_count_all')
+        for schema in schemas - set(partition_schema(y) for y in current):
+            if schema.startswith('history_'):
+                cursor.execute('DETACH DATABASE %s' % schema)
+        for year in current:
+            if partition_schema(year) not in schemas:
+                cursor.execute('ATTACH DATABASE ? AS %s' % partition_schema(year), (partition_path(year),))
+
+        completed = " WHERE o.status = 'COMPLETED'"
+        cursor.execute(_view_sql('order_history_all', 'order_history',
+                                 ORDER_HISTORY_COLUMNS, LIVE_ORDER_HISTORY + completed, current))
+        cursor.execute(_view_sql('production_entry_history_all', 'production_entry_history',
+                                 ENTRY_HISTORY_COLUMNS, LIVE_ENTRY_HISTORY + completed, current))
+        cursor.execute(_view_sql('production_hourly_count_all', 'production_hourly_count_history',
+                                 HOURLY_HISTORY_COLUMNS, LIVE_HOURLY_HISTORY, current))
+        connection_record.info['history_years'] = current
+    except sqlite3.DatabaseError as ex:
+        # Not (yet) this app's schema, e.g. a new file before create_all().
+        LOG.debug('History partitions not attached: %s', ex)
+        connection_record.info.pop('history_years', None)
+    finally:
+        if query_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+
+event.listen(Pool, 'checkout', attach_partitions)
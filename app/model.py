@@ -1,32 +1,43 @@
 import enum
-import random
 import calendar
+from contextlib import contextmanager
 
 from app import db
 from sqlalchemy import Column, Integer, String, Date, Time
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship, column_property, scoped_session, sessionmaker, sessionmaker
-from sqlalchemy import select, func, and_, event, UniqueConstraint
+from sqlalchemy.orm import relationship, column_property, scoped_session, sessionmaker, sessionmaker, object_session, Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy import select, func, and_, or_, event, inspect, UniqueConstraint, MetaData
+from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, date, timedelta
 from sqlalchemy_utils import ColorType
 from flask_security import UserMixin, RoleMixin
 from flask import flash
 from flask_admin.babel import gettext
 from sqlalchemy.sql.expression import true
-from util import slot_lead_to_machine, num_estimate_per_shift
+from util import num_estimate_per_shift
+import changes
+# The change_log table and its triggers are created with the models.
+import change_log
 
 ########################### Flask Security Models ######################
 roles_users = db.Table(
     'roles_users',
     db.Column('user_id', db.Integer(), db.ForeignKey('user.id')),
-    db.Column('role_id', db.Integer(), db.ForeignKey('role.id'))
+    db.Column('role_id', db.Integer(), db.ForeignKey('role.id')),
+    # Users of a role without reading the table, see staff_cache.py.
+    db.Index('ix_roles_users_role_user', 'role_id', 'user_id'),
+    # Roles of the current user, loaded on every request.
+    db.Index('ix_roles_users_user_role', 'user_id', 'role_id')
 )
 
 # m-m User-to-ProductionEntry mapping for assembler role only
 users_production_entries_table = db.Table(
     'users_production_entries',
     Column('user_id', Integer, db.ForeignKey('user.id')),
-    Column('production_entry_id', Integer, db.ForeignKey('production_entry.id'))
+    Column('production_entry_id', Integer, db.ForeignKey('production_entry.id')),
+    db.Index('ix_users_production_entries_entry_user', 'production_entry_id', 'user_id')
 )
 
 class Role(db.Model, RoleMixin):
@@ -61,6 +72,9 @@ class User(db.Model, UserMixin):
     def __str__(self):
         return self.name
 
+# Case-insensitive name order and LIKE 'prefix%' lookups.
+db.Index('ix_user_name_nocase', User.name.collate('NOCASE'))
+
 
 ############################ Cedar Models ##########################    
 class Base(db.Model):
@@ -136,7 +150,8 @@ product_colors_table = db.Table(
     'product_color',
     db.Model.metadata,
     db.Column('product_id', db.String, db.ForeignKey('product.id')),
-    db.Column('color_id', db.String, db.ForeignKey('color.id'))
+    db.Column('color_id', db.String, db.ForeignKey('color.id')),
+    db.Index('ix_product_color_product_color', 'product_id', 'color_id')
 )
 
 
@@ -164,7 +179,7 @@ class ProductionEntry(db.Model):
     id = db.Column(db.Integer, primary_key = True, autoincrement=True)
     shift_id = db.Column(db.Integer, db.ForeignKey(Shift.id), nullable=False)
     shift = db.relationship(Shift, backref='production_entry_shift')
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
     order = db.relationship('Order', backref='production_entry_orders')
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     lead = db.relationship(User)
@@ -179,6 +194,9 @@ class ProductionEntry(db.Model):
     num_bad = db.Column(db.Integer, default=0)
     date = Column(Date, default=date.today())
     members = db.relationship(User, secondary=users_production_entries_table)
+    # Reports by date range, then shift. AUTOINCREMENT: an archived entry's id
+    # is never handed out again, it stays unique in history.
+    __table_args__ = (db.Index('ix_production_entry_date_shift', 'date', 'shift_id'), {'sqlite_autoincrement': True})
     
     @hybrid_property
     def machine_id(self):
@@ -206,6 +224,23 @@ class ProductionEntry(db.Model):
         # return super(ProductionEntry, self).save(*args, **kwargs)
 
 
+class ProductionHourlyCount(db.Model):
+    """Per hour counts of a ProductionEntry, derived from its num_hourly_* strings on save."""
+    __tablename__ = 'production_hourly_count'
+    entry_id = db.Column(db.Integer, db.ForeignKey('production_entry.id', ondelete='CASCADE'), primary_key=True)
+    hour_index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    good = db.Column(db.Integer, nullable=False, default=0)
+    bad = db.Column(db.Integer, nullable=False, default=0)
+    damage = db.Column(db.Integer, nullable=False, default=0)
+    # Covers the entry -> hours lookup of the GROUP BY reports without touching the table.
+    __table_args__ = (
+        db.Index('ix_production_hourly_count_entry_counts', 'entry_id', 'hour_index', 'good', 'bad', 'damage'),
+    )
+
+    def __repr__(self):
+        return '%d - %d' % (self.entry_id, self.hour_index)
+
+
 class Order(db.Model):
     """Order table ORM mapping"""
     __tablename__ = 'order'
@@ -213,7 +248,7 @@ class Order(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
     name = db.Column(db.String, nullable=False, index=True)
-    status = db.Column(db.Enum('NEW', 'IN_PROGRESS', 'COMPLETED'), nullable=False, default='NEW')
+    status = db.Column(db.Enum('NEW', 'IN_PROGRESS', 'COMPLETED'), nullable=False, default='NEW', index=True)
     quantity = db.Column(db.Integer, nullable=False, default=0)
     product_id = db.Column(db.Integer, db.ForeignKey(Product.id), nullable=False)
     product = db.relationship(Product, backref='product')
@@ -225,16 +260,15 @@ class Order(db.Model):
     assigned_machine_id = db.Column(db.Integer, db.ForeignKey(Machine.id))
     # NOTE: backref name MUST be unique between relationships.
     assigned_machine = db.relationship(Machine, backref=db.backref('order_to_machine'))
-    completed = column_property(
-        select([func.sum(ProductionEntry.num_good)]).\
-            where(ProductionEntry.order_id==id).\
-            correlate_except(ProductionEntry)
-    )
-    total_bad = column_property(
-        select([func.sum(ProductionEntry.num_bad)]).\
-            where(ProductionEntry.order_id==id).\
-            correlate_except(ProductionEntry)
-    )
+    # Progress counters, maintained by the ProductionEntry triggers below.
+    completed = db.Column(db.Integer, nullable=False, default=0, index=True)
+    total_bad = db.Column(db.Integer, nullable=False, default=0)
+    # Order strips of the machine list: open orders of some machines.
+    # AUTOINCREMENT: an archived order's id is never handed out again.
+    __table_args__ = (db.Index('ix_order_machine_status', 'assigned_machine_id', 'status'), {'sqlite_autoincrement': True})
+
+    # Filter with status.in_(ACTIVE_STATUSES): SQLite cannot search an index for !=.
+    ACTIVE_STATUSES = ('NEW', 'IN_PROGRESS')
 
     def __repr__(self):
         return '%d - %s - %s' % (self.id, self.name, self.status)
@@ -257,6 +291,25 @@ class TeamRequest(Base):
     start_date = db.Column(db.Date, default=(date.today() + timedelta(days=1)), nullable=False)
     end_date = db.Column(db.Date, default=(date.today() + timedelta(days=1)), nullable=False)
     day_off = db.Column(db.String(25))
+    # Team generation job, run in the background by roster.worker.
+    status = db.Column(db.Enum('PENDING', 'RUNNING', 'DONE', 'FAILED'), default='PENDING', nullable=False, index=True)
+    num_days = db.Column(db.Integer, default=0, nullable=False)
+    num_days_done = db.Column(db.Integer, default=0, nullable=False)
+    num_teams = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String)
+    # host:pid of the worker running it and its last sign of life.
+    worker_id = db.Column(db.String)
+    heartbeat_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            status=self.status,
+            num_days=self.num_days,
+            num_days_done=self.num_days_done,
+            num_teams=self.num_teams,
+            error=self.error
+        )
     
     def __repr__(self):
         return '%s - %s' % (self.start_date, self.end_date)
@@ -266,13 +319,15 @@ class TeamRequest(Base):
 user_team_table = db.Table(
     'user_team',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('team_id', db.Integer, db.ForeignKey('team.id'))
+    db.Column('team_id', db.Integer, db.ForeignKey('team.id')),
+    db.Index('ix_user_team_team_user', 'team_id', 'user_id')
 )
 
 user_team_standbys_table = db.Table(
     'user_team_standbys',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('team_id', db.Integer, db.ForeignKey('team.id'))
+    db.Column('team_id', db.Integer, db.ForeignKey('team.id')),
+    db.Index('ix_user_team_standbys_team_user', 'team_id', 'user_id')
 )
 
 class Team(Base):
@@ -286,7 +341,7 @@ class Team(Base):
     lead = db.relationship(User)
     members = db.relationship(User, secondary=user_team_table)
     standbys = db.relationship(User, secondary=user_team_standbys_table)
-    #__table_args__ = (UniqueConstraint('date', 'shift_id', 'machine_id', name='_date_shift_machine_uc'),)
+    __table_args__ = (db.Index('ux_team_date_shift_machine', 'date', 'shift_id', 'machine_id', unique=True),)
     
     def __repr__(self):
         return '%d - %s - %s' % (self.id, self.shift.name, self.date)
@@ -335,48 +390,231 @@ def before_order_update(mapper, connection, target):
     calculate_order_details(target)
 
 
+def parse_hourly(value):
+    """'10,20,30' -> [10, 20, 30]"""
+    if not value or not value.strip():
+        return []
+    return [int(x) for x in value.split(',')]
+
+
+HOURLY_ATTRS = ('num_hourly_good', 'num_hourly_bad', 'num_hourly_damage')
+
+
+def hourly_changed(target):
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in HOURLY_ATTRS)
+
+
+def calculate_entry_totals(target):
+    good = parse_hourly(target.num_hourly_good)
+    bad = parse_hourly(target.num_hourly_bad)
+    damage = parse_hourly(target.num_hourly_damage)
+    if good:
+        target.num_good = sum(good)
+    if bad or damage:
+        target.num_bad = sum(bad) + sum(damage)
+
+
+def hourly_count_rows(entry_id, num_hourly_good, num_hourly_bad, num_hourly_damage):
+    good = parse_hourly(num_hourly_good)
+    bad = parse_hourly(num_hourly_bad)
+    damage = parse_hourly(num_hourly_damage)
+    at = lambda values, i: values[i] if i < len(values) else 0
+    return [
+        dict(entry_id=entry_id, hour_index=i, good=at(good, i), bad=at(bad, i), damage=at(damage, i))
+        for i in range(max(len(good), len(bad), len(damage)))
+    ]
+
+
+def save_hourly_counts(connection, entries):
+    """Replace the production_hourly_count rows of the given ProductionEntries."""
+    table = ProductionHourlyCount.__table__
+    entry_ids = [e.id for e in entries]
+    if not entry_ids:
+        return
+    rows = []
+    for e in entries:
+        rows.extend(hourly_count_rows(e.id, e.num_hourly_good, e.num_hourly_bad, e.num_hourly_damage))
+
+    connection.execute(table.delete().where(table.c.entry_id.in_(entry_ids)))
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
 @listens_for(ProductionEntry, 'before_update')
 def before_productionentry_update(mapper, connection, target):
     print "========== before production entry update ========="
-    if target.num_hourly_good:
-        num_good = sum([int(x) for x in target.num_hourly_good.split(',')])
-        target.num_good = num_good
-    
-    if target.num_hourly_bad:
-        num_bad = sum([int(x) for x in target.num_hourly_bad.split(',')])
-        target.num_bad = num_bad
-
-    if target.num_hourly_damage:
-        num_bad = sum([int(x) for x in target.num_hourly_damage.split(',')])
-        if target.num_bad and target.num_bad > 0:
-            target.num_bad += num_bad
-        else:
-            target.num_bad = num_bad
-            
+    if hourly_changed(target):
+        calculate_entry_totals(target)
+
+
+def progress_order_ids(target):
+    """Orders whose counters a ProductionEntry change affects."""
+    order_ids = set([target.order_id])
+    # An entry moved to another order also changes the old one.
+    order_ids.update(inspect(target).attrs.order_id.history.deleted)
+    order_ids.discard(None)
+    return order_ids
+
+
+def refresh_order_progress(connection, order_ids=None):
+    """
+    Recompute the stored completed/total_bad counters from production_entry.
+    All orders are rebuilt when `order_ids` is None.
+    """
+    order_table = Order.__table__
+    entry_table = ProductionEntry.__table__
+    sums = lambda column: select([func.coalesce(func.sum(column), 0)]).\
+        where(entry_table.c.order_id == order_table.c.id).as_scalar()
+    stmt = order_table.update().values(
+        completed=sums(entry_table.c.num_good),
+        total_bad=sums(entry_table.c.num_bad),
+        updated_at=func.current_timestamp()
+    )
+    if order_ids is not None:
+        if not order_ids:
+            return 0
+        stmt = stmt.where(order_table.c.id.in_(order_ids))
+    return connection.execute(stmt).rowcount
+
+
+def order_progress_mismatches(connection):
+    """(id, completed, total_bad, actual completed, actual total_bad) for every order whose counters are off."""
+    order_table = Order.__table__
+    entry_table = ProductionEntry.__table__
+    actual = select([
+        entry_table.c.order_id,
+        func.sum(entry_table.c.num_good).label('completed'),
+        func.sum(entry_table.c.num_bad).label('total_bad')
+    ]).group_by(entry_table.c.order_id).alias('actual')
+    actual_completed = func.coalesce(actual.c.completed, 0)
+    actual_total_bad = func.coalesce(actual.c.total_bad, 0)
+    stmt = select([
+        order_table.c.id, order_table.c.completed, order_table.c.total_bad,
+        actual_completed, actual_total_bad
+    ]).select_from(
+        order_table.outerjoin(actual, actual.c.order_id == order_table.c.id)
+    ).where(or_(
+        order_table.c.completed != actual_completed,
+        order_table.c.total_bad != actual_total_bad
+    ))
+    return connection.execute(stmt).fetchall()
+
+
+def complete_finished_orders(connection, order_ids):
+    order_table = Order.__table__
+    return connection.execute(
+        order_table.update().
+        where(and_(
+            order_table.c.id.in_(order_ids),
+            order_table.c.status != 'COMPLETED',
+            order_table.c.quantity - order_table.c.completed <= 0
+        )).
+        values(status='COMPLETED', production_end_at=datetime.now())
+    ).rowcount
+
+
+def sync_order_progress(session, connection, order_ids):
+    """Copy the counters written with plain SQL onto Orders already loaded in the session."""
+    changes.touch(session, Order.__tablename__)
+    order_table = Order.__table__
+    rows = connection.execute(
+        select([
+            order_table.c.id, order_table.c.completed, order_table.c.total_bad,
+            order_table.c.status, order_table.c.production_end_at
+        ]).where(order_table.c.id.in_(order_ids))
+    )
+    for row in rows:
+        order = session.identity_map.get(identity_key(Order, row.id))
+        if order is not None:
+            for name in ('completed', 'total_bad', 'status', 'production_end_at'):
+                set_committed_value(order, name, row[name])
+
+
+DEFERRED_ORDERS = 'deferred_order_progress'
+DEFERRED_ENTRIES = 'deferred_hourly_counts'
+
+
+def _deferred(target, key):
+    session = object_session(target)
+    return session.info.get(key) if session is not None else None
+
+
+def update_order_progress(connection, target, complete=False):
+    deferred = _deferred(target, DEFERRED_ORDERS)
+    if deferred is not None:
+        deferred.update(progress_order_ids(target))
+        return
+
+    order_ids = progress_order_ids(target)
+    refresh_order_progress(connection, order_ids)
+    if complete:
+        complete_finished_orders(connection, order_ids)
+
+    session = object_session(target)
+    if session is not None:
+        sync_order_progress(session, connection, order_ids)
+
+
+def update_hourly_counts(connection, target):
+    deferred = _deferred(target, DEFERRED_ENTRIES)
+    if deferred is not None:
+        deferred.append(target)
+    else:
+        save_hourly_counts(connection, [target])
+
+
+@contextmanager
+def deferred_entry_triggers(session):
+    """
+    Collect the hourly count and order progress work of every ProductionEntry
+    flushed inside the block and run it once, as grouped statements, at the
+    end instead of once per row.
+    """
+    order_ids = session.info[DEFERRED_ORDERS] = set()
+    entries = session.info[DEFERRED_ENTRIES] = []
+    try:
+        yield
+        session.flush()
+        connection = session.connection()
+        save_hourly_counts(connection, entries)
+        if order_ids:
+            refresh_order_progress(connection, order_ids)
+            complete_finished_orders(connection, order_ids)
+            sync_order_progress(session, connection, order_ids)
+    finally:
+        session.info.pop(DEFERRED_ORDERS, None)
+        session.info.pop(DEFERRED_ENTRIES, None)
 
 
 @listens_for(ProductionEntry, 'after_update')
 def after_productionentry_update(mapper, connection, target):
     print "========== after production entry update ========="
-    order = Order.query.get(target.order_id)
-    if order.remaining <= 0:
-        Order.query.filter_by(id=target.order_id).update({ 
-            'status': 'COMPLETED', 
-            'production_end_at': datetime.now() 
-        })
+    if hourly_changed(target):
+        update_hourly_counts(connection, target)
+    update_order_progress(connection, target, complete=True)
+
+
+@listens_for(ProductionEntry, 'after_insert')
+def after_productionentry_insert(mapper, connection, target):
+    update_hourly_counts(connection, target)
+    update_order_progress(connection, target)
+
+
+@listens_for(ProductionEntry, 'after_delete')
+def after_productionentry_delete(mapper, connection, target):
+    table = ProductionHourlyCount.__table__
+    connection.execute(table.delete().where(table.c.entry_id == target.id))
+    update_order_progress(connection, target)
 
 
 @listens_for(ProductionEntry, 'before_insert')
 def before_productionentry_insert(mapper, connection, target):
     print "========== before production entry insert ========="
+    calculate_entry_totals(target)
     order = Order.query.get(target.order_id)
     shift = Shift.query.get(target.shift_id)
-    completed = db.session.query(func.sum(ProductionEntry.num_good)).filter(ProductionEntry.order_id == order.id)
-
-    if completed.scalar() and completed.scalar() > 0: 
-        remaining = order.quantity - completed.scalar()
-    else:
-        remaining = order.quantity 
+    remaining = order.quantity - (order.completed or 0)
 
     if remaining > 0:
         num_estimate, num_raw_bag = num_estimate_per_shift(
@@ -391,89 +629,29 @@ def before_productionentry_insert(mapper, connection, target):
         
  
 
+PENDING_TEAM_REQUESTS = 'pending_team_requests'
+
 @listens_for(TeamRequest, 'after_insert')
 def after_teamrequest_insert(mapper, connection, target):     
     print "============ after team reqeust insert =============="
     print target.day_off, target.start_date, target.end_date
-    txn = connection.begin()
-    Session = sessionmaker()
-    session = Session(bind=connection)
-    teams = []
-    try:
-        machines = session.query(Machine).filter(Machine.status != 'NOT_IN_USE').all()
-        assemblers = session.query(User).filter(and_(User.active == true(), User.roles.any(name='assembler'))).all()
-        random.shuffle(assemblers)
-        leads = session.query(User).filter(and_(User.active == true(), User.roles.any(name='lead'))).all()
-        random.shuffle(leads)
-        shifts = session.query(Shift).all()
-        assembler_map = {}
-        for s in shifts:
-            assembler_map[s.id] = []
-        while assemblers:
-            a = assemblers.pop()
-            assembler_map[a.shift_id].append(a)
-        
-        lead_slot, extra = slot_lead_to_machine(leads, machines)
-        if len(lead_slot) != len(machines):
-            print "Total lead slot does not match with number of machines."
-            return
-        teams = from_start_to_end_date(target.start_date, target.end_date, target.day_off, shifts, machines, assembler_map, lead_slot, extra)
-        if len(teams) > 0:
-            session.add_all(teams)
-            session.commit()
-        txn.commit()
-    except Exception as ex:
-        txn.rollback()
-        flash(gettext('Failed to create teams. %(error)s', error=str(ex)), 'error')
-        print ex
+    # Teams are generated in the background once the request is committed.
+    object_session(target).info.setdefault(PENDING_TEAM_REQUESTS, []).append(target.id)
+
+
+@listens_for(Session, 'after_commit')
+def enqueue_requested_teams(session):
+    request_ids = session.info.pop(PENDING_TEAM_REQUESTS, None)
+    if request_ids:
+        from roster import worker
+        for request_id in request_ids:
+            worker.enqueue(session.get_bind(), request_id)
+
+
+@listens_for(Session, 'after_rollback')
+def discard_requested_teams(session):
+    session.info.pop(PENDING_TEAM_REQUESTS, None)
 
-    finally:
-        txn.close()
-
-
-
-def from_start_to_end_date(start, end, day_off_str, shifts, machines, assembler_map, leader_slot, extra):
-    day_offs = []
-    if day_off_str and len(day_off_str.strip()) > 0:
-        day_offs = [ int(x) for x in day_off_str.split(',') ]
-    teams = []
-    while start <= end:
-        # check current date is in the day offs list
-        if start.weekday() in day_offs:
-            start += timedelta(days=1) 
-            continue
-
-        for s in shifts:
-            m_copy = machines[:]
-            leaders = leader_slot[:]
-            m = m_copy.pop()
-            l = leaders.pop()
-            members = []
-            standbys = []
-            for a in assembler_map[s.id]:
-                if len(members) < int(m.average_num_workers):
-                    members.append(a)
-                elif len(m_copy) > 0:
-                    # Save a team to DB.
-                    t = Team(date=start, shift_id=s.id, machine_id=m.id, user_id=l.id, members=members, standbys=[])
-                    teams.append(t)
-                    m = m_copy.pop()
-                    l = leaders.pop()
-                    members = [a]
-                else:
-                    standbys.append(a)
-            
-            if len(standbys) > 0 or len(members) > 0:
-                # Save the last team with standbys 
-                print "saving standbys = %d, last mem = %d" % (len(standbys),  len(members))
-                standbys.extend(extra)
-                t = Team(date=start, shift_id=s.id, machine_id=m.id, user_id=l.id, members=members, standbys=standbys)
-                teams.append(t)
-            
-        start += timedelta(days=1) 
-        # end of while loop
-    
-    return teams
             
 ############################# Histroy Models ##########################
 class OrderHistory(db.Model):
@@ -517,3 +695,83 @@ class ProductionEntryHistory(db.Model):
     def __repr__(self):
         return '%d - %d - %s' % (self.id, self.order_id, self.shift_name)
 
+
+class ProductionHourlyCountHistory(db.Model):
+    """Hourly counts of an archived entry, with what the reports group them by."""
+    __tablename__ = 'production_hourly_count_history'
+    entry_id = Column(Integer, primary_key=True, autoincrement=False)
+    hour_index = Column(Integer, primary_key=True, autoincrement=False)
+    date = Column(Date)
+    shift_id = Column(Integer)
+    machine_id = Column(Integer)
+    good = Column(Integer, nullable=False, default=0)
+    bad = Column(Integer, nullable=False, default=0)
+    damage = Column(Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.Index('ix_production_hourly_count_history_date_shift', 'date', 'shift_id'),
+    )
+
+    def __repr__(self):
+        return '%d - %d' % (self.entry_id, self.hour_index)
+
+
+
+############################# History Views ##########################
+# Read-only mappings of the TEMP views over every history partition, see
+# history.py. Their own MetaData keeps them out of db.create_all().
+HistoryView = declarative_base(metadata=MetaData())
+
+
+class OrderHistoryAll(HistoryView):
+    __tablename__ = 'order_history_all'
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    quantity = Column(Integer)
+    product_id = Column(Integer)
+    product_name = Column(String)
+    raw_material_quantity = Column(Integer)
+    estimated_time_to_complete = Column(Integer)
+    machine_id = Column(Integer)
+    machine_name = Column(String)
+    photo = Column(String)
+    order_created_at = Column(db.DateTime)
+    production_start_at = Column(db.DateTime)
+    production_end_at = Column(db.DateTime)
+    note = Column(String)
+
+    def __repr__(self):
+        return '%d - %s - %s' % (self.id, self.name, self.product_name)
+
+
+class ProductionEntryHistoryAll(HistoryView):
+    __tablename__ = 'production_entry_history_all'
+    id = Column(Integer, primary_key=True)
+    date = Column(Date)
+    shift_name = Column(String)
+    order_id = Column(Integer)
+    order = relationship(OrderHistoryAll, viewonly=True,
+                         primaryjoin='foreign(ProductionEntryHistoryAll.order_id) == OrderHistoryAll.id')
+    lead = Column(String)
+    assemblers = Column(String)
+    num_hourly_good = Column(String)
+    num_hourly_bad = Column(String)
+    num_good = Column(Integer)
+    num_bad = Column(Integer)
+    machine_id = Column(Integer)
+    photo = Column(String)
+
+    def __repr__(self):
+        return '%d - %d - %s' % (self.id, self.order_id, self.shift_name)
+
+
+class ProductionHourlyCountAll(HistoryView):
+    """Hourly counts of the live and the archived entries, for the reports."""
+    __tablename__ = 'production_hourly_count_all'
+    entry_id = Column(Integer, primary_key=True)
+    hour_index = Column(Integer, primary_key=True)
+    date = Column(Date)
+    shift_id = Column(Integer)
+    machine_id = Column(Integer)
+    good = Column(Integer)
+    bad = Column(Integer)
+    damage = Column(Integer)
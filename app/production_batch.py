@@ -0,0 +1,183 @@
+"""
+Shift-end batch submission of production entries.
+
+Leads post a whole shift (every machine, every hour) as one JSON document
+instead of saving one admin form per machine:
+
+    {
+        "date": "2017-10-20", "shift_id": 1,
+        "entries": [
+            {"id": 12, "num_hourly_good": [50, 48, 52], "num_hourly_bad": "0,1,0"},
+            {"order_id": 3, "user_id": 4, "members": [7, 8], "num_hourly_good": [40]}
+        ]
+    }
+
+Entries with an `id` update that entry, the others are created. The batch
+is validated as a whole and applied in a single transaction; if any entry
+is invalid nothing is written and the errors are reported per entry index.
+"""
+from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy.orm import joinedload
+from model import Order, Shift, User, ProductionEntry, HOURLY_ATTRS, parse_hourly, deferred_entry_triggers
+
+WEIGHT_ATTRS = ('total_bad_weight', 'total_damage_weight')
+
+
+def _ids(values):
+    return set(v for v in values if isinstance(v, (int, long)))
+
+
+def _date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _hourly(value, shift):
+    """Normalize a list or '1,2,3' string of hourly counts to the stored string form."""
+    if isinstance(value, list):
+        counts = value
+    elif isinstance(value, basestring):
+        counts = parse_hourly(value)
+    else:
+        raise ValueError('must be a list or a comma separated string')
+
+    if not all(isinstance(c, (int, long)) and c >= 0 for c in counts):
+        raise ValueError('counts must be non-negative integers')
+    if shift is not None and len(counts) > shift.total_hours:
+        raise ValueError('more hours than the %d of shift %s' % (shift.total_hours, shift.name))
+    return ','.join(str(c) for c in counts)
+
+
+def _has_role(user, name):
+    return any(r.name == name for r in user.roles)
+
+
+def validate_batch(session, payload):
+    """
+    Check every entry of a batch against the database.
+
+    Returns (plan, errors): `plan` is a list of (index, entry or None, values)
+    ready for apply_batch(), `errors` a list of {'index', 'errors'} dicts.
+    """
+    entries = payload.get('entries') or []
+    items = [e if isinstance(e, dict) else {} for e in entries]
+
+    # Load everything the batch refers to up front, one query per table.
+    existing = dict((e.id, e) for e in session.query(ProductionEntry)
+                    .filter(ProductionEntry.id.in_(_ids(i.get('id') for i in items))))
+    orders = dict((o.id, o) for o in session.query(Order)
+                  .options(joinedload(Order.product))
+                  .filter(Order.id.in_(_ids(i.get('order_id') for i in items))))
+    user_ids = _ids(i.get('user_id') for i in items)
+    for i in items:
+        if isinstance(i.get('members'), list):
+            user_ids.update(_ids(i['members']))
+    users = dict((u.id, u) for u in session.query(User)
+                 .options(joinedload(User.roles))
+                 .filter(User.id.in_(user_ids)))
+    shifts = dict((s.id, s) for s in session.query(Shift))
+
+    plan = []
+    errors = []
+    for index, (raw, item) in enumerate(zip(entries, items)):
+        problems = {}
+        values = {}
+        entry = None
+        if not isinstance(raw, dict):
+            errors.append(dict(index=index, errors={'entry': 'must be an object'}))
+            continue
+
+        if 'id' in item:
+            entry = existing.get(item['id'])
+            if entry is None:
+                problems['id'] = 'production entry %s does not exist' % item['id']
+        else:
+            order = orders.get(item.get('order_id'))
+            if order is None:
+                problems['order_id'] = 'order %s does not exist' % item.get('order_id')
+            elif order.status == 'COMPLETED':
+                problems['order_id'] = 'order %d is already completed' % order.id
+            else:
+                values['order_id'] = order.id
+
+            lead = users.get(item.get('user_id'))
+            if lead is None or not lead.active or not _has_role(lead, 'lead'):
+                problems['user_id'] = 'user %s is not an active lead' % item.get('user_id')
+            else:
+                values['user_id'] = lead.id
+
+        shift_id = item.get('shift_id', payload.get('shift_id'))
+        if shift_id is not None or entry is None:
+            if shift_id not in shifts:
+                problems['shift_id'] = 'shift %s does not exist' % shift_id
+            else:
+                values['shift_id'] = shift_id
+        shift = shifts.get(values.get('shift_id')) or (entry.shift if entry is not None else None)
+
+        entry_date = item.get('date', payload.get('date'))
+        if entry_date is not None:
+            try:
+                values['date'] = _date(entry_date)
+            except (TypeError, ValueError):
+                problems['date'] = 'must be a YYYY-MM-DD date'
+
+        if 'members' in item:
+            members = item['members'] if isinstance(item['members'], list) else None
+            if members is None or not all(m in users and _has_role(users[m], 'assembler') for m in members):
+                problems['members'] = 'must be a list of assembler ids'
+            else:
+                values['members'] = [users[m] for m in members]
+
+        for name in HOURLY_ATTRS:
+            if name in item:
+                try:
+                    values[name] = _hourly(item[name], shift)
+                except ValueError as ex:
+                    problems[name] = str(ex)
+
+        for name in WEIGHT_ATTRS:
+            if item.get(name) is not None:
+                try:
+                    values[name] = Decimal(str(item[name]))
+                except InvalidOperation:
+                    problems[name] = 'must be a number'
+
+        if problems:
+            errors.append(dict(index=index, errors=problems))
+        else:
+            plan.append((index, entry, values))
+
+    return plan, errors
+
+
+def apply_batch(session, plan):
+    """Write a validated batch in one transaction, returns [{'index', 'id'}]."""
+    saved = []
+    try:
+        with deferred_entry_triggers(session):
+            for index, entry, values in plan:
+                if entry is None:
+                    entry = ProductionEntry()
+                    session.add(entry)
+                for name, value in values.items():
+                    setattr(entry, name, value)
+                saved.append((index, entry))
+
+            session.flush()
+            # Same as saving the admin form: counts put the order in progress.
+            now = datetime.now()
+            for index, entry in saved:
+                if entry.num_hourly_good or entry.num_hourly_bad:
+                    if entry.order.status == 'NEW':
+                        entry.order.status = 'IN_PROGRESS'
+                    if not entry.order.production_start_at:
+                        entry.order.production_start_at = now
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    return [dict(index=index, id=entry.id) for index, entry in saved]
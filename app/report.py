@@ -0,0 +1,57 @@
+"""
+Production reports, aggregated in SQL from the hourly counts of the live and
+the archived production entries (production_hourly_count_all, see history.py).
+"""
+from sqlalchemy import func, cast, Integer
+from model import Shift, ProductionHourlyCountAll as HourlyCount
+
+
+def _entries_between(query, start, end, machine_id=None):
+    query = (
+        query.select_from(HourlyCount)
+        .join(Shift, HourlyCount.shift_id == Shift.id)
+        .filter(HourlyCount.date.between(start, end))
+    )
+    if machine_id is not None:
+        query = query.filter(HourlyCount.machine_id == machine_id)
+    return query
+
+
+def hourly_output(session, start, end, machine_id=None):
+    """Good/bad/damage per machine, shift and clock hour between two dates."""
+    # The n-th hour of a shift is n hours after the shift start.
+    hour = (cast(func.strftime('%H', Shift.start), Integer) + HourlyCount.hour_index) % 24
+    query = session.query(
+        HourlyCount.date, Shift.name.label('shift'),
+        HourlyCount.machine_id.label('machine_id'),
+        hour.label('hour'),
+        func.sum(HourlyCount.good).label('good'),
+        func.sum(HourlyCount.bad).label('bad'),
+        func.sum(HourlyCount.damage).label('damage')
+    )
+    return (
+        _entries_between(query, start, end, machine_id)
+        .group_by(HourlyCount.date, Shift.id, HourlyCount.machine_id, HourlyCount.hour_index)
+        .order_by(HourlyCount.date, Shift.id, HourlyCount.machine_id, HourlyCount.hour_index)
+    )
+
+
+def shift_output(session, start, end, machine_id=None):
+    """Good/bad/damage per machine and shift between two dates."""
+    query = session.query(
+        HourlyCount.date, Shift.name.label('shift'),
+        HourlyCount.machine_id.label('machine_id'),
+        func.sum(HourlyCount.good).label('good'),
+        func.sum(HourlyCount.bad).label('bad'),
+        func.sum(HourlyCount.damage).label('damage')
+    )
+    return (
+        _entries_between(query, start, end, machine_id)
+        .group_by(HourlyCount.date, Shift.id, HourlyCount.machine_id)
+        .order_by(HourlyCount.date, Shift.id, HourlyCount.machine_id)
+    )
+
+
+def to_dicts(rows):
+    iso = lambda v: v.isoformat() if hasattr(v, 'isoformat') else v
+    return [dict((k, iso(v)) for k, v in zip(row.keys(), row)) for row in rows]
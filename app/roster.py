@@ -0,0 +1,596 @@
+"""
+Team roster generation for a TeamRequest.
+
+Every (date, shift) is staffed by assign_shift(): seats are balanced over
+the machines in use, workers who stood by most often get seated first and
+rotate machines from day to day, leads share the machines by their
+machine_to_lead_ratio and standbys are spread over the teams.
+
+The roster is produced as plain tuples and diffed against the teams already
+stored for those days (unique per date, shift and machine), so overlapping
+requests only insert, update or delete what changed. Writes use executemany()
+into team, user_team and user_team_standbys, one transaction per chunk of
+days, so a 90 day request never holds the SQLite writer for the whole range.
+
+Saving a TeamRequest only queues it: `worker` generates the teams on a
+background thread and records the status and progress on the request row,
+which /api/team_request/<id>/status and the admin list report. A running
+request names the worker process that claimed it and is stamped with a
+heartbeat after each chunk; requests left RUNNING by a worker that is gone
+are run again, see RosterWorker.resume().
+"""
+import errno
+import math
+import heapq
+import os
+import random
+import socket
+import threading
+import Queue
+from collections import namedtuple, defaultdict
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from sqlalchemy import select, and_, func, bindparam
+from sqlalchemy.sql.expression import true
+from model import Machine, Shift, User, Role, Team, TeamRequest, roles_users, user_team_table, user_team_standbys_table
+import changes
+
+LOG = getLogger(__name__)
+
+# Days written per transaction.
+CHUNK_DAYS = 7
+# A running request whose heartbeat is older belongs to a worker that is gone.
+STALE_AFTER = timedelta(minutes=10)
+
+TeamRow = namedtuple('TeamRow', 'date shift_id machine_id user_id members standbys')
+
+ROSTER_TABLES = (Team.__tablename__, user_team_table.name, user_team_standbys_table.name)
+
+
+def users_with_role(connection, role):
+    """(id, shift_id) of the active users having a role."""
+    user = User.__table__
+    role_table = Role.__table__
+    return connection.execute(
+        select([user.c.id, user.c.shift_id]).
+        select_from(
+            user.join(roles_users, roles_users.c.user_id == user.c.id).
+            join(role_table, role_table.c.id == roles_users.c.role_id)
+        ).
+        where(and_(user.c.active == true(), role_table.c.name == role)).
+        distinct()
+    ).fetchall()
+
+
+def load_machines(connection):
+    machine = Machine.__table__
+    return connection.execute(
+        select([machine.c.id, machine.c.average_num_workers, machine.c.machine_to_lead_ratio]).
+        where(machine.c.status != 'NOT_IN_USE').
+        order_by(machine.c.id)
+    ).fetchall()
+
+
+def load_shift_ids(connection):
+    shift = Shift.__table__
+    return [row.id for row in connection.execute(select([shift.c.id]).order_by(shift.c.id))]
+
+
+def group_by_shift(users, shift_ids):
+    """{shift_id: [user ids]} keeping the order of `users`."""
+    groups = dict((s, []) for s in shift_ids)
+    for u in users:
+        if u.shift_id in groups:
+            groups[u.shift_id].append(u.id)
+    return groups
+
+
+def roster_days(start, end, day_off_str):
+    """Dates from start to end, skipping the day off weekdays ('0,6' = Monday, Sunday)."""
+    day_offs = []
+    if day_off_str and len(day_off_str.strip()) > 0:
+        day_offs = [int(x) for x in day_off_str.split(',')]
+    while start <= end:
+        if start.weekday() not in day_offs:
+            yield start
+        start += timedelta(days=1)
+
+
+def lead_ratio(machine):
+    """Number of machines one lead runs, from machine_to_lead_ratio '1-N'."""
+    return max(1, int(machine.machine_to_lead_ratio.split('-')[-1]))
+
+
+def allocate_seats(machines, num_workers):
+    """
+    Split `num_workers` over the machines, returns the seats per machine.
+
+    A machine short of staff costs its squared shortfall ratio
+    ((demand - seats) / demand) ** 2, one that is fully staffed costs nothing.
+    The cost is convex and separable per machine, so giving each seat to the
+    machine whose cost drops the most, (2 * (demand - seats) - 1) / demand ** 2,
+    reaches the minimum total cost. With too few workers every machine is a
+    little short instead of the last ones being empty. O(workers log machines).
+    """
+    def gain(seated, demand):
+        return float(2 * (demand - seated) - 1) / demand ** 2
+
+    seats = [0] * len(machines)
+    heap = [(-gain(0, int(m.average_num_workers)), -int(m.average_num_workers), i) for i, m in enumerate(machines)
+            if int(m.average_num_workers) > 0]
+    heapq.heapify(heap)
+    while num_workers > 0 and heap:
+        _, neg_demand, i = heapq.heappop(heap)
+        seats[i] += 1
+        num_workers -= 1
+        if seats[i] < -neg_demand:
+            heapq.heappush(heap, (-gain(seats[i], -neg_demand), neg_demand, i))
+    return seats
+
+
+def assign_leads(machines, leads):
+    """
+    Give each machine a lead, returns (lead per machine, spare leads).
+
+    Only as many leads as the ratios need are used. Each one runs a run of
+    consecutive machines carrying about the same share of the total load.
+    """
+    loads = [1.0 / lead_ratio(m) for m in machines]
+    total = sum(loads)
+    needed = min(len(leads), max(1, int(math.ceil(total - 1e-9))))
+    slots = []
+    done = 0.0
+    for load in loads:
+        slots.append(leads[min(needed - 1, int((done + load / 2) * needed / total))])
+        done += load
+    return slots, leads[needed:]
+
+
+class Fairness(object):
+    """What the workers did on the days rostered so far."""
+    def __init__(self, standbys=None):
+        # Times on standby, the most get a seat first.
+        self.standbys = defaultdict(int, standbys or {})
+        # Machine worked last, everyone moves on to the next machine.
+        self.last_machine = {}
+
+
+def assign_shift(day, shift_id, machines, assemblers, leads, fairness):
+    """Teams of one shift on one day, as TeamRows."""
+    if not machines or not leads:
+        return []
+
+    seats = allocate_seats(machines, len(assemblers))
+    # sorted() is stable: equal standby counts keep their current order.
+    ranked = sorted(assemblers, key=lambda u: -fairness.standbys[u])
+    num_seated = sum(seats)
+    seated, standbys = ranked[:num_seated], ranked[num_seated:]
+
+    position = dict((m.id, i) for i, m in enumerate(machines))
+    seated.sort(key=lambda u: (position.get(fairness.last_machine.get(u), -1) + 1) % len(machines))
+
+    # Rotate the leads so the spare ones change from day to day.
+    offset = day.toordinal() % len(leads)
+    lead_slots, spare_leads = assign_leads(machines, leads[offset:] + leads[:offset])
+
+    teams = []
+    workers = iter(seated)
+    for machine, count, lead in zip(machines, seats, lead_slots):
+        if count:
+            members = [next(workers) for _ in range(count)]
+            teams.append(TeamRow(day, shift_id, machine.id, lead, members, []))
+            for u in members:
+                fairness.last_machine[u] = machine.id
+
+    if teams:
+        # Spread the standbys over the teams rather than piling them on one.
+        for i, u in enumerate(standbys + spare_leads):
+            teams[i % len(teams)].standbys.append(u)
+        for u in standbys:
+            fairness.standbys[u] += 1
+    return teams
+
+
+def standby_history(connection, before, days=28):
+    """{user_id: times on standby} over the days before a date."""
+    team = Team.__table__
+    standbys = user_team_standbys_table
+    return dict(connection.execute(
+        select([standbys.c.user_id, func.count()]).
+        select_from(standbys.join(team, team.c.id == standbys.c.team_id)).
+        where(and_(team.c.date >= before - timedelta(days=days), team.c.date < before)).
+        group_by(standbys.c.user_id)
+    ).fetchall())
+
+
+def reconcile_shift(day, shift_id, machines, assemblers, leads, fairness, stored):
+    """
+    Diff the stored teams of a shift against the machines in use and the
+    active staff. Returns (new TeamRows, {team id: updated TeamRow}, [team
+    ids to delete]).
+
+    Stored teams are kept as they are, minus the machines no longer in use and
+    the staff no longer active; an inactive lead is replaced. Machines with no
+    team get one from the assemblers not placed yet. Without stored teams this
+    is assign_shift().
+    """
+    if not stored:
+        return assign_shift(day, shift_id, machines, assemblers, leads, fairness), {}, []
+
+    machine_ids = set(m.id for m in machines)
+    staff = set(assemblers)
+    lead_set = set(leads)
+    lead_slots = None
+    kept = {}
+    changed = {}
+    removed = []
+    for team_id, team in stored:
+        if team.machine_id not in machine_ids or team.machine_id in kept:
+            removed.append(team_id)
+            continue
+
+        lead = team.user_id
+        if lead not in lead_set:
+            if lead_slots is None:
+                lead_slots = dict(zip([m.id for m in machines], assign_leads(machines, leads)[0]))
+            lead = lead_slots[team.machine_id]
+        team_now = team._replace(
+            user_id=lead,
+            members=[u for u in team.members if u in staff],
+            standbys=[u for u in team.standbys if u in staff or u in lead_set]
+        )
+        if team_now != team:
+            changed[team_id] = team_now
+        kept[team.machine_id] = team_now
+
+    placed = set()
+    for team in kept.values():
+        placed.update(team.members + team.standbys)
+        for u in team.members:
+            fairness.last_machine[u] = team.machine_id
+        for u in team.standbys:
+            if u in staff:
+                fairness.standbys[u] += 1
+
+    new_teams = []
+    missing = [m for m in machines if m.id not in kept]
+    if missing:
+        pool = [u for u in assemblers if u not in placed]
+        for team in assign_shift(day, shift_id, missing, pool, leads, fairness):
+            # The spare leads already run the kept teams.
+            new_teams.append(team._replace(standbys=[u for u in team.standbys if u in staff]))
+    return new_teams, changed, removed
+
+
+def load_teams(connection, first, last):
+    """{(date, shift_id): [(team id, TeamRow)]} of the teams stored between two dates."""
+    team = Team.__table__
+    between = team.c.date.between(first, last)
+    links = {}
+    for link in (user_team_table, user_team_standbys_table):
+        users = links[link.name] = defaultdict(list)
+        for user_id, team_id in connection.execute(
+            select([link.c.user_id, link.c.team_id]).
+            select_from(link.join(team, team.c.id == link.c.team_id)).
+            where(between)
+        ):
+            users[team_id].append(user_id)
+
+    stored = defaultdict(list)
+    for row in connection.execute(
+        select([team.c.id, team.c.date, team.c.shift_id, team.c.machine_id, team.c.user_id]).
+        where(between).order_by(team.c.id)
+    ):
+        stored[(row.date, row.shift_id)].append((row.id, TeamRow(
+            row.date, row.shift_id, row.machine_id, row.user_id,
+            links[user_team_table.name][row.id], links[user_team_standbys_table.name][row.id]
+        )))
+    return stored
+
+
+def off_day_team_ids(connection, start, end, days):
+    """Ids of the teams between two dates that are not on a roster day."""
+    team = Team.__table__
+    days = set(days)
+    return [row.id for row in connection.execute(
+        select([team.c.id, team.c.date]).where(team.c.date.between(start, end))
+    ) if row.date not in days]
+
+
+def _batches(values, size=500):
+    """Slices of at most `size` items, SQLite limits the parameters of a statement."""
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _unlink(connection, team_ids):
+    for batch in _batches(team_ids):
+        for link in (user_team_table, user_team_standbys_table):
+            connection.execute(link.delete().where(link.c.team_id.in_(batch)))
+
+
+def delete_teams(connection, team_ids):
+    """Delete teams and their member/standby links, returns the number deleted."""
+    team = Team.__table__
+    _unlink(connection, team_ids)
+    for batch in _batches(team_ids):
+        connection.execute(team.delete().where(team.c.id.in_(batch)))
+    return len(team_ids)
+
+
+def update_teams(connection, changed):
+    """Store the lead, members and standbys of {team id: TeamRow}."""
+    if not changed:
+        return
+    team = Team.__table__
+    connection.execute(
+        team.update().where(team.c.id == bindparam('team_id')).values(user_id=bindparam('lead_id')),
+        [dict(team_id=team_id, lead_id=t.user_id) for team_id, t in changed.items()]
+    )
+    _unlink(connection, changed.keys())
+    for link, attr in ((user_team_table, 'members'), (user_team_standbys_table, 'standbys')):
+        rows = [dict(user_id=u, team_id=team_id) for team_id, t in changed.items() for u in getattr(t, attr)]
+        if rows:
+            connection.execute(link.insert(), rows)
+
+
+def write_teams(connection, teams):
+    """Insert TeamRows and their member/standby links, returns the number of teams."""
+    if not teams:
+        return 0
+
+    team_table = Team.__table__
+    row = lambda t: dict(date=t.date, shift_id=t.shift_id, machine_id=t.machine_id, user_id=t.user_id)
+
+    # The first insert takes the write lock. SQLite hands out max(id) + 1 for
+    # new rows, so the ids after it are free until this transaction ends.
+    first_id = connection.execute(team_table.insert(), row(teams[0])).inserted_primary_key[0]
+    team_ids = range(first_id, first_id + len(teams))
+    if len(teams) > 1:
+        connection.execute(team_table.insert(), [
+            dict(row(t), id=team_id) for t, team_id in zip(teams[1:], team_ids[1:])
+        ])
+
+    members = [dict(user_id=u, team_id=team_id) for t, team_id in zip(teams, team_ids) for u in t.members]
+    if members:
+        connection.execute(user_team_table.insert(), members)
+
+    standbys = [dict(user_id=u, team_id=team_id) for t, team_id in zip(teams, team_ids) for u in t.standbys]
+    if standbys:
+        connection.execute(user_team_standbys_table.insert(), standbys)
+
+    return len(teams)
+
+
+def begin_write(connection):
+    """
+    Take the SQLite write lock at the start of a transaction. pysqlite begins
+    lazily at the first write, so what was read before it could be stale.
+    """
+    connection.execute('BEGIN IMMEDIATE')
+
+
+def generate_teams(engine, start, end, day_off_str, chunk_days=CHUNK_DAYS, progress=None):
+    """
+    Bring the teams of a date range up to date, returns the number of teams
+    inserted or updated.
+
+    Teams already stored for the range are kept, see reconcile_shift(), so an
+    overlapping request only writes what changed.
+
+    `progress(connection, days_done, num_days, num_teams)` is called inside
+    each chunk's transaction, after its teams are written.
+    """
+    with engine.connect() as connection:
+        machines = load_machines(connection)
+        shift_ids = load_shift_ids(connection)
+        assemblers = users_with_role(connection, 'assembler')
+        leads = users_with_role(connection, 'lead')
+        fairness = Fairness(standby_history(connection, start))
+
+    if not machines or not leads:
+        raise ValueError('Teams need at least one machine in use and one active lead.')
+
+    random.shuffle(assemblers)
+    random.shuffle(leads)
+    assembler_map = group_by_shift(assemblers, shift_ids)
+    lead_map = group_by_shift(leads, shift_ids)
+
+    days = list(roster_days(start, end, day_off_str))
+    with engine.begin() as connection:
+        begin_write(connection)
+        # Teams left on what are now days off.
+        deleted = delete_teams(connection, off_day_team_ids(connection, start, end, days))
+
+    total = inserted = 0
+    for i in range(0, len(days), chunk_days):
+        chunk = days[i:i + chunk_days]
+        with engine.begin() as connection:
+            # No other regeneration changes the stored teams before the diff is written.
+            begin_write(connection)
+            stored = load_teams(connection, chunk[0], chunk[-1])
+            new_teams = []
+            changed = {}
+            removed = []
+            for day in chunk:
+                for shift_id in shift_ids:
+                    # A shift without leads of its own borrows from all of them.
+                    shift_leads = lead_map[shift_id] or [l.id for l in leads]
+                    diff = reconcile_shift(day, shift_id, machines, assembler_map[shift_id], shift_leads,
+                                           fairness, stored.get((day, shift_id), []))
+                    new_teams.extend(diff[0])
+                    changed.update(diff[1])
+                    removed.extend(diff[2])
+
+            deleted += delete_teams(connection, removed)
+            update_teams(connection, changed)
+            inserted += write_teams(connection, new_teams)
+            total += len(new_teams) + len(changed)
+            if progress is not None:
+                progress(connection, i + len(chunk), len(days), total)
+        changes.bump(*ROSTER_TABLES)
+
+    LOG.info('Teams %s - %s: %d inserted, %d updated, %d deleted',
+             start, end, inserted, total - inserted, deleted)
+    return total
+
+
+######################## Background jobs ########################
+def _update_request(connection, request_id, **values):
+    table = TeamRequest.__table__
+    return connection.execute(
+        table.update().where(table.c.id == request_id).values(**values)
+    ).rowcount
+
+
+def worker_id():
+    """host:pid of this process, forked gunicorn workers each have their own."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def worker_alive(owner, heartbeat_at, now=None):
+    """
+    Whether the worker that claimed a request may still run it: its heartbeat
+    is recent and, when it ran on this host, its process still exists.
+    """
+    now = now or datetime.now()
+    if not owner or heartbeat_at is None or heartbeat_at < now - STALE_AFTER:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname() or int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except OSError as ex:
+        return ex.errno == errno.EPERM
+    return True
+
+
+def claim_request(engine, request_id):
+    """Move a PENDING request to RUNNING, False if another worker has it already."""
+    table = TeamRequest.__table__
+    with engine.begin() as connection:
+        claimed = connection.execute(
+            table.update().
+            where(and_(table.c.id == request_id, table.c.status == 'PENDING')).
+            values(status='RUNNING', num_days_done=0, num_teams=0, error=None,
+                   worker_id=worker_id(), heartbeat_at=datetime.now())
+        ).rowcount == 1
+    if claimed:
+        changes.bump(TeamRequest.__tablename__)
+    return claimed
+
+
+def run_request(engine, request_id):
+    """Generate the teams of a TeamRequest, recording its status and progress."""
+    if not claim_request(engine, request_id):
+        return
+
+    table = TeamRequest.__table__
+    with engine.connect() as connection:
+        request = connection.execute(
+            select([table.c.start_date, table.c.end_date, table.c.day_off]).where(table.c.id == request_id)
+        ).first()
+
+    def progress(connection, days_done, num_days, num_teams):
+        _update_request(connection, request_id, num_days=num_days, num_days_done=days_done, num_teams=num_teams,
+                        heartbeat_at=datetime.now())
+
+    try:
+        num_days = len(list(roster_days(request.start_date, request.end_date, request.day_off)))
+        with engine.begin() as connection:
+            _update_request(connection, request_id, num_days=num_days)
+        generate_teams(engine, request.start_date, request.end_date, request.day_off, progress=progress)
+        status = dict(status='DONE')
+    except Exception as ex:
+        LOG.exception('Team request %d failed', request_id)
+        status = dict(status='FAILED', error=str(ex))
+
+    with engine.begin() as connection:
+        _update_request(connection, request_id, **status)
+    changes.bump(TeamRequest.__tablename__)
+
+
+def pending_request_ids(engine):
+    table = TeamRequest.__table__
+    with engine.connect() as connection:
+        return [row.id for row in connection.execute(
+            select([table.c.id]).where(table.c.status == 'PENDING').order_by(table.c.id)
+        )]
+
+
+def release_stale_requests(engine):
+    """
+    Put the RUNNING requests of workers that are gone back to PENDING, returns
+    their ids. Generating a request again only writes what it had not yet.
+    """
+    table = TeamRequest.__table__
+    with engine.connect() as connection:
+        running = connection.execute(
+            select([table.c.id, table.c.worker_id, table.c.heartbeat_at]).where(table.c.status == 'RUNNING')
+        ).fetchall()
+
+    released = []
+    for request_id, owner, heartbeat_at in running:
+        if worker_alive(owner, heartbeat_at):
+            continue
+        # Unless its worker moved it on meanwhile.
+        unchanged = table.c.heartbeat_at.is_(None) if heartbeat_at is None else table.c.heartbeat_at == heartbeat_at
+        with engine.begin() as connection:
+            if connection.execute(
+                table.update().
+                where(and_(table.c.id == request_id, table.c.status == 'RUNNING', unchanged)).
+                values(status='PENDING', worker_id=None)
+            ).rowcount:
+                released.append(request_id)
+                LOG.warning('Team request %d was left RUNNING by worker %s, running it again', request_id, owner)
+    if released:
+        changes.bump(TeamRequest.__tablename__)
+    return released
+
+
+class RosterWorker(object):
+    """
+    Runs team requests one at a time on a daemon thread of this process.
+    The thread is started by the first enqueue().
+    """
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enqueue(self, engine, request_id):
+        self._start()
+        self._queue.put((engine, request_id))
+
+    def resume(self, engine):
+        """Queue the requests left PENDING or RUNNING by a worker that is gone, e.g. by a restart."""
+        release_stale_requests(engine)
+        for request_id in pending_request_ids(engine):
+            self.enqueue(engine, request_id)
+
+    def wait(self):
+        """Block until every queued request is finished."""
+        self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='roster-worker')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            engine, request_id = self._queue.get()
+            try:
+                run_request(engine, request_id)
+            except Exception:
+                LOG.exception('Team request %d could not be run', request_id)
+            finally:
+                self._queue.task_done()
+
+
+worker = RosterWorker()
@@ -1,5 +1,16 @@
-from app import db
-from model import Product, Order, ProductionEntry, OrderHistory, ProductionEntryHistory
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from logging import getLogger
+
+from app import app, db
+import changes
+import db_backup
+import history
+
+LOG = getLogger(__name__)
+
 
 def init_logger():
     import logging
@@ -15,63 +26,161 @@ def test_job(a, b):
     print(str(a) + ' ' + str(b))
     #app.logger.info('Scheduler Running:' + str(a) + ' ' + str(b))
 
+# Completed orders moved per transaction, small enough that the shop floor
+# never waits long on the SQLite writer lock.
+ARCHIVE_CHUNK_SIZE = 500
+
+ARCHIVE_TABLES = (
+    'order', 'production_entry', 'users_production_entries', 'production_hourly_count',
+    'order_history', 'production_entry_history', 'production_hourly_count_history'
+)
+
+# With WAL a transaction over attached databases is atomic per file only, a
+# crash can leave a chunk copied but not deleted. Re-running it skips the rows
+# already copied (same id, same order/creation); any other row with the id
+# fails the chunk rather than overwrite what was archived.
+ARCHIVE_ORDERS_SQL = (
+    'INSERT INTO %%(schema)s.order_history (%s)' % ', '.join(history.ORDER_HISTORY_COLUMNS) +
+    history.LIVE_ORDER_HISTORY + "WHERE o.id IN (%(ids)s) AND o.status = 'COMPLETED' AND NOT EXISTS "
+    "(SELECT 1 FROM %(schema)s.order_history x WHERE x.id = o.id AND x.order_created_at IS o.created_at)"
+)
+
+ARCHIVE_ENTRIES_SQL = (
+    'INSERT INTO %%(schema)s.production_entry_history (%s)' % ', '.join(history.ENTRY_HISTORY_COLUMNS) +
+    history.LIVE_ENTRY_HISTORY + "WHERE o.id IN (%(ids)s) AND o.status = 'COMPLETED' AND NOT EXISTS "
+    "(SELECT 1 FROM %(schema)s.production_entry_history x WHERE x.id = e.id AND x.order_id = e.order_id)"
+)
+
+# The entries are checked above, their hours already there are a re-copy.
+ARCHIVE_HOURLY_SQL = (
+    'INSERT INTO %%(schema)s.production_hourly_count_history (%s)' % ', '.join(history.HOURLY_HISTORY_COLUMNS) +
+    history.LIVE_HOURLY_HISTORY + "WHERE o.id IN (%(ids)s) AND o.status = 'COMPLETED' AND NOT EXISTS "
+    "(SELECT 1 FROM %(schema)s.production_hourly_count_history x "
+    "WHERE x.entry_id = h.entry_id AND x.hour_index = h.hour_index)"
+)
+
+COMPLETED_IDS = """(SELECT id FROM "order" WHERE id IN (%(ids)s) AND status = 'COMPLETED')"""
+
+# Children first, foreign keys are on.
+ARCHIVE_DELETE_SQL = (
+    'DELETE FROM production_hourly_count WHERE entry_id IN '
+    '(SELECT id FROM production_entry WHERE order_id IN ' + COMPLETED_IDS + ')',
+    'DELETE FROM users_production_entries WHERE production_entry_id IN '
+    '(SELECT id FROM production_entry WHERE order_id IN ' + COMPLETED_IDS + ')',
+    'DELETE FROM production_entry WHERE order_id IN ' + COMPLETED_IDS,
+    'DELETE FROM "order" WHERE id IN ' + COMPLETED_IDS,
+)
+
+
+def archive_chunk(connection, order_ids, schema='main'):
+    """
+    Move completed orders, their production entries and hourly counts to the
+    history tables of a schema (an attached partition), returns (orders, entries).
+    """
+    params = {'ids': ', '.join('?' * len(order_ids)), 'schema': schema}
+    connection.execute(ARCHIVE_ORDERS_SQL % params, *order_ids)
+    connection.execute(ARCHIVE_ENTRIES_SQL % params, *order_ids)
+    # The reports read them from history, see report.py.
+    connection.execute(ARCHIVE_HOURLY_SQL % params, *order_ids)
+    # Counted as they leave, a re-run copies less than it moves.
+    deleted = [connection.execute(sql % params, *order_ids).rowcount for sql in ARCHIVE_DELETE_SQL]
+    return deleted[3], deleted[2]
+
+
+def archive_orders(engine, chunk_size=ARCHIVE_CHUNK_SIZE, pause=0.05):
+    """
+    Archive every COMPLETED order, one transaction per chunk of orders.
+
+    Orders go to the history partition of the year they finished in (see
+    history.py), or to the history tables of the live database when no
+    partition directory is configured. A crash loses nothing, the next run
+    simply carries on with the orders still left. `pause` seconds between
+    chunks let waiting writers in. Returns (orders, entries).
+    """
+    total_orders = total_entries = 0
+    while True:
+        started = time.time()
+        with engine.connect() as connection:
+            rows = connection.execute(
+                'SELECT id, strftime(\'%Y\', COALESCE(production_end_at, updated_at, created_at)) '
+                'FROM "order" WHERE status = ? ORDER BY id LIMIT ?', 'COMPLETED', chunk_size
+            ).fetchall()
+        if not rows:
+            break
+
+        by_schema = defaultdict(list)
+        for order_id, year in rows:
+            if history.enabled():
+                # Created before the transaction, checkout attaches it.
+                year = int(year or datetime.now().year)
+                history.ensure_partition(year)
+                by_schema[history.partition_schema(year)].append(order_id)
+            else:
+                by_schema['main'].append(order_id)
+
+        orders = entries = 0
+        with engine.begin() as connection:
+            for schema, order_ids in by_schema.items():
+                moved = archive_chunk(connection, order_ids, schema)
+                orders += moved[0]
+                entries += moved[1]
+        changes.bump(*ARCHIVE_TABLES)
+
+        total_orders += orders
+        total_entries += entries
+        LOG.info('Archived %d orders, %d production entries in %.3f s', orders, entries, time.time() - started)
+        if len(rows) < chunk_size:
+            break
+        time.sleep(pause)
+
+    return total_orders, total_entries
+
+
 def archive_orders_job():
-    print "@@@@@@@@@ archive orders job @@@@@@@@@@"
-    orders = db.session.query(Order).filter(Order.status == 'COMPLETED').all()
-    print "num completed orders = %d" % len(orders)
-    if len(orders) < 1:
+    started = time.time()
+    try:
+        orders, entries = archive_orders(db.engine)
+    except Exception:
+        LOG.exception('Archiving completed orders failed')
         return
+    if orders:
+        LOG.info('Archived %d completed orders, %d production entries in %.3f s',
+                 orders, entries, time.time() - started)
 
-    try:
-        count = 0
-        for o in orders:
-            print "completed = %d, product = %s" % (o.completed, o.photo)
-            oh = OrderHistory()
-            oh.id = int(o.id)
-            oh.name = str(o.name)
-            oh.quantity = int(o.quantity)
-            oh.product_id = int(o.product_id)
-            oh.product_name = str(o.product.name)
-            oh.raw_material_quantity = int(o.raw_material_quantity)
-            oh.estimated_time_to_complete = int(o.estimated_time_to_complete)
-            oh.machine_id = int(o.assigned_machine_id)
-            oh.machine_name = o.assigned_machine.name
-            oh.photo = str(o.photo)
-            oh.production_start_at = o.production_start_at
-            oh.production_end_at = o.production_end_at
-            oh.note = str(o.note)
-
-            db.session.add(oh)
-            count += 1
-
-            for e in o.production_entry_orders:
-                print "production entry good = %d vs bad = %d" % (e.num_good, e.num_bad)
-                assemblers = [ m.name for m in e.members ]
-                assembler_names = ','.join(assemblers)
-
-                eh = ProductionEntryHistory()
-                eh.id = e.id
-                eh.date = e.date
-                eh.shift_name = e.shift.name
-                eh.order_id = oh.id
-                eh.lead = e.lead.name
-                eh.assemblers = str(assembler_names)
-                eh.num_hourly_good = str(e.num_hourly_good)
-                eh.num_hourly_bad = str(e.num_hourly_bad)
-                eh.num_good = e.num_good
-                eh.num_bad = e.num_bad
-                eh.machine_id = e.machine_id
-                eh.photo = oh.photo
-
-                db.session.add(eh)
-                db.session.delete(e)
-            
-            db.session.delete(o)
-        
-        if count > 0:
-            db.session.commit()
-            print "successfully committed."
-    except Exception as ex:
-        print "@@@@@@@@@@@@@@@ Something went wrong @@@@@@@@@@@@"
-        print ex
 
+def backup_databases(engine, backup_dir, compression='gzip', keep_days=db_backup.NO_OF_DAYS,
+                     keep_last=db_backup.KEEP_LAST, segment_dir=None):
+    """
+    Online backup of the live database and of the history partitions into
+    backup_dir (see db_backup.py), then remove the expired backups there and
+    the change log segments of segment_dir older than every backup kept.
+    Returns the backup files written.
+    """
+    if not os.path.isdir(backup_dir):
+        os.makedirs(backup_dir)
+    databases = [engine.url.database] + [history.partition_path(y) for y in history.years()]
+    written = [
+        db_backup.sqlite3_backup(database, backup_dir, compression,
+                                 app.config.get('BACKUP_PAGES_PER_STEP', db_backup.PAGES_PER_STEP),
+                                 app.config.get('BACKUP_STEP_SLEEP', db_backup.STEP_SLEEP))
+        for database in databases
+    ]
+    db_backup.clean_data(backup_dir, keep_days, keep_last)
+    if segment_dir:
+        kept = db_backup.list_backups(backup_dir).get(os.path.basename(engine.url.database))
+        if kept:
+            db_backup.prune_segments(segment_dir, kept[-1][0])
+    return written
+
+
+def backup_job():
+    started = time.time()
+    try:
+        written = backup_databases(db.engine, app.config['BACKUP_DIR'], app.config.get('BACKUP_COMPRESSION', 'gzip'),
+                                   app.config.get('BACKUP_KEEP_DAYS', db_backup.NO_OF_DAYS),
+                                   app.config.get('BACKUP_KEEP_LAST', db_backup.KEEP_LAST),
+                                   app.config.get('BACKUP_CHANGES_DIR'))
+    except Exception:
+        LOG.exception('Database backup failed')
+        return
+    LOG.info('Backed up %d database(s) in %.3f s', len(written), time.time() - started)
@@ -0,0 +1,86 @@
+"""
+Active users by role, for the lead / assembler autocomplete of the Team and
+Production Entry forms.
+
+Each role keeps its active users in memory as (id, name) choices sorted by
+name without case, the same order as the ix_user_name_nocase index. A term
+is then a binary search for its prefix, with the semantics of
+`name LIKE 'term%'`, and the page is a slice of the list. The list of a role
+is read again after a commit to user, role or roles_users (see changes.py).
+"""
+import bisect
+import string
+import threading
+from collections import namedtuple
+
+from sqlalchemy.sql.expression import true
+
+from app import db
+from model import User, Role, roles_users
+import changes
+
+TABLES = ('user', 'role', 'roles_users')
+
+# SQLite NOCASE and LIKE only fold ASCII letters.
+_FOLD = dict((ord(c), ord(c.lower())) for c in string.ascii_uppercase)
+
+_lock = threading.Lock()
+# role name -> (generation, folded names, choices)
+_cache = {}
+
+
+class Choice(namedtuple('Choice', 'id name')):
+    """A user as the ajax loaders show it, without loading the User row."""
+    __slots__ = ()
+
+    def __unicode__(self):
+        return self.name
+
+    def __str__(self):
+        return self.name.encode('utf-8')
+
+
+def fold(name):
+    return unicode(name).translate(_FOLD)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def _load(role):
+    rows = (
+        db.session.query(User.id, User.name)
+        .join(roles_users, roles_users.c.user_id == User.id)
+        .join(Role, Role.id == roles_users.c.role_id)
+        .filter(Role.name == role, User.active == true())
+        .order_by(User.name.collate('NOCASE'), User.id)
+    )
+    choices = [Choice(*row) for row in rows]
+    choices.sort(key=lambda c: (fold(c.name), c.id))
+    return [fold(c.name) for c in choices], choices
+
+
+def role_users(role):
+    """(folded names, choices) of the active users of a role, sorted by name."""
+    generation = changes.generation(*TABLES)
+    cached = _cache.get(role)
+    if cached is not None and cached[0] == generation:
+        return cached[1], cached[2]
+
+    names, choices = _load(role)
+    with _lock:
+        _cache[role] = (generation, names, choices)
+    return names, choices
+
+
+def search(role, term, offset=0, limit=10):
+    """Active users of a role whose name starts with term, ignoring case."""
+    names, choices = role_users(role)
+    prefix = fold(term or u'')
+    start = bisect.bisect_left(names, prefix) + max(offset or 0, 0)
+    end = len(names)
+    if limit:
+        end = min(end, start + limit)
+    return [c for n, c in zip(names[start:end], choices[start:end]) if n.startswith(prefix)]
@@ -3,58 +3,102 @@ var template = Handlebars.compile(source);
 var MAX_ROW = 20;
 var current_orders = [];
 var charts = [];
-var refInterval = window.setInterval('update()', 30000); // 30 seconds
+var refInterval = null;
+var stream = null;
 
 var update = function() {
     $.ajax({
         type : 'GET',
         url : '../api/dashboard',
-        success : function(data){
-            if (arraysEqual(data, current_orders)) {
-                // update progress
-                //console.log("update progress");
-            
-                for(var j = 0; j < data.length; j++) {
-                    order = data[j];
-                    if ( JSON.stringify(current_orders[j]) === JSON.stringify(order) ) {
-                        // console.log("No changes found. Skipping...");
-                        continue;
-                    }
-                    $('#title_' + order.id).html(order.machine_product);
-                    $('#q_' + order.id).html(order.quantity);
-                    $('#c_' + order.id).html(order.completed);
-                    $('#b_' + order.id).html(order.total_bad);
-                    chart = charts[j];
-                    current = chart.series[0].data[0];
-                    current.y = order.percent;
-                    chart.series[0].setData([current]);
-                    chart.percent_label.attr({
-                        text: order.percent + '<span style="vertical-align:super;font-size:50%">%</span>'
-                    })
-                }
-            } else {
-                // console.log("init all charts");
-                current_orders = [];
-                charts = [];
-                var row_num = 0;
-                $('#chart_group').html('');
-
-                for( var i = 0;  i < data.length; i++) {
-                    order = data[i];
-                    current_orders.push(order);
-                    if ( i % 3 == 0) {
-                        row_num++;
-                        row_html = '<div id="row_' + row_num + '" class="flex-row row"></div>';
-                        $('#chart_group').append(row_html);
-                    }
-                    row = '#row_' + row_num;
-                    $(row).append(template(order));
-                    chart = draw_donut(order.id + '', order.percent);
-                    charts.push(chart);
-                }
-            }
-        },
+        success : render
+    });
+};
+
+// Fall back to polling every 30 seconds while the push stream is down.
+var startPolling = function() {
+    if (!refInterval) {
+        refInterval = window.setInterval('update()', 30000); // 30 seconds
+    }
+};
+
+var stopPolling = function() {
+    if (refInterval) {
+        window.clearInterval(refInterval);
+        refInterval = null;
+    }
+};
+
+var connect = function() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+
+    stream = new EventSource('../api/dashboard/stream');
+    stream.addEventListener('snapshot', function(e) {
+        stopPolling();
+        render(JSON.parse(e.data).orders);
     });
+    stream.addEventListener('delta', function(e) {
+        var delta = JSON.parse(e.data);
+        var orders = {};
+        for (var i = 0; i < current_orders.length; i++) {
+            orders[current_orders[i].id] = current_orders[i];
+        }
+        for (var j = 0; j < delta.changed.length; j++) {
+            orders[delta.changed[j].id] = delta.changed[j];
+        }
+        render($.map(delta.ids, function(id) { return orders[id]; }));
+    });
+    // EventSource reconnects by itself, poll in the meantime.
+    stream.onerror = startPolling;
+};
+
+var render = function(data) {
+    if (arraysEqual(data, current_orders)) {
+        // update progress
+        //console.log("update progress");
+    
+        for(var j = 0; j < data.length; j++) {
+            order = data[j];
+            if ( JSON.stringify(current_orders[j]) === JSON.stringify(order) ) {
+                // console.log("No changes found. Skipping...");
+                continue;
+            }
+            current_orders[j] = order;
+            $('#title_' + order.id).html(order.machine_product);
+            $('#q_' + order.id).html(order.quantity);
+            $('#c_' + order.id).html(order.completed);
+            $('#b_' + order.id).html(order.total_bad);
+            chart = charts[j];
+            current = chart.series[0].data[0];
+            current.y = order.percent;
+            chart.series[0].setData([current]);
+            chart.percent_label.attr({
+                text: order.percent + '<span style="vertical-align:super;font-size:50%">%</span>'
+            })
+        }
+    } else {
+        // console.log("init all charts");
+        current_orders = [];
+        charts = [];
+        var row_num = 0;
+        $('#chart_group').html('');
+
+        for( var i = 0;  i < data.length; i++) {
+            order = data[i];
+            current_orders.push(order);
+            if ( i % 3 == 0) {
+                row_num++;
+                row_html = '<div id="row_' + row_num + '" class="flex-row row"></div>';
+                $('#chart_group').append(row_html);
+            }
+            row = '#row_' + row_num;
+            $(row).append(template(order));
+            chart = draw_donut(order.id + '', order.percent);
+            charts.push(chart);
+        }
+    }
 };
 
 var draw_donut = function(id, percent) {
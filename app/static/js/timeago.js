@@ -0,0 +1,42 @@
+// Fills in the "x ago" text of the <time class="timeago"> cells of the admin
+// lists. The server only sends the absolute time so that a cached cell stays
+// right; this keeps the relative text current and refreshes it every minute.
+(function() {
+    var INTERVALS = [
+        ['week', 604800],
+        ['day', 86400],
+        ['hour', 3600],
+        ['minute', 60],
+        ['second', 1]
+    ];
+
+    // Same wording as util.display_time().
+    var displayTime = function(seconds, granularity) {
+        var result = [];
+        for (var i = 0; i < INTERVALS.length; i++) {
+            var value = Math.floor(seconds / INTERVALS[i][1]);
+            if (value) {
+                seconds -= value * INTERVALS[i][1];
+                result.push(value + ' ' + INTERVALS[i][0] + (value == 1 ? '' : 's'));
+            }
+        }
+        return result.slice(0, granularity || 2).join(', ');
+    };
+
+    var refresh = function() {
+        var now = new Date().getTime();
+        var cells = document.querySelectorAll('time.timeago[data-epoch]');
+        for (var i = 0; i < cells.length; i++) {
+            var epoch = parseInt(cells[i].getAttribute('data-epoch'), 10);
+            var seconds = Math.max(Math.floor(now / 1000) - epoch, 0);
+            cells[i].textContent = displayTime(seconds) + ' ago';
+        }
+    };
+
+    if (document.readyState == 'loading') {
+        document.addEventListener('DOMContentLoaded', refresh);
+    } else {
+        refresh();
+    }
+    window.setInterval(refresh, 60000);
+})();
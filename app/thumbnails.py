@@ -0,0 +1,243 @@
+"""
+Thumbnails of the uploaded photos, in several sizes.
+
+A photo is resized into every size in SIZES by a process pool after its
+upload, and by the `flask thumbnails` command for the photos already there.
+The results live in a content-addressed cache under app/files:
+
+    thumbs/<first 2 hex>/<sha1 of the original>-<size>.<ext>
+
+so a replaced photo gets new names and an unchanged one is never made twice.
+They are WEBP where PIL can write it, progressive JPEG otherwise.
+
+thumbnail_url(photo, size) is what the pages use: the cached thumbnail when
+it is ready, until then the old Flask-Admin _thumb file or the original
+while generation is queued.
+"""
+import os
+import hashlib
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from logging import getLogger
+
+from flask import url_for
+from flask_admin.form import thumbgen_filename, ImageUploadField
+from flask_admin.form.upload import ImageUploadInput
+from PIL import Image, ImageOps
+
+LOG = getLogger(__name__)
+
+# Name -> square edge in pixels, as the pages show them.
+SIZES = OrderedDict([
+    ('icon', 50),    # Machine list order strip
+    ('list', 75),    # List view thumbnails
+    ('card', 200)    # Dashboard
+])
+CACHE_DIR = 'thumbs'
+PROCESSES = 2
+JPEG_QUALITY = 80
+
+base_path = os.path.join(os.path.dirname(__file__), 'files')
+
+_lock = threading.Lock()
+_pool = None
+# photo -> (sha1, AsyncResult) of the generation in progress
+_pending = {}
+# photo -> ((mtime, size), sha1) of the original file
+_digests = {}
+# Cached thumbnail names known to exist.
+_ready = set()
+# sha1 of the originals whose generation failed, not queued again: a new
+# upload has another sha1 and gets its try.
+_failed = set()
+
+
+def set_directory(path):
+    """Read uploads from and cache thumbnails under `path`, the static folder by default."""
+    global base_path
+    base_path = path
+    _digests.clear()
+    _ready.clear()
+    _failed.clear()
+
+
+def thumbnail_format():
+    Image.init()
+    return ('WEBP', 'webp') if 'WEBP' in Image.SAVE else ('JPEG', 'jpg')
+
+
+def cache_name(digest, size):
+    return '%s/%s/%s-%s.%s' % (CACHE_DIR, digest[:2], digest, size, thumbnail_format()[1])
+
+
+def file_digest(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(65536), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def digest(photo):
+    """sha1 of an uploaded photo, None if the file is missing."""
+    if not photo:
+        return None
+    try:
+        st = os.stat(os.path.join(base_path, photo))
+    except OSError:
+        return None
+    stamp = (st.st_mtime, st.st_size)
+    cached = _digests.get(photo)
+    if cached is None or cached[0] != stamp:
+        cached = _digests[photo] = (stamp, file_digest(os.path.join(base_path, photo)))
+    return cached[1]
+
+
+def make_thumbnails(source, directory, digest):
+    """
+    Write every size of one image, runs in the pool. Returns (names written,
+    None), or ([], the error): the pool only calls back on success.
+    """
+    try:
+        return write_thumbnails(source, directory, digest), None
+    except Exception:
+        return [], traceback.format_exc()
+
+
+def write_thumbnails(source, directory, digest):
+    """Write every size of one image, returns the names written."""
+    image = Image.open(source)
+    image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    format, ext = thumbnail_format()
+    if format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        image = background
+
+    written = []
+    for size, edge in SIZES.items():
+        name = cache_name(digest, size)
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            continue
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass  # Made by another worker meanwhile.
+
+        thumb = ImageOps.fit(image, (edge, edge), Image.ANTIALIAS)
+        tmp_path = path + '.tmp'
+        if format == 'JPEG':
+            thumb.save(tmp_path, format, quality=JPEG_QUALITY, optimize=True, progressive=True)
+        else:
+            thumb.save(tmp_path, format, quality=JPEG_QUALITY)
+        # Readers see a whole file or none.
+        os.rename(tmp_path, path)
+        written.append(name)
+    return written
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = multiprocessing.Pool(PROCESSES)
+    return _pool
+
+
+def schedule(photo):
+    """Queue the thumbnails of an uploaded photo, returns False if there is nothing to do."""
+    key = digest(photo) if photo else None
+    if key is None or key in _failed or is_ready(photo, key=key):
+        return False
+
+    with _lock:
+        if photo in _pending:
+            return True
+        result = _get_pool().apply_async(
+            make_thumbnails, (os.path.join(base_path, photo), base_path, key),
+            callback=lambda result, photo=photo, key=key: _done(photo, key, result)
+        )
+        _pending[photo] = (key, result)
+    return True
+
+
+def _done(photo, key, result):
+    names, error = result
+    with _lock:
+        _pending.pop(photo, None)
+        if error:
+            _failed.add(key)
+    if error:
+        LOG.error('Thumbnails of %s failed, serving the original: %s', photo, error)
+    else:
+        LOG.info('Made %d thumbnails of %s', len(names), photo)
+
+
+def wait(timeout=None):
+    """Wait for the queued thumbnails."""
+    with _lock:
+        pending = list(_pending.items())
+    for photo, (key, result) in pending:
+        try:
+            result.get(timeout)
+        except multiprocessing.TimeoutError:
+            pass  # Still running.
+        except Exception as ex:
+            # Lost by the pool, e.g. a dead worker: no callback comes.
+            _done(photo, key, ([], ex))
+
+
+def is_ready(photo, size=None, key=None):
+    """Whether a photo has its thumbnails (of one size) in the cache."""
+    key = key or digest(photo)
+    if key is None:
+        return False
+    for s in ([size] if size else SIZES):
+        name = cache_name(key, s)
+        if name not in _ready:
+            if not os.path.exists(os.path.join(base_path, name)):
+                return False
+            _ready.add(name)
+    return True
+
+
+def thumbnail_name(photo, size='list'):
+    """Static filename of the best image of a photo available now for a size."""
+    key = digest(photo)
+    if key is not None and is_ready(photo, size, key):
+        return cache_name(key, size)
+    if key is not None:
+        schedule(photo)
+    legacy = thumbgen_filename(photo)
+    if os.path.exists(os.path.join(base_path, legacy)):
+        return legacy
+    return photo
+
+
+def thumbnail_url(photo, size='list'):
+    if not photo:
+        return ''
+    return url_for('static', filename=thumbnail_name(photo, size))
+
+
+def backfill(photos):
+    """Queue thumbnails for existing photos, returns how many were queued."""
+    return sum(1 for photo in set(photos) if photo and schedule(photo))
+
+
+class ThumbnailUploadInput(ImageUploadInput):
+    def get_url(self, field):
+        return thumbnail_url(field.data)
+
+
+class ThumbnailUploadField(ImageUploadField):
+    """Image upload whose thumbnails are made in the background, see SIZES."""
+    widget = ThumbnailUploadInput()
+
+    def _save_thumbnail(self, data, filename, format):
+        schedule(filename)
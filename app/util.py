@@ -1,4 +1,4 @@
-from flask_admin.form import thumbgen_filename
+from thumbnails import thumbnail_url
 from jinja2 import Markup
 from flask import url_for
 from decimal import *
@@ -32,7 +32,7 @@ def color_boxes_html(colors):
     return html
 
 
-def image_icon_html(model, count=None):
+def image_icon_html(model, count=None, back_url=None):
     if not model.photo:
         return ''
     
@@ -41,14 +41,23 @@ def image_icon_html(model, count=None):
         num_worker = '<i class="glyphicon glyphicon-user">x%s</i>' % str(count)
 
     html = '<a href="%s"><img src="%s" width="50" height="50">%s</a>' % (
-        url_for('order.edit_view', id=model.id, url=url_for('order.index_view')),    
-        url_for('static', filename=thumbgen_filename(model.photo)),
+        url_for('order.edit_view', id=model.id, url=back_url or url_for('order.index_view')),    
+        thumbnail_url(model.photo, 'icon'),
         num_worker
     )
     
     return html
 
 
+def order_icons_html(orders):
+    """Icon strip of a machine's orders, the first one with its worker count."""
+    back_url = url_for('order.index_view')
+    html = ''
+    for i, o in enumerate(orders):
+        html += image_icon_html(o, o.product.num_employee_required if i == 0 else None, back_url)
+    return html
+
+
 def href_link_html(model_id, model_name):
     if not model_id or not model_name:
         return ''
@@ -60,23 +69,6 @@ def href_link_html(model_id, model_name):
     
     return html
 
-def slot_lead_to_machine(leads, machines):
-    resources = []
-    count = 0
-    lead = leads.pop()
-    for m in machines:
-        ratio = int(m.machine_to_lead_ratio.split('-')[0])
-        if len(leads) > 0 and count >= ratio:
-            lead = leads.pop()
-            count = 1 # reset 0 and just pop() above (1). So, sets to 1
-        else:
-            count += 1
-
-        resources.append(lead)
-
-    return (resources, leads)
-
-
 def num_estimate_per_shift(hours, order_remaining, time_to_build, unit_weight, raw_material_weight_per_bag):
     time = hours * 60 * 60
     estimate = Decimal(time) / Decimal(time_to_build)
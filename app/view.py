@@ -2,15 +2,19 @@ import os
 import os.path as op
 
 from app import app, db
+from flask_admin import expose
 from flask_admin.contrib.sqla import ModelView
 from model import Color, Machine, Product, Order, Shift, ProductionEntry, User, Role, Team, TeamRequest
 from flask_admin.model.form import InlineFormAdmin
-from flask_admin.form import thumbgen_filename, ImageUploadField, rules, DateTimeField, Select2Field
-from jinja2 import Markup
-from flask import url_for, redirect, render_template, request, abort, flash
+from flask_admin.form import ImageUploadField, rules, DateTimeField, Select2Field
+from jinja2 import Markup, contextfunction
+from flask import url_for, redirect, render_template, request, abort, flash, g, has_request_context, \
+    Response, stream_with_context
+from werkzeug.utils import secure_filename
 from sqlalchemy.event import listens_for
 from datetime import datetime, timedelta
-from util import display_time, color_boxes_html, image_icon_html, href_link_html
+import time
+from util import display_time, color_boxes_html, order_icons_html, href_link_html
 from wtforms import Form, SelectMultipleField, RadioField, validators, TextField
 from wtforms_components import ColorField, DateField
 from wtforms.validators import Required
@@ -21,6 +25,17 @@ from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
 from flask_admin.actions import action
 from flask_admin.babel import gettext, ngettext
 from flask_admin.model.typefmt import BASE_FORMATTERS, list_formatter
+from sqlalchemy.orm import ColumnProperty, defer, joinedload
+from collections import defaultdict
+import sqlalchemy.orm
+import keyset
+import count_cache
+import staff_cache
+import export
+import thumbnails
+from thumbnails import thumbnail_url, ThumbnailUploadField
+import changes
+import fragment_cache
 
 
 # Create directory for file fields to use
@@ -53,10 +68,13 @@ def date_format(view, value):
     return value.strftime('%d.%m.%Y %H:%M:%S')
 
 def timestamp_formatter(view, context, model, name):
+    # The "x ago" text is filled in by js/timeago.js, so the cell stays the
+    # same from one render to the next (see fragment_cache.py).
     field = getattr(model, name, None)
     if field and field.strftime("%Y-%m-%d %I:%M:%S"):
-        d = datetime.now() - field
-        return display_time(int(d.total_seconds())) + " ago"
+        html = '<time class="timeago" datetime="%s" data-epoch="%d" title="%s">%s</time>' % (
+            field.isoformat(), time.mktime(field.timetuple()), date_format(view, field), date_format(view, field))
+        return Markup(html)
     else:
         return ''
 
@@ -67,11 +85,217 @@ def timestamp_formatter(view, context, model, name):
 
 
 ####################### Login Required View ###################
+EAGER_LOADERS = dict(joined='joinedload', selectin='selectinload', subquery='subqueryload',
+                     contains='contains_eager')
+
 class RoleBasedModelView(ModelView):
     column_display_pk = True
     page_size = 20
     can_view_details = True
     # column_type_formatters = MY_DEFAULT_FORMATTERS
+    # Page with next/prev cursors instead of OFFSET and count(*), see keyset.py.
+    # Views turning it on use the 'admin/model/keyset_list.html' list template.
+    keyset_pagination = False
+    # Filtered counts over more rows than this are shown as "about N" estimates.
+    count_estimate_threshold = None
+    # Relationships loaded with the list page instead of once per row, as
+    # dotted paths to 'joined' (many-to-one) or 'selectin' (collections), e.g.
+    # {'product': 'joined', 'product.colors': 'selectin'}; 'contains' for a
+    # relationship get_query() joins itself.
+    column_eager_loads = None
+    # Wide columns the list page does not show, loaded on first access.
+    column_deferred = ()
+    # Export rows as they are read instead of loading the whole list, see export.py.
+    export_streaming = False
+    # Reuse the formatted list cells of unchanged rows, see fragment_cache.py.
+    fragment_cache = True
+    # Tables other than its own that the cells of a row read, e.g. ('product',).
+    fragment_cache_tables = ()
+    # Columns formatted on every render, e.g. ones with a cache of their own.
+    fragment_cache_exclude = ()
+
+    def __init__(self, *args, **kwargs):
+        if self.keyset_pagination:
+            self.simple_list_pager = True
+        super(RoleBasedModelView, self).__init__(*args, **kwargs)
+
+    def _count_query(self, column=None):
+        """Cached count(*) of the model, see count_cache.py."""
+        return count_cache.count_query(self.session, self.model, column, self.count_estimate_threshold)
+
+    def get_count_query(self):
+        return self._count_query()
+
+    def _load_options(self):
+        """Loader options of column_eager_loads and column_deferred."""
+        plan = self.column_eager_loads or {}
+        options = []
+        for path in sorted(plan):
+            names = path.split('.')
+            # Each step of the path loads with its own plan entry if it has one.
+            loader = sqlalchemy.orm
+            for i, name in enumerate(names):
+                strategy = plan.get('.'.join(names[:i + 1]), plan[path])
+                loader = getattr(loader, EAGER_LOADERS[strategy])(name)
+            options.append(loader)
+        options.extend(defer(name) for name in self.column_deferred)
+        return options
+
+    def scaffold_auto_joins(self):
+        # Flask-Admin joins every listed relationship, collections too; the
+        # plan decides for the relationships it names.
+        planned = set(path.split('.')[0] for path in self.column_eager_loads or ())
+        joins = super(RoleBasedModelView, self).scaffold_auto_joins()
+        return [j for j in joins if j.key not in planned]
+
+    def get_query(self):
+        query = super(RoleBasedModelView, self).get_query()
+        options = self._load_options()
+        return query.options(*options) if options else query
+
+    def _export_data(self):
+        if not self.export_streaming:
+            return super(RoleBasedModelView, self)._export_data()
+
+        view_args = self._get_list_extra_args()
+        sort_column = self._get_column_by_idx(view_args.sort)
+        if sort_column is not None:
+            sort_column = sort_column[0]
+        count, query = self.get_list(0, sort_column, view_args.sort_desc, view_args.search,
+                                     view_args.filters, execute=False, page_size=self.export_max_rows)
+        return count, query.yield_per(export.EXPORT_BATCH)
+
+    @expose('/export/<export_type>/')
+    def export(self, export_type):
+        if export_type != 'ndjson' or not self.can_export or export_type not in self.export_types:
+            return super(RoleBasedModelView, self).export(export_type)
+
+        count, data = self._export_data()
+        columns = [c[0] for c in self._export_columns]
+        rows = ([self.get_export_value(row, c) for c in columns] for row in data)
+        filename = secure_filename(self.get_export_name(export_type=export_type))
+        return Response(
+            stream_with_context(export.ndjson_lines(columns, rows)),
+            headers={'Content-Disposition': 'attachment;filename=%s' % filename},
+            mimetype=export.FORMATS['ndjson']
+        )
+
+    @contextfunction
+    def get_list_value(self, context, model, name):
+        if not self.fragment_cache or name in self.fragment_cache_exclude or not has_request_context():
+            return super(RoleBasedModelView, self).get_list_value(context, model, name)
+
+        row_key = fragment_cache.row_key(model)
+        if row_key is None:
+            return super(RoleBasedModelView, self).get_list_value(context, model, name)
+        cell_key = (self.endpoint, self._fragment_roles(), name)
+        version = self._fragment_version(row_key, model)
+        value = fragment_cache.get(row_key, cell_key, version)
+        if value is fragment_cache.MISSING:
+            value = fragment_cache.cacheable(
+                super(RoleBasedModelView, self).get_list_value(context, model, name))
+            fragment_cache.put(row_key, cell_key, version, value)
+        return value
+
+    def _fragment_roles(self):
+        if 'fragment_roles' not in g:
+            g.fragment_roles = tuple(sorted(r.name for r in current_user.roles))
+        return g.fragment_roles
+
+    def _fragment_version(self, row_key, model):
+        """(updated_at, table generations, thumbnails ready) of a row, once per request."""
+        versions = g.setdefault('fragment_versions', {})
+        version = versions.get(row_key)
+        if version is None:
+            # The row's own table too: updated_at only has seconds and other
+            # workers' updates do not evict here.
+            tables = (row_key[0],) + tuple(self.fragment_cache_tables)
+            photo = getattr(model, 'photo', None)
+            version = versions[row_key] = (
+                getattr(model, 'updated_at', None),
+                changes.generation(*tables),
+                thumbnails.is_ready(photo) if photo else None
+            )
+        return version
+
+    def _get_list_extra_args(self):
+        view_args = super(RoleBasedModelView, self)._get_list_extra_args()
+        # Cursors belong to one sort/filter, the sort and filter links start over.
+        view_args.extra_args.pop(keyset.AFTER, None)
+        view_args.extra_args.pop(keyset.BEFORE, None)
+        return view_args
+
+    def _keyset_page(self, sort_column, sort_desc):
+        """KeysetPage of the listed sort column, None when it needs a join."""
+        if sort_column is not None:
+            if self._sortable_joins.get(sort_column):
+                return None
+            column = self._sortable_columns.get(sort_column)
+        else:
+            order = self._get_default_order()
+            if order is None:
+                column, sort_desc = None, False
+            elif order[1]:
+                return None
+            else:
+                column, sort_desc = order[0], order[2]
+
+        pk = getattr(self.model, self._primary_key)
+        if column is None:
+            column = pk
+        if not isinstance(getattr(column, 'property', None), ColumnProperty):
+            return None
+
+        backwards = keyset.BEFORE in request.args
+        cursor = request.args.get(keyset.BEFORE if backwards else keyset.AFTER)
+        return keyset.KeysetPage(column, pk, bool(sort_desc),
+                                 keyset.decode_cursor(cursor) if cursor else None, backwards)
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        if getattr(g, 'keyset_page', None) is not None:
+            return query, joins
+        return super(RoleBasedModelView, self)._apply_sorting(query, joins, sort_column, sort_desc)
+
+    def _apply_pagination(self, query, page, page_size):
+        page_size = self.page_size if page_size is None else page_size
+        if getattr(g, 'keyset_page', None) is not None:
+            return g.keyset_page.apply(query, page_size)
+        return super(RoleBasedModelView, self)._apply_pagination(query, page, page_size)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        if not self.keyset_pagination or not execute or not has_request_context():
+            return super(RoleBasedModelView, self).get_list(
+                page, sort_column, sort_desc, search, filters, execute, page_size)
+
+        keyset_page = g.keyset_page = self._keyset_page(sort_column, sort_desc)
+        try:
+            count, data = super(RoleBasedModelView, self).get_list(
+                page, sort_column, sort_desc, search, filters, execute, page_size)
+        finally:
+            g.keyset_page = None
+
+        if keyset_page is not None:
+            data = keyset_page.finish(data, self.page_size if page_size is None else page_size)
+            g.keyset_pager = self._keyset_pager(keyset_page)
+        return count, data
+
+    def _keyset_pager(self, page):
+        args = request.args.to_dict()
+        for name in ('page', keyset.AFTER, keyset.BEFORE):
+            args.pop(name, None)
+        url = lambda **cursor: url_for('.index_view', **dict(args, **cursor))
+        return dict(
+            has_prev=page.has_prev,
+            has_next=page.has_next,
+            first_url=url(),
+            prev_url=url(**{keyset.BEFORE: page.prev_cursor}),
+            next_url=url(**{keyset.AFTER: page.next_cursor})
+        )
+
+    def render(self, template, **kwargs):
+        kwargs.setdefault('keyset_pager', g.get('keyset_pager'))
+        return super(RoleBasedModelView, self).render(template, **kwargs)
 
     def is_accessible(self):
         if not current_user.is_active or not current_user.is_authenticated:
@@ -160,23 +384,23 @@ class UserModelView(RoleBasedModelView):
     details_modal = True
     edit_modal = True
     column_list = ['photo', User.id, User.name, User.gender, User.is_in, 'shift', 'roles', User.active, User.email]
+    column_eager_loads = {'shift': 'joined', 'roles': 'selectin'}
+    fragment_cache_tables = ('shift', 'role', 'roles_users')
+    column_deferred = ('password',)
     form_columns = (User.name, User.gender, User.email, User.password, 'roles', 'shift',  User.phone, User.active, User.is_in, 'photo')
     
     def _list_thumbnail(view, context, model, name):
         if not model.photo:
             return ''
 
-        return Markup('<img src="%s">' % url_for('static',
-                                                 filename=thumbgen_filename(model.photo)))
+        return Markup('<img src="%s">' % thumbnail_url(model.photo))
 
     column_formatters = {
         'photo': _list_thumbnail
     }
 
     form_extra_fields = {
-        'photo': ImageUploadField('Image',
-                                      base_path=file_path,
-                                      thumbnail_size=(75, 75, True))
+        'photo': ThumbnailUploadField('Image', base_path=file_path)
     }
     # Sort the data by id in descending order.
     column_default_sort = ('id', True)
@@ -258,12 +482,18 @@ class ColorModelView(RoleBasedModelView):
     column_filters = ('id', 'name')
     
 
+# machine id -> (order/product generation, order signature, icon strip html)
+_order_strip_cache = {}
+
+
 class MachineModelView(RoleBasedModelView):
     details_modal = True
     edit_modal = True
     column_exclude_list = ['created_at']
     column_list = [Machine.id, Machine.name, Machine.status, 'machine_to_lead_ratio', Machine.average_num_workers, 'orders']
     column_searchable_list = (Machine.id, Machine.name, Machine.status)
+    # The order strips have their own cache, see _order_strips().
+    fragment_cache_exclude = ('orders',)
     column_labels = dict(
         average_num_workers='Scheduled Assemblers', machine_to_lead_ratio='Lead to Machine Ratio'
     )
@@ -272,21 +502,64 @@ class MachineModelView(RoleBasedModelView):
         if not model.photo:
             return ''
 
-        return Markup('<img src="%s">' % url_for('static',
-                                                 filename=thumbgen_filename(model.photo)))
+        return Markup('<img src="%s">' % thumbnail_url(model.photo))
 
-    def _all_orders(view, context, model, name):
-        non_completed_orders = db.session.query(Order).filter(and_(Order.assigned_machine_id == model.id, Order.status != 'COMPLETED')).all()
-        html = ''
-        is_first = True
-        for o in non_completed_orders:
-            if is_first:
-                is_first = False
-                html += image_icon_html(o, o.product.num_employee_required)
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        count, data = super(MachineModelView, self).get_list(
+            page, sort_column, sort_desc, search, filters, execute, page_size)
+        if execute and has_request_context():
+            g.order_strips = self._order_strips([m.id for m in data])
+        return count, data
+
+    def _open_orders_query(self, machine_ids):
+        return (
+            self.session.query(Order).options(joinedload(Order.product))
+            .filter(Order.assigned_machine_id.in_(machine_ids), Order.status.in_(Order.ACTIVE_STATUSES))
+            .order_by(Order.assigned_machine_id, Order.id)
+        )
+
+    def _order_strips(self, machine_ids):
+        """
+        Order icon strip html by machine id. The orders of all the machines
+        not cached for the current order/product generation are read in one
+        query; a strip is rendered again only if its orders changed.
+        """
+        generation = changes.generation('order', 'product')
+        strips = {}
+        stale = []
+        for machine_id in machine_ids:
+            cached = _order_strip_cache.get(machine_id)
+            if cached is not None and cached[0] == generation:
+                strips[machine_id] = cached[2]
+            else:
+                stale.append(machine_id)
+        if not stale:
+            return strips
+
+        orders = defaultdict(list)
+        for o in self._open_orders_query(stale):
+            orders[o.assigned_machine_id].append(o)
+
+        for machine_id in stale:
+            signature = tuple(
+                (o.id, o.product.photo, thumbnails.is_ready(o.product.photo, 'icon'), o.product.num_employee_required)
+                for o in orders[machine_id]
+            )
+            cached = _order_strip_cache.get(machine_id)
+            if cached is not None and cached[1] == signature:
+                html = cached[2]
             else:
-                html += image_icon_html(o)
+                html = order_icons_html(orders[machine_id])
+            _order_strip_cache[machine_id] = (generation, signature, html)
+            strips[machine_id] = html
+        return strips
 
-        return Markup(html)
+    def _all_orders(view, context, model, name):
+        strips = g.get('order_strips')
+        if strips is None or model.id not in strips:
+            strips = view._order_strips([model.id])
+        return Markup(strips[model.id])
 
     def _planned_workers(view, context, model, name):
         html = '<i class="glyphicon glyphicon-user">x%s</i>' % str(model.average_num_workers)
@@ -300,9 +573,7 @@ class MachineModelView(RoleBasedModelView):
     }
 
     form_extra_fields = {
-        'photo': ImageUploadField('Image',
-                                      base_path=file_path,
-                                      thumbnail_size=(75, 75, True))
+        'photo': ThumbnailUploadField('Image', base_path=file_path)
     }
     form_columns = ('name','status', 'power_in_kilowatt', 'photo', 'average_num_workers', 'machine_to_lead_ratio')
     # Sort the data by id in descending order.
@@ -320,6 +591,8 @@ class ProductModelView(RoleBasedModelView):
         Product.time_to_build, Product.num_employee_required, 'machine',
         Product.raw_material_weight_per_bag, Product.multi_colors_ratio
     )
+    column_eager_loads = {'colors': 'selectin', 'machine': 'joined'}
+    fragment_cache_tables = ('product_color', 'color', 'machine')
     # List column renaming
     column_labels = dict(
         selling_price='Price', num_employee_required='Employee Required', 
@@ -337,7 +610,7 @@ class ProductModelView(RoleBasedModelView):
             return ''
 
         return Markup('<img src="%s">' % 
-                url_for('static', filename=thumbgen_filename(model.photo))
+                thumbnail_url(model.photo)
             )
 
     column_formatters = {
@@ -370,9 +643,7 @@ class ProductModelView(RoleBasedModelView):
     # Alternative way to contribute field is to override it completely.
     # In this case, Flask-Admin won't attempt to merge various parameters for the field.
     form_extra_fields = {
-        'photo': ImageUploadField('Image',
-                                      base_path=file_path,
-                                      thumbnail_size=(75, 75, True))
+        'photo': ThumbnailUploadField('Image', base_path=file_path)
     }
     # Create form fields adjustment.
     # Sort the data by id in descending order.
@@ -421,8 +692,7 @@ class OrderModelView(RoleBasedModelView):
         if not model.photo:
             return ''
 
-        return Markup('<img src="%s">' % url_for('static',
-                                                 filename=thumbgen_filename(model.photo)))
+        return Markup('<img src="%s">' % thumbnail_url(model.photo))
 
     column_formatters = {
         'Product Photo': _list_thumbnail,
@@ -442,6 +712,13 @@ class OrderModelView(RoleBasedModelView):
         Order.assigned_machine_id,
         Order.production_start_at, Order.production_end_at
     )
+    column_eager_loads = {
+        'product': 'joined',
+        'product.colors': 'selectin',
+        'production_entry_orders': 'selectin'
+    }
+    fragment_cache_tables = ('product', 'product_color', 'color', 'production_entry')
+    column_deferred = ('note',)
 
     column_sortable_list = [ 'id', 'name', 'product', 'status', 
         'quantity', 'completed', 'estimated_time_to_complete',
@@ -469,19 +746,20 @@ class OrderModelView(RoleBasedModelView):
     column_default_sort = ('id', True)
 
 
-class UserLeadAjaxModelLoader(QueryAjaxModelLoader):
-    # Overrides Team lead name loader
+class RoleUserAjaxModelLoader(QueryAjaxModelLoader):
+    # Active users of one role by name prefix, see staff_cache.py.
+    role = None
+
     def get_list(self, term, offset=0, limit=10):
-        return (
-            db.session.query(User).filter(and_(User.active == true(), User.roles.any(name='lead'))).all()
-        )
+        return staff_cache.search(self.role, term, offset, limit)
+
+class UserLeadAjaxModelLoader(RoleUserAjaxModelLoader):
+    # Overrides Team lead name loader
+    role = 'lead'
 
-class UserAssemblerAjaxModelLoader(QueryAjaxModelLoader):
+class UserAssemblerAjaxModelLoader(RoleUserAjaxModelLoader):
     # Overrides Team assember name loader
-    def get_list(self, term, offset=0, limit=10):
-        return (
-            db.session.query(User).filter(and_(User.active == true(), User.roles.any(name='assembler'))).all()
-        )
+    role = 'assembler'
 
 
 class ProductionEntryModelView(RoleBasedModelView):
@@ -492,6 +770,20 @@ class ProductionEntryModelView(RoleBasedModelView):
         'id', 'shift', 'date', 'machine_id', 'order', 'Product Photo', 'Colors', 'status',
         'lead', 'members', 'remaining', 'num_estimate', 'raw_material_quantity_estimate', 'num_good', 'num_bad'
     )
+    column_eager_loads = {
+        'shift': 'joined',
+        'lead': 'joined',
+        'members': 'selectin',
+        'order': 'joined',
+        'order.product': 'joined',
+        'order.product.colors': 'selectin'
+    }
+    fragment_cache_tables = (
+        'shift', 'user', 'users_production_entries', 'order', 'product', 'product_color', 'color'
+    )
+    column_deferred = (
+        'num_hourly_good', 'num_hourly_bad', 'num_hourly_damage', 'total_bad_weight', 'total_damage_weight'
+    )
     column_sortable_list = [ 
         'id', 'shift', 'date', 'order',
          'num_good', 'num_bad'
@@ -501,10 +793,12 @@ class ProductionEntryModelView(RoleBasedModelView):
     # Sort entry by id descending order.
     column_default_sort = ('id', True)
     column_labels = dict(num_bad='Num Reject', num_estimate='Num Estimate', raw_material_quantity_estimate='Raw Material Quantity')
+    export_streaming = True
+    export_types = ['csv', 'ndjson']
     
     # Create form fields
     def order_status_filter():
-        return db.session.query(Order).filter(Order.status != 'COMPLETED')
+        return db.session.query(Order).filter(Order.status.in_(Order.ACTIVE_STATUSES))
 
     form_args = dict(
         order = dict(label='For Order', query_factory=order_status_filter)
@@ -554,7 +848,7 @@ class ProductionEntryModelView(RoleBasedModelView):
             return ''
 
         return Markup('<img src="%s">' % 
-                url_for('static', filename=thumbgen_filename(model.photo))
+                thumbnail_url(model.photo)
             )
 
     column_formatters = {
@@ -574,7 +868,10 @@ class ProductionEntryModelView(RoleBasedModelView):
 
 
 class TeamRequestModelView(RoleBasedModelView):
-    column_exclude_list = ['updated_at', 'day_off']
+    list_template = 'admin/model/team_request_list.html'
+    # The roster job writes the progress with plain SQL.
+    fragment_cache = False
+    column_exclude_list = ['updated_at', 'day_off', 'num_days', 'num_days_done', 'num_teams', 'error']
     column_default_sort = ('id', True)
     form_columns = ('start_date', 'end_date', 'day_off')
     column_labels = dict(id='Team Request Id')
@@ -606,13 +903,43 @@ class TeamRequestModelView(RoleBasedModelView):
         else:
             model.day_off = ''
 
+    def _status(view, context, model, name):
+        labels = dict(PENDING='default', RUNNING='info', DONE='success', FAILED='danger')
+        html = '<span class="label label-%s">%s</span>' % (labels.get(model.status, 'default'), model.status)
+        if model.status == 'FAILED' and model.error:
+            html += ' <small>%s</small>' % Markup.escape(model.error)
+        elif model.status != 'DONE':
+            percent = model.num_days_done * 100 / model.num_days if model.num_days else 0
+            html += (
+                '<div class="progress" style="margin: 4px 0 0;">'
+                '<div class="progress-bar" style="width: %d%%;">%d/%d days</div></div>'
+            ) % (percent, model.num_days_done, model.num_days)
+        elif model.num_teams:
+            html += ' <small>%d teams</small>' % model.num_teams
+        return Markup('<div class="team-request-status" data-status-url="%s">%s</div>' % (
+            url_for('team_request_status', request_id=model.id), html))
+
+    column_formatters = {
+        'status': _status
+    }
+
 
 class TeamModelView(RoleBasedModelView):
     details_modal = True
     edit_modal = True
+    keyset_pagination = True
+    list_template = 'admin/model/keyset_list.html'
     column_default_sort = ('date', False)
     column_sortable_list = [ 'id', 'date', 'machine' ]
     column_list = ['id', 'date', 'week_day', 'shift', 'machine', 'lead', 'members', 'standbys' ]
+    column_eager_loads = {
+        'shift': 'joined',
+        'machine': 'joined',
+        'lead': 'joined',
+        'members': 'selectin',
+        'standbys': 'selectin'
+    }
+    fragment_cache_tables = ('shift', 'machine', 'user', 'user_team', 'user_team_standbys')
     column_searchable_list = ('id', 'date')
     column_labels = dict(id='Team Id',week_day='Day')
     column_filters = ('date', 'shift.name','machine.name', 'lead.name', 'members.name')
@@ -645,29 +972,37 @@ class TeamModelView(RoleBasedModelView):
     
 ########################## Active Views ##############################
 class ActiveOrderModelView(OrderModelView):
+    count_estimate_threshold = 50000
+
     def is_accessible(self):
         result = super(OrderModelView, self).is_accessible()
         self.can_create = True
         return result
 
     def get_query(self):
-        return self.session.query(self.model).filter(self.model.status != 'COMPLETED')
+        active = self.model.status.in_(self.model.ACTIVE_STATUSES)
+        return super(ActiveOrderModelView, self).get_query().filter(active)
 
     def get_count_query(self):
-        return self.session.query(func.count('*')).filter(self.model.status != 'COMPLETED')
+        return self._count_query().filter(self.model.status.in_(self.model.ACTIVE_STATUSES)).as_base()
 
 
 class ActiveProductionEntryModelView(ProductionEntryModelView):
+    count_estimate_threshold = 50000
+    # The order comes with the join of the status filter.
+    column_eager_loads = dict(ProductionEntryModelView.column_eager_loads, order='contains')
+
     def is_accessible(self):
         result = super(ProductionEntryModelView, self).is_accessible()
         self.can_create = True
         return result
 
     def get_query(self):
-        return self.session.query(self.model).join(Order).filter(Order.status != 'COMPLETED')
+        active = Order.status.in_(Order.ACTIVE_STATUSES)
+        return super(ActiveProductionEntryModelView, self).get_query().join(Order).filter(active)
 
     def get_count_query(self):
-        return self.session.query(func.count(self.model.id)).join(Order).filter(Order.status != 'COMPLETED')
+        return self._count_query(self.model.id).join(Order).filter(Order.status.in_(Order.ACTIVE_STATUSES)).as_base()
 
 
 class ActiveTeamModelView(TeamModelView):
@@ -678,8 +1013,63 @@ class ActiveTeamModelView(TeamModelView):
 
     def get_query(self):
         today = datetime.now().date()
-        return self.session.query(self.model).filter(self.model.date >= today)
+        return super(ActiveTeamModelView, self).get_query().filter(self.model.date >= today)
 
     def get_count_query(self):
         today = datetime.now().date()
-        return self.session.query(func.count('*')).filter(self.model.date >= today)
+        return self._count_query().filter(self.model.date >= today).as_base()
+
+########################## History Views ##############################
+class HistoryModelView(RoleBasedModelView):
+    """Read-only views over every history partition (see history.py)."""
+    details_modal = True
+    column_default_sort = ('id', True)
+    keyset_pagination = True
+    list_template = 'admin/model/keyset_list.html'
+    export_streaming = True
+    # The partitions are written outside the ORM and not change-tracked.
+    fragment_cache = False
+    export_types = ['csv', 'ndjson']
+
+    def is_accessible(self):
+        result = super(HistoryModelView, self).is_accessible()
+        self.can_create = False
+        self.can_edit = False
+        self.can_delete = False
+        return result
+
+    def _list_thumbnail(view, context, model, name):
+        if not model.photo:
+            return ''
+
+        return Markup('<img src="%s">' % thumbnail_url(model.photo))
+
+
+class OrderHistoryModelView(HistoryModelView):
+    column_list = (
+        'id', 'name', 'product_name', 'Product Photo', 'quantity', 'machine_name',
+        'order_created_at', 'production_start_at', 'production_end_at', 'note'
+    )
+    column_sortable_list = ('id', 'name', 'product_name', 'machine_name', 'production_end_at')
+    column_searchable_list = ('name', 'product_name')
+    column_filters = ('id', 'name', 'product_name', 'machine_id', 'production_end_at')
+    column_labels = dict(id='Order Id', machine_name='Machine')
+    column_formatters = {
+        'Product Photo': HistoryModelView._list_thumbnail,
+        'production_start_at': timestamp_formatter,
+        'production_end_at': timestamp_formatter
+    }
+
+
+class ProductionEntryHistoryModelView(HistoryModelView):
+    column_list = (
+        'id', 'date', 'shift_name', 'machine_id', 'order_id', 'Product Photo',
+        'lead', 'assemblers', 'num_good', 'num_bad'
+    )
+    column_sortable_list = ('id', 'date', 'shift_name', 'order_id', 'num_good', 'num_bad')
+    column_searchable_list = ('lead', 'assemblers')
+    column_filters = ('date', 'shift_name', 'machine_id', 'order_id', 'lead')
+    column_labels = dict(shift_name='Shift', num_bad='Num Reject')
+    column_formatters = {
+        'Product Photo': HistoryModelView._list_thumbnail
+    }
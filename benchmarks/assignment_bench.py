@@ -0,0 +1,85 @@
+"""
+Roster assignment: the original greedy popping against roster.assign_shift(),
+in memory (no database), on synthetic machines and staff.
+
+    flask/bin/python -m benchmarks.assignment_bench --machines 300 --assemblers 3000 --days 30
+
+Reports the time per (date, shift) and the staffing quality over the days:
+machines left empty or short of workers, the most standbys on one team and
+the spread of standby days between workers.
+"""
+import argparse
+import random
+import time
+from collections import namedtuple, Counter
+from datetime import date, timedelta
+
+from app import roster
+from benchmarks.greedy_roster import slot_lead_to_machine, greedy_day
+
+MachineRow = namedtuple('MachineRow', 'id average_num_workers machine_to_lead_ratio')
+
+
+def synthetic_machines(count):
+    return [MachineRow(i + 1, str(2 + i % 5), '1-%d' % (1 + i % 3)) for i in range(count)]
+
+
+def run_greedy(days, machines, assemblers, leads):
+    shuffled = assemblers[:]
+    random.shuffle(shuffled)
+    lead_slot, extra = slot_lead_to_machine(leads[:], machines)
+    return [greedy_day(day, [1], machines, {1: shuffled}, lead_slot, extra) for day in days]
+
+
+def run_engine(days, machines, assemblers, leads):
+    fairness = roster.Fairness()
+    return [roster.assign_shift(day, 1, machines, assemblers, leads, fairness) for day in days]
+
+
+def quality(rosters, machines, assemblers):
+    demand = dict((m.id, int(m.average_num_workers)) for m in machines)
+    empty = short = most_standbys = 0
+    standby_days = Counter()
+    for teams in rosters:
+        staffed = dict((t.machine_id, len(t.members)) for t in teams)
+        empty += sum(1 for m in machines if not staffed.get(m.id))
+        short += sum(1 for m in machines if 0 < staffed.get(m.id, 0) < demand[m.id])
+        most_standbys = max([most_standbys] + [len(t.standbys) for t in teams])
+        standby_days.update(u for t in teams for u in t.standbys if u in assemblers)
+    counts = [standby_days[u] for u in assemblers]
+    return dict(
+        empty=float(empty) / len(rosters), short=float(short) / len(rosters),
+        most_standbys=most_standbys, standby_spread=max(counts) - min(counts)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--machines', type=int, default=300)
+    parser.add_argument('--assemblers', type=int, default=3000)
+    parser.add_argument('--leads', type=int, default=150)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    machines = synthetic_machines(args.machines)
+    assemblers = range(1, args.assemblers + 1)
+    leads = range(args.assemblers + 1, args.assemblers + args.leads + 1)
+    start = date.today()
+    days = [start + timedelta(days=d) for d in range(args.days)]
+    seats = sum(int(m.average_num_workers) for m in machines)
+    print 'machines=%d seats=%d assemblers=%d leads=%d days=%d' % (
+        args.machines, seats, args.assemblers, args.leads, args.days)
+
+    print '%-8s %12s %12s %12s %14s %15s' % (
+        '', 'ms/shift', 'empty/day', 'short/day', 'max standbys', 'standby spread')
+    for label, run in (('greedy', run_greedy), ('engine', run_engine)):
+        started = time.time()
+        rosters = run(days, machines, assemblers, leads)
+        elapsed = time.time() - started
+        q = quality(rosters, machines, set(assemblers))
+        print '%-8s %12.2f %12.1f %12.1f %14d %15d' % (
+            label, elapsed * 1000 / len(days), q['empty'], q['short'], q['most_standbys'], q['standby_spread'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Helpers shared by the benchmark scripts: a throw-away database filled with
+synthetic machines and staff.
+
+Run the scripts from the project root, e.g.
+
+    flask/bin/python -m benchmarks.roster_bench --machines 40 --assemblers 600
+"""
+import os
+import time
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import time as clock
+
+from run import app, db
+from app import changes, db_migrate, history
+from app.model import Machine, Shift, User, Role, roles_users
+
+
+@contextmanager
+def scratch_db():
+    """Point the app at an empty, fully migrated database in a temp directory."""
+    tmp_dir = tempfile.mkdtemp()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+    changes.set_notify_file(os.path.join(tmp_dir, 'bench.changes'))
+    history.set_directory(os.path.join(tmp_dir, 'history'))
+    with app.app_context():
+        db.create_all()
+        db_migrate.stamp(db.engine)
+        try:
+            yield db.engine
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def populate(engine, machines=20, assemblers=300, leads=20, shifts=3, workers_per_machine=4):
+    """Insert machines, shifts and active leads/assemblers spread over the shifts."""
+    with engine.begin() as connection:
+        connection.execute(Shift.__table__.insert(), [
+            dict(name='Shift %d' % s, start=clock((8 * s) % 24), end=clock((8 * s + 8) % 24), total_hours=8)
+            for s in range(shifts)
+        ])
+        connection.execute(Machine.__table__.insert(), [
+            dict(name='Machine %d' % m, status='ON', average_num_workers=str(workers_per_machine),
+                 machine_to_lead_ratio='1-%d' % (1 + m % 2))
+            for m in range(machines)
+        ])
+        connection.execute(Role.__table__.insert(), [dict(id=1, name='lead'), dict(id=2, name='assembler')])
+
+        users = []
+        links = []
+        for i in range(leads + assemblers):
+            users.append(dict(id=i + 1, name='User %d' % i, password='x', gender='M', active=True,
+                              shift_id=1 + i % shifts))
+            links.append(dict(user_id=i + 1, role_id=1 if i < leads else 2))
+        connection.execute(User.__table__.insert(), users)
+        connection.execute(roles_users.insert(), links)
+
+
+@contextmanager
+def timer(label, rows=None):
+    started = time.time()
+    result = {}
+    yield result
+    elapsed = time.time() - started
+    count = result.get('rows', rows)
+    if count:
+        print '%-32s %8d rows %8.3f s %10.0f rows/s' % (label, count, elapsed, count / elapsed)
+    else:
+        print '%-32s %8.3f s' % (label, elapsed)
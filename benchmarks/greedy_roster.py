@@ -0,0 +1,52 @@
+"""
+The original roster assignment, kept as the baseline for the benchmarks:
+leads and assemblers are shuffled and popped onto the machines in turn.
+"""
+from app.roster import TeamRow
+
+
+def slot_lead_to_machine(leads, machines):
+    resources = []
+    count = 0
+    lead = leads.pop()
+    for m in machines:
+        ratio = int(m.machine_to_lead_ratio.split('-')[0])
+        if len(leads) > 0 and count >= ratio:
+            lead = leads.pop()
+            count = 1 # reset 0 and just pop() above (1). So, sets to 1
+        else:
+            count += 1
+
+        resources.append(lead)
+
+    return (resources, leads)
+
+
+def greedy_day(day, shift_ids, machines, assembler_map, lead_slot, extra):
+    """
+    Fill machines with the assemblers of each shift in turn. Whoever is left
+    when every machine is full, plus the spare leads, stands by on the last team.
+    """
+    teams = []
+    for shift_id in shift_ids:
+        m_copy = machines[:]
+        leaders = lead_slot[:]
+        m = m_copy.pop()
+        l = leaders.pop()
+        members = []
+        standbys = []
+        for a in assembler_map.get(shift_id, []):
+            if len(members) < int(m.average_num_workers):
+                members.append(a)
+            elif len(m_copy) > 0:
+                teams.append(TeamRow(day, shift_id, m.id, l, members, []))
+                m = m_copy.pop()
+                l = leaders.pop()
+                members = [a]
+            else:
+                standbys.append(a)
+
+        if len(standbys) > 0 or len(members) > 0:
+            teams.append(TeamRow(day, shift_id, m.id, l, members, standbys + extra))
+
+    return teams
@@ -0,0 +1,69 @@
+"""
+Roster generation throughput: ORM add_all() (the previous implementation)
+against the executemany() writer in app.roster.
+
+    flask/bin/python -m benchmarks.roster_bench --days 90
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+from sqlalchemy.orm import sessionmaker
+from benchmarks.common import scratch_db, populate, timer
+from benchmarks.greedy_roster import slot_lead_to_machine, greedy_day
+from app import roster
+from app.model import Machine, Shift, User, Team, user_team_table, user_team_standbys_table
+
+
+def orm_generate(engine, start, end):
+    """The pre-executemany implementation: Team ORM objects flushed row by row."""
+    session = sessionmaker(bind=engine)()
+    machines = session.query(Machine).filter(Machine.status != 'NOT_IN_USE').all()
+    assemblers = session.query(User).filter(User.roles.any(name='assembler')).all()
+    leads = session.query(User).filter(User.roles.any(name='lead')).all()
+    shifts = session.query(Shift).all()
+    random.shuffle(assemblers)
+    random.shuffle(leads)
+    assembler_map = dict((s.id, [a for a in assemblers if a.shift_id == s.id]) for s in shifts)
+    lead_slot, extra = slot_lead_to_machine(leads, machines)
+
+    teams = []
+    for day in roster.roster_days(start, end, ''):
+        for t in greedy_day(day, [s.id for s in shifts], machines, assembler_map, lead_slot, extra):
+            teams.append(Team(date=t.date, shift_id=t.shift_id, machine_id=t.machine_id, user_id=t.user_id.id,
+                              members=t.members, standbys=t.standbys))
+    session.add_all(teams)
+    session.commit()
+    session.close()
+    return len(teams)
+
+
+def count_rows(engine):
+    with engine.connect() as connection:
+        return sum(connection.execute('SELECT count(*) FROM "%s"' % t).scalar()
+                   for t in (Team.__tablename__, user_team_table.name, user_team_standbys_table.name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--machines', type=int, default=40)
+    parser.add_argument('--assemblers', type=int, default=600)
+    parser.add_argument('--leads', type=int, default=40)
+    parser.add_argument('--days', type=int, default=90)
+    args = parser.parse_args()
+
+    start = date.today() + timedelta(days=1)
+    end = start + timedelta(days=args.days - 1)
+    print 'machines=%d assemblers=%d leads=%d days=%d' % (args.machines, args.assemblers, args.leads, args.days)
+
+    for label, generate in (('ORM add_all (before)', orm_generate),
+                            ('executemany chunks (after)', lambda e, s, n: roster.generate_teams(e, s, n, ''))):
+        with scratch_db() as engine:
+            populate(engine, machines=args.machines, assemblers=args.assemblers, leads=args.leads)
+            with timer(label) as result:
+                generate(engine, start, end)
+                result['rows'] = count_rows(engine)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Write and read throughput of the SQLite profiles of config.SQLITE_PROFILES
+(see app/db_tuning.py), on synthetic machines, staff, orders and
+production entries.
+
+    flask/bin/python -m benchmarks.sqlite_profiles_bench --entries 2000
+
+Writes are production entries with their hourly counts and order counters,
+once committed one entry at a time (the tablets) and once in big
+transactions (an import). Reads are the admin order list page query and the
+hourly production report.
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import select
+
+from benchmarks.common import scratch_db, populate, timer
+from run import app, db
+from app import db_tuning, report
+from app.model import (Product, Order, ProductionEntry, ProductionHourlyCount,
+                       refresh_order_progress)
+
+HOURS = 8
+
+
+def add_orders(engine, machines, orders_per_machine=5):
+    with engine.begin() as connection:
+        connection.execute(Product.__table__.insert(), [
+            dict(id=m + 1, name='Product %d' % m, weight=12.5, time_to_build=30, num_employee_required=3,
+                 raw_material_weight_per_bag=50, machine_id=m + 1)
+            for m in range(machines)
+        ])
+        connection.execute(Order.__table__.insert(), [
+            dict(name='Order %d-%d' % (m, o), status='IN_PROGRESS', quantity=100000, product_id=m + 1,
+                 raw_material_quantity=10, estimated_time_to_complete=3600, assigned_machine_id=m + 1)
+            for m in range(machines) for o in range(orders_per_machine)
+        ])
+        return [row.id for row in connection.execute(select([Order.__table__.c.id]))]
+
+
+def write_entries(engine, order_ids, leads, count, per_commit, first_day):
+    """Insert `count` entries, `per_commit` per transaction, as the app writes them."""
+    entry_table = ProductionEntry.__table__
+    hourly_table = ProductionHourlyCount.__table__
+    done = 0
+    while done < count:
+        size = min(per_commit, count - done)
+        with engine.begin() as connection:
+            entries = []
+            for i in range(done, done + size):
+                good = [random.randint(20, 60) for _ in range(HOURS)]
+                entries.append(dict(
+                    shift_id=1 + i % 3, order_id=random.choice(order_ids), user_id=random.randint(1, leads),
+                    date=first_day + timedelta(days=i // 200), num_good=sum(good),
+                    num_hourly_good=','.join(map(str, good)), num_bad=0
+                ))
+            for entry in entries:
+                entry['id'] = connection.execute(entry_table.insert(), entry).inserted_primary_key[0]
+            connection.execute(hourly_table.insert(), [
+                dict(entry_id=e['id'], hour_index=h, good=int(g), bad=0, damage=0)
+                for e in entries for h, g in enumerate(e['num_hourly_good'].split(','))
+            ])
+            refresh_order_progress(connection, set(e['order_id'] for e in entries))
+        done += size
+    return done
+
+
+def read_order_pages(engine, pages):
+    order_table, product_table = Order.__table__, Product.__table__
+    query = (
+        select([order_table, product_table.c.name.label('product_name')])
+        .select_from(order_table.join(product_table, product_table.c.id == order_table.c.product_id))
+        .where(order_table.c.status != 'COMPLETED')
+        .order_by(order_table.c.id.desc())
+    )
+    rows = 0
+    with engine.connect() as connection:
+        for page in range(pages):
+            rows += len(connection.execute(query.limit(20).offset((page % 10) * 20)).fetchall())
+    return rows
+
+
+def read_reports(count, first_day):
+    rows = 0
+    for i in range(count):
+        day = first_day + timedelta(days=i % 10)
+        rows += len(report.hourly_output(db.session, day, day + timedelta(days=6)).all())
+        db.session.remove()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--machines', type=int, default=40)
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=500, help='Entries per transaction of the bulk write.')
+    parser.add_argument('--reads', type=int, default=500)
+    parser.add_argument('--profiles', nargs='*', help='Profiles to run, all by default.')
+    args = parser.parse_args()
+
+    profiles = args.profiles or sorted(app.config['SQLITE_PROFILES'])
+    first_day = date.today() - timedelta(days=30)
+    print 'machines=%d entries=%d batch=%d reads=%d' % (args.machines, args.entries, args.batch, args.reads)
+
+    for name in profiles:
+        app.config['SQLITE_PROFILE'] = name
+        random.seed(1)
+        with scratch_db() as engine:
+            print '\n%s: %s' % (name, ', '.join('%s=%s' % s for s in db_tuning.report(engine)))
+            populate(engine, machines=args.machines)
+            order_ids = add_orders(engine, args.machines)
+
+            with timer('commit per entry', args.entries):
+                write_entries(engine, order_ids, 20, args.entries, 1, first_day)
+            with timer('%d entries per commit' % args.batch, args.entries):
+                write_entries(engine, order_ids, 20, args.entries, args.batch, first_day)
+            with timer('order list pages') as result:
+                read_order_pages(engine, args.reads)
+                result['rows'] = args.reads
+            with timer('hourly reports') as result:
+                read_reports(args.reads // 10, first_day)
+                result['rows'] = args.reads // 10
+
+
+if __name__ == '__main__':
+    main()
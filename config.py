@@ -8,6 +8,73 @@ SECRET_KEY = '123456790'
 DATABASE_FILE = 'prod-mgmt.db'
 SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, DATABASE_FILE)
 SQLALCHEMY_ECHO = False # Print SQL into logs
+# SQLite PRAGMAs of every connection, by profile (see app/db_tuning.py).
+# SQLITE_PROFILE=bulk-load in the environment for imports and archive runs.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'safe')
+SQLITE_PROFILES = {
+    # Durable: a crash of the app loses nothing, a power cut at most the last commits.
+    'safe': {
+        'busy_timeout': 5000,           # ms a writer waits for the lock
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,           # KiB, 64 MB per connection
+        'mmap_size': 268435456,         # 256 MB
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,     # pages
+        'foreign_keys': 'ON'
+    },
+    # No fsync at all, the previous settings: a power cut can corrupt the file.
+    'fast': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,          # 256 MB
+        'mmap_size': 1073741824,        # 1 GB
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,
+        'foreign_keys': 'ON'
+    },
+    # One big writer: large caches, checkpoints left to the WAL checkpointer,
+    # which every engine of this profile starts.
+    'bulk-load': {
+        'busy_timeout': 30000,
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -524288,          # 512 MB
+        'mmap_size': 1073741824,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 0,
+        'foreign_keys': 'ON'
+    }
+}
+# Connections kept open by the read-only engine of the History views,
+# exports, dashboard and reports (see app/db_reader.py).
+SQLITE_READER_POOL_SIZE = 5
+# Checkpoint the WAL from a background thread once it is bigger than this,
+# e.g. after long history reads kept SQLite from recycling it.
+WAL_CHECKPOINT_INTERVAL = 30                   # seconds between size checks
+WAL_CHECKPOINT_PASSIVE_BYTES = 16 * 1024 * 1024
+WAL_CHECKPOINT_TRUNCATE_BYTES = 64 * 1024 * 1024
+# Shared by all gunicorn workers to broadcast committed table changes.
+CHANGE_NOTIFY_FILE = os.path.join(basedir, 'prod-mgmt.changes')
+# Archived orders go to one history-YYYY.db file per year in here.
+HISTORY_DIR = os.path.join(basedir, 'history')
+# Nightly online backups of the database and the history partitions, see app/db_backup.py.
+# Run by `flask backup` from cron (e.g. 30 2 * * *): the JOBS below are not started.
+BACKUP_DIR = os.path.join(basedir, 'backups')
+BACKUP_COMPRESSION = 'gzip'
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.05
+# Backups older than BACKUP_KEEP_DAYS are removed, except the newest BACKUP_KEEP_LAST.
+BACKUP_KEEP_DAYS = 7
+BACKUP_KEEP_LAST = 3
+# Change log segments shipped between the full backups, see app/change_log.py.
+BACKUP_CHANGES_DIR = os.path.join(BACKUP_DIR, 'changes')
+# Seconds between change log shipments by the app, None to leave them to
+# `flask ship-changes`.
+BACKUP_SHIP_INTERVAL = 60
+# Fingerprint static files and write their .gz/.br siblings when the app starts.
+ASSETS_BUILD_ON_STARTUP = True
 
 # Flask-Security config
 SECURITY_URL_PREFIX = "/admin"
@@ -49,5 +116,13 @@ JOBS = [
         'args': (),
         'trigger': 'interval',
         'seconds': 3600
+    },
+    {
+        'id': 'backup_job',
+        'func': 'app.scheduler:backup_job',
+        'args': (),
+        'trigger': 'cron',
+        'hour': 2,
+        'minute': 30
     }
 ]
\ No newline at end of file
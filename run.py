@@ -14,21 +14,33 @@ from app.view import (
     RoleBasedModelView, UserModelView, RoleModelView,
     TeamRequestModelView, TeamModelView,
     ActiveOrderModelView, ActiveProductionEntryModelView,
-    ActiveTeamModelView
+    ActiveTeamModelView, OrderHistoryModelView, ProductionEntryHistoryModelView
 )
 from app import app, admin, db
 from flask_admin.consts import ICON_TYPE_GLYPH
 from flask_admin.contrib.sqla import ModelView
 from app.model import Color, Machine, Product, Order, Shift, ProductionEntry, User, Role, Team, TeamRequest
-from flask_security import Security, SQLAlchemyUserDatastore
+from app.model import OrderHistoryAll, ProductionEntryHistoryAll
+from flask_security import Security, SQLAlchemyUserDatastore, login_required, roles_accepted
 from flask_admin import helpers as admin_helpers
 from flask_apscheduler import APScheduler
-from flask import send_from_directory, jsonify
+from flask import send_from_directory, jsonify, make_response, request, Response, stream_with_context, abort
+from datetime import datetime, date
 from app.build_db import build_sample_db
-from decimal import *
+from app.dashboard import snapshot as dashboard_snapshot, event_stream as dashboard_event_stream
+from app import changes, db_migrate, report, production_batch, roster, scheduler, history, export, thumbnails, assets, db_tuning, db_reader, db_backup, change_log
+from app.model import refresh_order_progress, order_progress_mismatches
+import click
 
 ################ config.py ####################
 app.config.from_object('config')
+changes.set_notify_file(app.config.get('CHANGE_NOTIFY_FILE'))
+history.set_directory(app.config.get('HISTORY_DIR'))
+assets.register('send_dist', os.path.join(app.root_path, 'static'))
+assets.register('static', app.static_folder)
+app.add_template_global(assets.asset_url)
+if app.config.get('ASSETS_BUILD_ON_STARTUP'):
+    assets.build_all()
 
 
 ################ Flask Admin View Setup #######################
@@ -44,9 +56,9 @@ admin.add_view(RoleModelView(Role, db.session, category='Employee', menu_class_n
 admin.add_view(UserModelView(User, db.session, category='Employee', menu_class_name='shift', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-user'))
 admin.add_view(TeamRequestModelView(TeamRequest, db.session, category='Employee', menu_class_name='shift', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-random'))
 admin.add_view(ActiveTeamModelView(Team, db.session, category='Employee', menu_class_name='shift', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-calendar'))
-# History
-admin.add_view(OrderModelView(Order, db.session, endpoint="order_history", category='History', menu_class_name='order', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-shopping-cart'))
-admin.add_view(ProductionEntryModelView(ProductionEntry, db.session, endpoint="productionentry_history", category='History', menu_class_name='production_entry', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-list'))
+# History, read on the read-only engine (see app/db_reader.py)
+admin.add_view(OrderHistoryModelView(OrderHistoryAll, db_reader.session, name='Order', endpoint="order_history", category='History', menu_class_name='order', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-shopping-cart'))
+admin.add_view(ProductionEntryHistoryModelView(ProductionEntryHistoryAll, db_reader.session, name='Production Entry', endpoint="productionentry_history", category='History', menu_class_name='production_entry', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-list'))
 admin.add_view(TeamModelView(Team, db.session, endpoint="team_history", category='History', menu_class_name='shift', menu_icon_type=ICON_TYPE_GLYPH, menu_icon_value='glyphicon glyphicon-calendar'))
 ####################### Flask Security ####################
 # Initialize the SQLAlchemy data store and Flask-Security.
@@ -66,17 +78,12 @@ def security_context_processor():
     )
 
 ################ SQLite Optimization ######################
-from sqlalchemy.engine import Engine
-from sqlalchemy import event
-
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA journal_mode=WAL")
-    cursor.execute("PRAGMA synchronous=OFF")
-    cursor.execute("PRAGMA cache_size=100000")
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
+# The PRAGMAs are set per engine from SQLITE_PROFILE, see app/db_tuning.py.
+db_tuning.checkpointer.interval = app.config.get('WAL_CHECKPOINT_INTERVAL', 30)
+db_tuning.checkpointer.passive_bytes = app.config.get('WAL_CHECKPOINT_PASSIVE_BYTES')
+db_tuning.checkpointer.truncate_bytes = app.config.get('WAL_CHECKPOINT_TRUNCATE_BYTES')
+# The change log goes to BACKUP_CHANGES_DIR, see app/change_log.py.
+change_log.shipper.interval = app.config.get('BACKUP_SHIP_INTERVAL') or 60
 
 
 ################ Flask-APScheduler #################
@@ -86,9 +93,15 @@ def job1(a, b):
 
 
 ###################### Routes ######################
-@app.route('/static/<path:path>')
-def send_dist(path):
-    return send_from_directory(os.path.join(app.root_path, 'static'), path)
+@app.route('/static/<path:filename>')
+def send_dist(filename):
+    return assets.send_asset(assets.roots['send_dist'], filename)
+
+def send_files(filename):
+    return assets.send_asset(assets.roots['static'], filename)
+
+# Uploads are served from Flask's own static endpoint, with the same headers.
+app.view_functions['static'] = send_files
 
 @app.route('/')
 def index():
@@ -97,24 +110,196 @@ def index():
 
 @app.route('/api/dashboard')
 def dashboard():
-    orders = db.session.query(Order).filter(Order.status == 'IN_PROGRESS').all()
-    data = []
-    for o in orders:
-        o_map = {}
-        o_map['id'] = o.id
-        o_map['photo'] = o.photo
-        o_map['quantity'] = o.quantity
-        o_map['completed'] = o.completed
-        o_map['total_bad'] = o.total_bad
-        percent = ( Decimal(o.completed) / Decimal(o.quantity) ) * 100
-        percent = int(Decimal(percent).quantize(Decimal('1.'), rounding=ROUND_UP))
-        o_map['percent'] = percent
-        o_map['machine_product'] = '[%s] %s - %s' % ( str(o.assigned_machine.id), o.assigned_machine.name, o.product.name)
-        data.append(o_map)
-
-    return jsonify(data)
+    snapshot = dashboard_snapshot.refresh(db_reader.session)
+    response = make_response(snapshot.payload)
+    response.mimetype = 'application/json'
+    # Let the screens revalidate every poll, unchanged data comes back as 304.
+    response.cache_control.no_cache = True
+    response.set_etag(snapshot.etag)
+    return response.make_conditional(request)
+
+@app.route('/api/dashboard/stream')
+def dashboard_stream():
+    events = dashboard_event_stream(dashboard_snapshot, db_reader.session)
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
     
 
+def _date_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400)
+
+@app.route('/api/report/hourly')
+@login_required
+def hourly_report():
+    today = date.today()
+    start = _date_arg('start', today)
+    end = _date_arg('end', start)
+    machine_id = request.args.get('machine_id', type=int)
+    return jsonify(report.to_dicts(report.hourly_output(db_reader.session, start, end, machine_id)))
+
+@app.route('/api/report/shift')
+@login_required
+def shift_report():
+    today = date.today()
+    start = _date_arg('start', today)
+    end = _date_arg('end', start)
+    machine_id = request.args.get('machine_id', type=int)
+    return jsonify(report.to_dicts(report.shift_output(db_reader.session, start, end, machine_id)))
+
+
+@app.route('/api/production_entries/batch', methods=['POST'])
+@login_required
+@roles_accepted('admin', 'manager', 'lead')
+def production_entry_batch():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('entries'), list):
+        return jsonify(errors=[dict(index=None, errors={'entries': 'expected {"entries": [...]}'})]), 400
+
+    plan, errors = production_batch.validate_batch(db.session, payload)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    saved = production_batch.apply_batch(db.session, plan)
+    app.logger.info('Saved batch of %d production entries' % len(saved))
+    return jsonify(entries=saved)
+
+
+@app.route('/api/team_request/<int:request_id>/status')
+@login_required
+def team_request_status(request_id):
+    team_request = TeamRequest.query.get_or_404(request_id)
+    return jsonify(team_request.to_dict())
+
+
+@app.route('/api/export/<table>')
+@login_required
+@roles_accepted('admin')
+def export_table(table):
+    """Whole table as CSV (?format=ndjson for JSON lines), gzipped with ?gzip=1."""
+    tables = export.export_tables()
+    fmt = request.args.get('format', 'csv')
+    if table not in tables or fmt not in export.FORMATS:
+        abort(404)
+
+    filename = '%s.%s' % (table, fmt)
+    mimetype = export.FORMATS[fmt]
+    lines = export.stream_table(db_reader.engine(), tables[table], fmt)
+    if request.args.get('gzip', type=int):
+        lines = export.gzipped(lines)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return Response(stream_with_context(lines), mimetype=mimetype, headers={
+        'Content-Disposition': 'attachment;filename=%s' % filename,
+        'X-Accel-Buffering': 'no'
+    })
+
+
+######################## CLI ########################
+@app.cli.command('migrate')
+def migrate_command():
+    """Upgrade the database schema to the latest version."""
+    applied = db_migrate.upgrade(db.engine)
+    click.echo('Applied %d migration(s), schema version %d.' % (applied, db_migrate.head()))
+
+@app.cli.command('sqlite-settings')
+@click.option('--checkpoint', type=click.Choice(['PASSIVE', 'TRUNCATE']), help='Also checkpoint the WAL.')
+def sqlite_settings_command(checkpoint):
+    """Show the SQLite settings in effect (and checkpoint the WAL)."""
+    click.echo('Profile %s of %s' % (db_tuning.profile_of(db.engine), db.engine.url.database))
+    for pragma, value in db_tuning.report(db.engine):
+        click.echo('  %-20s %s' % (pragma, value))
+    database = db.engine.url.database
+    if checkpoint and database:
+        busy, pages, done = db_tuning.checkpoint(database, checkpoint)
+        click.echo('WAL checkpoint(%s): %d/%d pages%s' % (checkpoint, done, pages, ', busy' if busy else ''))
+
+@app.cli.command('assets')
+def assets_command():
+    """Fingerprint and precompress the static files."""
+    for endpoint, directory in sorted(assets.roots.items()):
+        files, compressed = assets.build(directory)
+        click.echo('%s: %d file(s), %d compressed sibling(s) written.' % (directory, files, compressed))
+
+@app.cli.command('thumbnails')
+def thumbnails_command():
+    """Generate the missing thumbnails of every uploaded photo."""
+    photos = [p for model in (User, Machine, Product) for (p,) in db.session.query(model.photo)]
+    queued = thumbnails.backfill(photos)
+    thumbnails.wait()
+    click.echo('Generated thumbnails of %d photo(s).' % queued)
+
+@app.cli.command('order-progress')
+@click.option('--verify', is_flag=True, help='Only report orders whose counters are off.')
+def order_progress_command(verify):
+    """Rebuild (or verify) the stored order completed/total_bad counters."""
+    with db.engine.begin() as connection:
+        mismatches = order_progress_mismatches(connection)
+        for m in mismatches:
+            click.echo('order %d: completed %d/%d, total_bad %d/%d (stored/actual)' % (
+                m[0], m[1], m[3], m[2], m[4]))
+        if not verify:
+            count = refresh_order_progress(connection)
+            click.echo('Rebuilt counters of %d order(s).' % count)
+        elif not mismatches:
+            click.echo('All order counters are correct.')
+
+    if mismatches and not verify:
+        changes.bump('order')
+
+@app.cli.command('archive-orders')
+@click.option('--chunk-size', default=scheduler.ARCHIVE_CHUNK_SIZE, help='Orders moved per transaction.')
+def archive_orders_command(chunk_size):
+    """Move completed orders and their production entries to history."""
+    orders, entries = scheduler.archive_orders(db.engine, chunk_size=chunk_size)
+    click.echo('Archived %d order(s), %d production entry(ies).' % (orders, entries))
+
+@app.cli.command('backup')
+@click.option('--backup-dir', help='Where the backups go, BACKUP_DIR by default.')
+@click.option('--compression', type=click.Choice(db_backup.compressions()), help='BACKUP_COMPRESSION by default.')
+def backup_command(backup_dir, compression):
+    """Back up the database and the history partitions, remove expired backups."""
+    backup_dir = backup_dir or app.config['BACKUP_DIR']
+    compression = compression or app.config['BACKUP_COMPRESSION']
+    written = scheduler.backup_databases(db.engine, backup_dir, compression, app.config['BACKUP_KEEP_DAYS'],
+                                         app.config['BACKUP_KEEP_LAST'], app.config['BACKUP_CHANGES_DIR'])
+    click.echo('Wrote %d backup(s) to %s.' % (len(written), backup_dir))
+
+@app.cli.command('ship-changes')
+def ship_changes_command():
+    """Move the change log into segment files for incremental backups."""
+    segment_dir = app.config['BACKUP_CHANGES_DIR']
+    lock_file = change_log.try_ship_lock(segment_dir)
+    if lock_file is None:
+        raise click.ClickException('A running app is shipping the change log to %s.' % segment_dir)
+    try:
+        segments = change_log.ship(db.engine, segment_dir)
+    finally:
+        lock_file.close()
+    click.echo('Wrote %d segment(s) to %s.' % (len(segments), segment_dir))
+
+@app.cli.command('restore-backup')
+@click.argument('target')
+@click.option('--backup', help='Full backup to start from, the newest of the database by default.')
+@click.option('--until', type=int, help='Last change (seq) to replay.')
+def restore_backup_command(target, backup, until):
+    """Restore the last full backup and the change log segments to TARGET."""
+    if not backup:
+        backups = db_backup.list_backups(app.config['BACKUP_DIR']).get(op.basename(db.engine.url.database))
+        if not backups:
+            raise click.ClickException('No backup of %s in %s' % (db.engine.url.database, app.config['BACKUP_DIR']))
+        backup = op.join(app.config['BACKUP_DIR'], backups[0][1])
+    segments, replayed = db_backup.restore(backup, app.config['BACKUP_CHANGES_DIR'], target, until)
+    click.echo('Restored %s: %s and %d change(s) from %d segment(s).' % (target, backup, replayed, segments))
+
+
 ####################### init ##########################
 def init_db_data():
     app_dir = op.realpath(os.path.dirname(__file__))
@@ -133,6 +318,36 @@ def init_logger():
     app.logger.handlers.extend(gunicorn_access_handlers)
 
 
+@app.before_first_request
+def migrate_db():
+    database = db.engine.url.database
+    if database and not op.exists(database):
+        # Nothing to migrate, init_db_data() builds a current schema.
+        return
+    applied = db_migrate.upgrade(db.engine)
+    if applied:
+        app.logger.info('Applied %d database migration(s)' % applied)
+
+@app.before_first_request
+def tune_db():
+    database = db.engine.url.database
+    if database and op.exists(database):
+        settings = ', '.join('%s=%s' % s for s in db_tuning.report(db.engine))
+        app.logger.info('SQLite profile %s: %s' % (db_tuning.profile_of(db.engine), settings))
+        db_tuning.checkpointer.start(database)
+
+@app.before_first_request
+def resume_team_requests():
+    # Requests queued by a worker that stopped before running them.
+    if op.exists(db.engine.url.database or ''):
+        roster.worker.resume(db.engine)
+
+@app.before_first_request
+def ship_changes():
+    # One worker at a time ships the change log, see app/change_log.py.
+    if app.config.get('BACKUP_SHIP_INTERVAL') and op.exists(db.engine.url.database or ''):
+        change_log.shipper.start(db.engine, app.config['BACKUP_CHANGES_DIR'])
+
 @app.before_first_request
 def setup_logging():
     if not app.debug:
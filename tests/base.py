@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from run import app, db, user_datastore
+from app.build_db import build_sample_db
+from app import changes, history, thumbnails, db_reader
+
+
+class AppTestCase(unittest.TestCase):
+    """Runs the app against a freshly built sample DB in a temp directory."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(cls.tmp_dir, 'test.db')
+        changes.set_notify_file(os.path.join(cls.tmp_dir, 'test.changes'))
+        history.set_directory(os.path.join(cls.tmp_dir, 'history'))
+        thumbnails.set_directory(os.path.join(cls.tmp_dir, 'files'))
+        # The tests ship the change log themselves.
+        app.config['BACKUP_CHANGES_DIR'] = os.path.join(cls.tmp_dir, 'changes')
+        app.config['BACKUP_SHIP_INTERVAL'] = None
+        with app.app_context():
+            build_sample_db(user_datastore)
+            db.session.remove()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+            db_reader.dispose()
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def login(self, email='admin@gmail.com', password='emp0wer*'):
+        return self.client.post('/admin/login/', data=dict(email=email, password=password),
+                                follow_redirects=True)
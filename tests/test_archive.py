@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import unittest
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from tests.base import AppTestCase
+from app import db, db_migrate, history, report
+from app.model import (Order, ProductionEntry, ProductionHourlyCount, OrderHistory,
+                       OrderHistoryAll, ProductionEntryHistoryAll)
+from app.scheduler import archive_orders, ARCHIVE_ORDERS_SQL, ARCHIVE_ENTRIES_SQL, ARCHIVE_HOURLY_SQL
+
+
+class ArchiveTestCase(AppTestCase):
+
+    def complete(self, *order_ids, **kwargs):
+        for order in Order.query.filter(Order.id.in_(order_ids)):
+            order.status = 'COMPLETED'
+            order.production_end_at = kwargs.get('end_at', datetime(2017, 6, 1))
+        db.session.commit()
+
+    def new_order(self):
+        order = Order(name='Again', product_id=1, quantity=10, raw_material_quantity=1, estimated_time_to_complete=1)
+        db.session.add(order)
+        db.session.commit()
+        return order.id
+
+    def test_archived_ids_are_not_handed_out_again(self):
+        self.complete(4)
+        self.assertEqual(archive_orders(db.engine, pause=0), (1, 0))
+        self.assertTrue(self.new_order() > 4)
+
+    def test_completed_orders_move_to_history(self):
+        entry = ProductionEntry.query.filter_by(order_id=1).first()
+        entry.num_hourly_good = '10,20'
+        db.session.commit()
+        entry_id, lead = entry.id, entry.lead.name
+        assemblers = sorted(m.name for m in entry.members)
+        entries = ProductionEntry.query.filter(ProductionEntry.order_id.in_([1, 2])).count()
+        day = entry.date
+        reports = lambda: (report.to_dicts(report.hourly_output(db.session, day, day)),
+                           report.to_dicts(report.shift_output(db.session, day, day)))
+        before = reports()
+        self.assertTrue(before[0])
+        self.complete(1)
+        self.complete(2, end_at=datetime(2018, 1, 2))
+
+        # Completed orders show in history before they are archived.
+        self.assertEqual(sorted(o.id for o in db.session.query(OrderHistoryAll) if o.id <= 2), [1, 2])
+
+        self.assertEqual(archive_orders(db.engine, chunk_size=1, pause=0), (2, entries))
+        db.session.remove()
+
+        self.assertEqual(Order.query.filter(Order.id.in_([1, 2])).count(), 0)
+        self.assertEqual(ProductionEntry.query.filter(ProductionEntry.order_id.in_([1, 2])).count(), 0)
+        self.assertEqual(ProductionHourlyCount.query.filter_by(entry_id=entry_id).count(), 0)
+        self.assertTrue(Order.query.count() > 0)
+
+        # One partition per year, nothing left in the live database.
+        self.assertEqual(history.years(), (2017, 2018))
+        self.assertTrue(os.path.exists(history.partition_path(2017)))
+        self.assertEqual(OrderHistory.query.count(), 0)
+        self.assertEqual(db.session.execute('SELECT id FROM history_2018.order_history').fetchall(), [(2,)])
+
+        self.assertEqual(sorted(o.id for o in db.session.query(OrderHistoryAll) if o.id <= 2), [1, 2])
+        archived = db.session.query(ProductionEntryHistoryAll).get(entry_id)
+        self.assertEqual((archived.order_id, archived.lead, archived.num_good), (1, lead, 30))
+        self.assertEqual(archived.order.production_end_at, datetime(2017, 6, 1))
+        self.assertEqual(sorted(archived.assemblers.split(',')), assemblers)
+
+        # The reports still count the archived hours.
+        self.assertEqual(reports(), before)
+        self.assertEqual(db.session.execute(
+            'SELECT good FROM history_2017.production_hourly_count_history WHERE entry_id = :id ORDER BY hour_index',
+            dict(id=entry_id)).fetchall(), [(10,), (20,)])
+
+        # Nothing left to do.
+        self.assertEqual(archive_orders(db.engine), (0, 0))
+
+    def test_old_partitions_get_the_hourly_count_table(self):
+        path = history.ensure_partition(2015)
+        connection = sqlite3.connect(path)
+        connection.execute('DROP TABLE production_hourly_count_history')
+        connection.commit()
+        connection.close()
+
+        self.assertEqual(history.upgrade_partitions(), [2015])
+        self.assertEqual(history.upgrade_partitions(), [])
+        connection = sqlite3.connect(path)
+        self.assertEqual(connection.execute('SELECT count(*) FROM production_hourly_count_history').fetchone(), (0,))
+        connection.close()
+
+    def test_rerun_skips_only_the_rows_already_copied(self):
+        self.complete(3)
+        history.ensure_partition(2017)
+        db.session.remove()
+        params = {'ids': '?', 'schema': history.partition_schema(2017)}
+        # Copied, then a crash before the delete.
+        with db.engine.begin() as connection:
+            for sql in (ARCHIVE_ORDERS_SQL, ARCHIVE_ENTRIES_SQL, ARCHIVE_HOURLY_SQL):
+                connection.execute(sql % params, 3)
+        self.assertEqual(archive_orders(db.engine, pause=0), (1, 0))
+        self.assertEqual(db.session.execute(
+            'SELECT count(*) FROM history_2017.order_history WHERE id = 3').scalar(), 1)
+
+        # Another order archived under the id fails instead of overwriting it.
+        order_id = self.new_order()
+        db.session.execute("INSERT INTO history_2017.order_history (id, name, quantity, raw_material_quantity, "
+                           "estimated_time_to_complete, order_created_at) VALUES (:id, 'Other', 1, 1, 1, '2000-01-01')", dict(id=order_id))
+        db.session.commit()
+        self.complete(order_id)
+        db.session.remove()
+        self.assertRaises(IntegrityError, archive_orders, db.engine, pause=0)
+        self.assertEqual(Order.query.filter_by(id=order_id).count(), 1)
+        self.assertEqual(db.session.execute('SELECT name FROM history_2017.order_history WHERE id = :id',
+                                            dict(id=order_id)).fetchall(), [('Other',)])
+
+        db.session.execute('DELETE FROM history_2017.order_history WHERE id = :id', dict(id=order_id))
+        db.session.commit()
+        self.assertEqual(archive_orders(db.engine, pause=0), (1, 0))
+
+    def test_migration_rebuilds_the_tables_with_autoincrement(self):
+        db.session.remove()
+        ids = [o.id for o in Order.query.order_by(Order.id)]
+        history.ensure_partition(2016)
+        connection = sqlite3.connect(db.engine.url.database)
+        # The old schema: ids handed out again after the highest is archived.
+        connection.execute('PRAGMA legacy_alter_table = ON')
+        connection.execute('ALTER TABLE "order" RENAME TO order_old')
+        connection.execute('CREATE TABLE "order" AS SELECT * FROM order_old')
+        connection.execute('DROP TABLE order_old')
+        connection.commit()
+        connection.close()
+        connection = sqlite3.connect(history.partition_path(2016))
+        connection.execute("INSERT INTO order_history (id, name, quantity, raw_material_quantity, "
+                           "estimated_time_to_complete) VALUES (100, 'Old', 1, 1, 1)")
+        connection.commit()
+        connection.close()
+
+        with db.engine.connect() as connection:
+            version = db_migrate.MIGRATIONS.index(db_migrate.add_order_entry_autoincrement)
+            db_migrate.set_version(connection, version)
+        self.assertEqual(db_migrate.upgrade(db.engine), db_migrate.head() - version)
+        with db.engine.connect() as connection:
+            self.assertIn('AUTOINCREMENT', db_migrate.table_sql(connection, 'order'))
+            self.assertTrue(db_migrate.index_exists(connection, 'ix_order_status'))
+            self.assertEqual(connection.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'order'").scalar(), 3)
+            self.assertEqual(connection.execute('PRAGMA foreign_keys').scalar(), 1)
+        self.assertEqual([o.id for o in Order.query.order_by(Order.id)], ids)
+        self.assertTrue(self.new_order() > 100)
+
+    def test_history_admin_views(self):
+        self.login()
+        for url in ('/admin/order_history/', '/admin/productionentry_history/'):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from tests.base import AppTestCase
+from app import assets
+
+STATIC = os.path.join(os.path.dirname(__file__), '..', 'app', 'static')
+
+
+class AssetsTestCase(AppTestCase):
+
+    def test_fingerprinted_url_is_immutable(self):
+        url = assets.asset_url('js/app.js')
+        digest = assets.fingerprint(os.path.join(STATIC, 'js', 'app.js'))
+        self.assertEqual(url, '/static/js/app.%s.js' % digest)
+
+        rv = self.client.get(url)
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('immutable', rv.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', rv.headers['Cache-Control'])
+        self.assertNotIn('Expires', rv.headers)
+        with open(os.path.join(STATIC, 'js', 'app.js'), 'rb') as fp:
+            self.assertEqual(rv.data, fp.read())
+
+    def test_plain_and_outdated_urls_revalidate(self):
+        rv = self.client.get('/static/js/app.js')
+        self.assertEqual(rv.headers['Cache-Control'], 'no-cache')
+        again = self.client.get('/static/js/app.js', headers={'If-None-Match': rv.headers['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+        outdated = self.client.get('/static/js/app.000000000000.js')
+        self.assertEqual(outdated.status_code, 200)
+        self.assertEqual(outdated.headers['Cache-Control'], 'no-cache')
+
+    def test_precompressed_variant(self):
+        assets.build(STATIC)
+        url = assets.asset_url('js/app.js')
+        rv = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', rv.headers['Vary'])
+        plain = self.client.get(url)
+        self.assertEqual(rv.mimetype, plain.mimetype)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(rv.data)).read(), plain.data)
+        self.assertNotEqual(rv.headers['ETag'], plain.headers['ETag'])
+
+    def test_concurrent_builds_write_their_own_files(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'app.js')
+            with open(path, 'w') as fp:
+                fp.write('var a = 1;\n' * 100)
+            # Another worker half way through writing the same sibling.
+            other = path + '.gz.%d.tmp' % (os.getpid() + 1)
+            with open(other, 'w') as fp:
+                fp.write('partial')
+            self.assertEqual(assets.build(tmp_dir), (1, 1))
+            with open(other) as fp:
+                self.assertEqual(fp.read(), 'partial')
+            self.assertEqual(gzip.open(path + '.gz').read(), 'var a = 1;\n' * 100)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_uploads_and_missing_files(self):
+        self.assertEqual(self.client.get('/files/chair.jpg').status_code, 200)
+        self.assertEqual(self.client.get('/static/js/nope.js').status_code, 404)
+        self.assertEqual(self.client.get('/static/../config.py').status_code, 404)
+
+    def test_appcache_version_follows_cached_files(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmp_dir, 'app.js'), 'w') as fp:
+                fp.write('var a = 1;')
+            with open(os.path.join(tmp_dir, assets.APPCACHE), 'w') as fp:
+                fp.write('CACHE MANIFEST\n\n2017-01-22:v16\n\nCACHE:\napp.js\n\nNETWORK:\n*\n')
+
+            first = assets.appcache_manifest(tmp_dir)
+            self.assertNotIn('v16', first)
+            self.assertIn('# version: ', first)
+            self.assertEqual(assets.appcache_manifest(tmp_dir), first)
+
+            with open(os.path.join(tmp_dir, 'app.js'), 'w') as fp:
+                fp.write('var a = 22;')
+            self.assertNotEqual(assets.appcache_manifest(tmp_dir), first)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        rv = self.client.get('/static/manifest.appcache')
+        self.assertEqual(rv.mimetype, 'text/cache-manifest')
+        self.assertNotIn('2017-01-22:v16', rv.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
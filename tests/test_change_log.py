@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from tests.base import AppTestCase
+from app import db, db_backup, change_log
+from app.model import Order, ProductionEntry, User, Role
+
+
+class ChangeLogTestCase(AppTestCase):
+
+    def setUp(self):
+        super(ChangeLogTestCase, self).setUp()
+        self.backup_dir = tempfile.mkdtemp()
+        self.segment_dir = os.path.join(self.backup_dir, 'changes')
+        # Start from an empty log.
+        change_log.ship(db.engine, os.path.join(self.backup_dir, 'before'))
+
+    def tearDown(self):
+        shutil.rmtree(self.backup_dir)
+        super(ChangeLogTestCase, self).tearDown()
+
+    def rows(self, path):
+        connection = sqlite3.connect(path)
+        try:
+            return dict((t, sorted(connection.execute('SELECT * FROM "%s"' % t).fetchall()))
+                        for t in change_log.TRACKED_TABLES)
+        finally:
+            connection.close()
+
+    def write_some(self):
+        order = Order.query.get(1)
+        order.note = u'replayed \u2713'
+        entry = ProductionEntry.query.filter(ProductionEntry.members.any()).first()
+        entry.members = entry.members[1:]
+        user = User.query.filter_by(email='admin@gmail.com').one()
+        user.roles.append(Role.query.filter_by(name='lead').one())
+        db.session.commit()
+        with db.engine.begin() as connection:
+            connection.execute("UPDATE machine SET name = name || ' B' WHERE id = 1")
+
+    def touch_machine(self):
+        with db.engine.begin() as connection:
+            connection.execute('UPDATE machine SET name = name WHERE id = 1')
+
+    def test_one_process_ships_at_a_time(self):
+        first, second = change_log.ChangeShipper(), change_log.ChangeShipper()
+        for shipper in (first, second):
+            shipper.engine, shipper.segment_dir = db.engine, self.segment_dir
+        self.touch_machine()
+        self.assertEqual(len(first.check()), 1)
+        self.touch_machine()
+        # flock: the second lock file is refused like another process's would be.
+        self.assertIsNone(second.check())
+        with db.engine.connect() as connection:
+            self.assertEqual(change_log.pending(connection), 1)
+        first.release()
+        self.assertEqual(len(second.check()), 1)
+        second.release()
+
+    def test_shipper_thread_empties_the_log(self):
+        shipper = change_log.ChangeShipper(interval=0.05)
+        self.touch_machine()
+        shipper.start(db.engine, self.segment_dir)
+        try:
+            for _ in range(100):
+                with db.engine.connect() as connection:
+                    if not change_log.pending(connection):
+                        break
+                time.sleep(0.05)
+        finally:
+            shipper.stop()
+            shipper.release()
+        with db.engine.connect() as connection:
+            self.assertEqual(change_log.pending(connection), 0)
+        self.assertEqual(len(db_backup.list_segments(self.segment_dir)), 1)
+
+    def test_no_triggers_without_json(self):
+        count = "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'machine'"
+        with db.engine.connect() as connection:
+            self.assertTrue(change_log.json_available(connection))
+        json_available = change_log.json_available
+        change_log.json_available = lambda connection: False
+        try:
+            with db.engine.begin() as connection:
+                change_log.create_triggers(connection, ['machine'])
+            with db.engine.connect() as connection:
+                self.assertEqual(connection.execute(count).scalar(), 0)
+            # Writes still work, unlogged.
+            self.touch_machine()
+            with db.engine.connect() as connection:
+                self.assertEqual(change_log.pending(connection), 0)
+        finally:
+            change_log.json_available = json_available
+            with db.engine.begin() as connection:
+                change_log.create_triggers(connection, ['machine'])
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.execute(count).scalar(), 3)
+
+    def test_triggers_log_orm_and_sql_writes(self):
+        self.write_some()
+        with db.engine.connect() as connection:
+            log = connection.execute('SELECT table_name, op, old_key, new_row FROM change_log ORDER BY seq').fetchall()
+        tables = set((t, op) for t, op, old, new in log)
+        self.assertIn(('order', 'U'), tables)
+        self.assertIn(('users_production_entries', 'D'), tables)
+        self.assertIn(('roles_users', 'I'), tables)
+        self.assertIn(('machine', 'U'), tables)
+        order = [json.loads(new) for t, op, old, new in log if t == 'order'][-1]
+        self.assertEqual(order['id'], 1)
+        self.assertEqual(order['note'], u'replayed \u2713')
+
+    def test_restore_replays_segments_over_the_backup(self):
+        database = db.engine.url.database
+        backup_file = db_backup.sqlite3_backup(database, self.backup_dir)
+        self.write_some()
+        first = change_log.ship(db.engine, self.segment_dir)
+        order = Order.query.get(2)
+        order.note = 'second segment'
+        db.session.commit()
+        second = change_log.ship(db.engine, self.segment_dir)
+        self.assertEqual((len(first), len(second)), (1, 1))
+        with db.engine.connect() as connection:
+            self.assertEqual(change_log.pending(connection), 0)
+
+        target = os.path.join(self.backup_dir, 'restored.db')
+        segments, changes = db_backup.restore(backup_file, self.segment_dir, target)
+        self.assertEqual(segments, 2)
+        self.assertTrue(changes > 3)
+        self.assertEqual(self.rows(target), self.rows(database))
+
+        # The restored database continues the log where the segments end.
+        connection = sqlite3.connect(target)
+        last = db_backup.list_segments(self.segment_dir)[-1][1]
+        self.assertEqual(db_backup.change_log_position(connection), last)
+        self.assertEqual(connection.execute('SELECT count(*) FROM change_log').fetchone()[0], 0)
+        connection.close()
+
+    def test_restore_until_and_missing_segments(self):
+        backup_file = db_backup.sqlite3_backup(db.engine.url.database, self.backup_dir)
+        order = Order.query.get(1)
+        order.note = 'first'
+        db.session.commit()
+        until = db_backup.list_segments(os.path.dirname(change_log.ship(db.engine, self.segment_dir)[0]))[-1][1]
+        order = Order.query.get(1)
+        order.note = 'second'
+        db.session.commit()
+        change_log.ship(db.engine, self.segment_dir)
+
+        target = os.path.join(self.backup_dir, 'until.db')
+        db_backup.restore(backup_file, self.segment_dir, target, until=until)
+        connection = sqlite3.connect(target)
+        self.assertEqual(connection.execute('SELECT note FROM "order" WHERE id = 1').fetchone()[0], 'first')
+        connection.close()
+
+        os.remove(os.path.join(self.segment_dir, db_backup.list_segments(self.segment_dir)[0][3]))
+        with self.assertRaises(db_backup.BackupError):
+            db_backup.restore(backup_file, self.segment_dir, os.path.join(self.backup_dir, 'gap.db'))
+        self.assertFalse(os.path.exists(os.path.join(self.backup_dir, 'gap.db')))
+
+
+if __name__ == '__main__':
+    unittest.main()
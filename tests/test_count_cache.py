@@ -0,0 +1,73 @@
+import unittest
+
+from sqlalchemy import event
+from tests.base import AppTestCase
+from run import admin
+from app import db, count_cache
+from app.model import Order, ProductionEntry
+
+
+class CountCacheTestCase(AppTestCase):
+
+    def setUp(self):
+        super(CountCacheTestCase, self).setUp()
+        count_cache.clear()
+        self.counts = []
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record)
+        super(CountCacheTestCase, self).tearDown()
+
+    def record(self, conn, cursor, statement, *args):
+        if statement.lstrip().startswith('SELECT count('):
+            self.counts.append(statement)
+
+    def view(self, endpoint):
+        return [v for v in admin._views if getattr(v, 'endpoint', None) == endpoint][0]
+
+    def test_count_runs_again_only_after_a_change(self):
+        view = self.view('order')
+        active = Order.query.filter(Order.status != 'COMPLETED').count()
+        self.counts = []
+        self.assertEqual(view.get_count_query().scalar(), active)
+        self.assertEqual(view.get_count_query().scalar(), active)
+        self.assertEqual(len(self.counts), 1)
+
+        # Filters are cached separately.
+        filtered = view.get_count_query().filter(Order.quantity > 1000)
+        self.assertEqual(filtered.scalar(), Order.query.filter(
+            Order.status != 'COMPLETED', Order.quantity > 1000).count())
+
+        order = Order.query.get(1)
+        order.status = 'COMPLETED'
+        db.session.commit()
+        self.counts = []
+        self.assertEqual(view.get_count_query().scalar(), active - 1)
+        self.assertEqual(len(self.counts), 1)
+
+    def test_filtered_count_over_a_big_table_is_estimated(self):
+        view = self.view('productionentry')
+        total = ProductionEntry.query.count()
+        min_hits, count_cache.ESTIMATE_MIN_HITS = count_cache.ESTIMATE_MIN_HITS, 1
+        try:
+            query = count_cache.count_query(db.session, ProductionEntry, estimate_threshold=1)
+            self.assertEqual(query.scalar(), total)
+            self.assertFalse(isinstance(query.scalar(), count_cache.Estimate))
+
+            estimate = query.filter(ProductionEntry.shift_id == 1).scalar()
+            self.assertTrue(isinstance(estimate, count_cache.Estimate))
+            self.assertEqual(int(estimate), ProductionEntry.query.filter_by(shift_id=1).count())
+            self.assertEqual(unicode(count_cache.Estimate(1234)), u'about 1,234')
+        finally:
+            count_cache.ESTIMATE_MIN_HITS = min_hits
+        self.assertEqual(view.count_estimate_threshold, 50000)
+
+    def test_list_view_shows_count(self):
+        self.login()
+        rv = self.client.get('/admin/order/')
+        self.assertEqual(rv.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
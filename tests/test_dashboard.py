@@ -0,0 +1,66 @@
+import sys
+import json
+import unittest
+import subprocess
+
+from tests.base import AppTestCase
+from app import db, changes
+from app.model import Order, ProductionEntry
+from app.dashboard import dashboard_query, event_stream, snapshot
+
+
+class DashboardTestCase(AppTestCase):
+
+    def start_order(self, order_id, hourly_good):
+        entry = ProductionEntry.query.filter_by(order_id=order_id).first()
+        entry.num_hourly_good = hourly_good
+        entry.order.status = 'IN_PROGRESS'
+        db.session.commit()
+
+    def test_progress_is_aggregated_in_sql(self):
+        self.start_order(1, '100,200,1')
+        rows = dashboard_query(db.session).all()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].completed, 301)
+        # 301 of 1000 rounds up to 31%
+        self.assertEqual(rows[0].percent, 31)
+
+    def test_unchanged_poll_returns_304(self):
+        self.start_order(1, '10')
+        first = self.client.get('/api/dashboard')
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+
+        again = self.client.get('/api/dashboard', headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+
+        self.start_order(1, '10,10')
+        changed = self.client.get('/api/dashboard', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_stream_sends_snapshot_then_deltas(self):
+        self.start_order(1, '10')
+        events = event_stream(snapshot, db.session, poll_interval=0, max_age=60)
+        self.assertTrue(next(events).startswith('retry:'))
+        first = next(events)
+        self.assertTrue(first.startswith('event: snapshot'))
+
+        self.start_order(1, '10,20')
+        delta = next(events)
+        self.assertTrue(delta.startswith('event: delta'))
+        data = json.loads(delta.split('data: ', 1)[1])
+        self.assertEqual([o['completed'] for o in data['changed']], [30])
+        self.assertEqual(data['removed'], [])
+
+    def test_changes_are_shared_between_processes(self):
+        before = changes.generation('order')
+        subprocess.check_call([sys.executable, '-c',
+            'import sys; from app import changes; '
+            'changes.set_notify_file(sys.argv[1]); changes.bump("order")',
+            changes._notify_file])
+        self.assertEqual(changes.generation('order')[0], before[0] + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
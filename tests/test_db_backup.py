@@ -0,0 +1,89 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from tests.base import AppTestCase
+from app import db, db_backup, history, scheduler
+
+
+class DbBackupTestCase(AppTestCase):
+
+    def setUp(self):
+        super(DbBackupTestCase, self).setUp()
+        self.backup_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.backup_dir)
+        super(DbBackupTestCase, self).tearDown()
+
+    def restore(self, backup_file):
+        path = os.path.join(self.backup_dir, 'restored.db')
+        with gzip.open(backup_file, 'rb') as source:
+            with open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        return path
+
+    def counts(self, path):
+        connection = sqlite3.connect(path)
+        try:
+            return [connection.execute('SELECT count(*) FROM "%s"' % t).fetchone()[0]
+                    for t in ('order', 'production_entry', 'user', 'product')]
+        finally:
+            connection.close()
+
+    def test_backup_restores_to_the_live_rows(self):
+        database = db.engine.url.database
+        # A write still in the WAL, with a connection open, is in the backup.
+        with db.engine.begin() as connection:
+            connection.execute('UPDATE "order" SET note = ? WHERE id = 1', 'before the backup')
+        backup_file = db_backup.sqlite3_backup(database, self.backup_dir, 'gzip')
+
+        self.assertTrue(backup_file.endswith('.gz'))
+        self.assertEqual(os.listdir(self.backup_dir), [os.path.basename(backup_file)])
+        restored = self.restore(backup_file)
+        self.assertEqual(db_backup.integrity_check(restored), [])
+        self.assertEqual(self.counts(restored), self.counts(database))
+        connection = sqlite3.connect(restored)
+        self.assertEqual(connection.execute('SELECT note FROM "order" WHERE id = 1').fetchone()[0],
+                         'before the backup')
+        connection.close()
+
+    def test_missing_backup_dir(self):
+        with self.assertRaises(db_backup.BackupError):
+            db_backup.sqlite3_backup(db.engine.url.database, os.path.join(self.backup_dir, 'nope'))
+
+    def test_retention_keeps_the_newest(self):
+        now = time.time()
+        names = []
+        for days in (0, 1, 2, 8, 9, 30):
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now - days * 86400))
+            names.append('prod-mgmt.db-%s.gz' % stamp)
+        old_partition = 'history-2017.db-%s.gz' % time.strftime('%Y%m%d-%H%M%S', time.localtime(now - 40 * 86400))
+        for name in names + [old_partition, 'notes.txt']:
+            open(os.path.join(self.backup_dir, name), 'w').close()
+
+        removed = db_backup.clean_data(self.backup_dir, days=7, keep_last=3)
+        self.assertEqual(sorted(os.path.basename(r) for r in removed), sorted(names[3:]))
+        # Too old, but the only backup of its database.
+        self.assertEqual(sorted(os.listdir(self.backup_dir)), sorted(names[:3] + [old_partition, 'notes.txt']))
+
+        removed = db_backup.clean_data(self.backup_dir, days=0, keep_last=1)
+        self.assertEqual(sorted(os.path.basename(r) for r in removed), sorted(names[1:3]))
+
+    def test_backup_databases_includes_partitions(self):
+        history.ensure_partition(2017)
+        written = scheduler.backup_databases(db.engine, os.path.join(self.backup_dir, 'out'))
+        names = [os.path.basename(w) for w in written]
+        self.assertEqual(len(names), 1 + len(history.years()))
+        self.assertTrue(names[0].startswith(os.path.basename(db.engine.url.database) + '-'))
+        self.assertTrue(any(n.startswith('history-2017.db-') for n in names))
+        for backup_file in written:
+            self.assertEqual(db_backup.integrity_check(self.restore(backup_file)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from sqlalchemy.exc import OperationalError
+from tests.base import AppTestCase
+from run import admin
+from app import db, db_reader, db_tuning
+from app.model import Order
+
+
+class DbReaderTestCase(AppTestCase):
+
+    def view(self, endpoint):
+        return [v for v in admin._views if getattr(v, 'endpoint', None) == endpoint][0]
+
+    def test_reader_engine_cannot_write(self):
+        reader = db_reader.engine()
+        self.assertIsNot(reader, db.engine)
+        self.assertEqual(reader.url.database, db.engine.url.database)
+        self.assertEqual(dict(db_tuning.report(reader))['query_only'], 1)
+        self.assertEqual(dict(db_tuning.report(db.engine))['query_only'], 0)
+        with self.assertRaises(OperationalError):
+            reader.execute("UPDATE \"order\" SET note = 'x'")
+
+    def test_reader_sees_committed_writes(self):
+        order = Order.query.get(1)
+        order.note = 'written by the form'
+        db.session.commit()
+        db_reader.session.remove()
+        self.assertEqual(db_reader.session.query(Order.note).filter_by(id=1).scalar(), 'written by the form')
+
+    def test_history_views_read_on_the_reader(self):
+        self.login()
+        for endpoint in ('order_history', 'productionentry_history'):
+            self.assertIs(self.view(endpoint).session, db_reader.session)
+            rv = self.client.get('/admin/%s/' % endpoint)
+            self.assertEqual(rv.status_code, 200)
+        # Forms keep the write session.
+        self.assertIs(self.view('order').session, db.session)
+
+    def test_read_only_routes(self):
+        self.login()
+        self.assertEqual(self.client.get('/api/dashboard').status_code, 200)
+        self.assertEqual(self.client.get('/api/report/shift').status_code, 200)
+        self.assertEqual(self.client.get('/api/export/order_history').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
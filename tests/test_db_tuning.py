@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from tests.base import AppTestCase
+from run import app, db
+from app import db_tuning
+
+
+class DbTuningTestCase(AppTestCase):
+
+    def setUp(self):
+        super(DbTuningTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        super(DbTuningTestCase, self).tearDown()
+
+    def scratch_engine(self, profile):
+        path = os.path.join(self.tmp_dir, '%s.db' % profile)
+        engine = create_engine('sqlite:///' + path)
+        db_tuning.configure(engine, *db_tuning.profile_pragmas(app.config, profile))
+        return engine, path
+
+    def test_app_engine_has_the_configured_profile(self):
+        self.assertEqual(db_tuning.profile_of(db.engine), app.config['SQLITE_PROFILE'])
+        settings = dict(db_tuning.report(db.engine))
+        self.assertEqual(settings['journal_mode'], 'wal')
+        self.assertEqual(settings['synchronous'], 'NORMAL')
+        self.assertEqual(settings['busy_timeout'], 5000)
+        self.assertEqual(settings['temp_store'], 'MEMORY')
+        self.assertEqual(settings['foreign_keys'], 1)
+
+    def test_profiles_are_per_engine(self):
+        engine, path = self.scratch_engine('bulk-load')
+        settings = dict(db_tuning.report(engine))
+        self.assertEqual(settings['synchronous'], 'OFF')
+        self.assertEqual(settings['wal_autocheckpoint'], 0)
+        # The app's engine keeps its own.
+        self.assertEqual(dict(db_tuning.report(db.engine))['synchronous'], 'NORMAL')
+        engine.dispose()
+
+    def test_bulk_load_starts_the_checkpointer(self):
+        previous = db_tuning.checkpointer.database
+        try:
+            engine, path = self.scratch_engine('bulk-load')
+            self.assertEqual(db_tuning.checkpointer.database, path)
+            self.assertTrue(db_tuning.checkpointer._thread.is_alive())
+            engine.dispose()
+        finally:
+            db_tuning.checkpointer.database = previous
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            db_tuning.profile_pragmas(app.config, 'turbo')
+        with self.assertRaises(ValueError):
+            db_tuning.profile_pragmas(dict(SQLITE_PROFILES={'odd': {'locking_mode': 'EXCLUSIVE'}}), 'odd')
+
+    def test_checkpointer_truncates_a_big_wal(self):
+        engine, path = self.scratch_engine('bulk-load')
+        # The WAL goes away with the last connection to the file, keep this one.
+        connection = engine.connect()
+        connection.execute('CREATE TABLE t (x TEXT)')
+        with connection.begin():
+            connection.execute('INSERT INTO t VALUES (?)', *[('x' * 1000,) for _ in range(200)])
+        size = db_tuning.wal_size(path)
+        self.assertGreater(size, 100000)
+
+        checkpointer = db_tuning.WalCheckpointer(passive_bytes=size * 2, truncate_bytes=size * 4)
+        checkpointer.database = path
+        self.assertIsNone(checkpointer.check())
+
+        checkpointer.passive_bytes = size // 2
+        mode, (busy, pages, done) = checkpointer.check()
+        self.assertEqual((mode, busy), ('PASSIVE', 0))
+        self.assertEqual(done, pages)
+
+        checkpointer.truncate_bytes = size // 2
+        mode, (busy, pages, done) = checkpointer.check()
+        self.assertEqual((mode, busy), ('TRUNCATE', 0))
+        self.assertEqual(db_tuning.wal_size(path), 0)
+        connection.close()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
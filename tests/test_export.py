@@ -0,0 +1,87 @@
+import csv
+import json
+import zlib
+import unittest
+from StringIO import StringIO
+
+from tests.base import AppTestCase
+from app import db, export
+from app.model import ProductionEntry
+
+
+class ExportTestCase(AppTestCase):
+
+    def test_csv_export(self):
+        self.login()
+        rv = self.client.get('/api/export/production_entry')
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.is_streamed)
+        self.assertEqual(rv.mimetype, 'text/csv')
+        rows = list(csv.reader(StringIO(rv.data)))
+        self.assertEqual(rows[0], [c.name for c in ProductionEntry.__table__.columns])
+        self.assertEqual([int(r[0]) for r in rows[1:]],
+                         [e.id for e in ProductionEntry.query.order_by(ProductionEntry.id)])
+
+    def test_ndjson_and_gzip(self):
+        self.login()
+        plain = self.client.get('/api/export/production_entry?format=ndjson')
+        self.assertEqual(plain.status_code, 200)
+        rows = [json.loads(line) for line in plain.data.splitlines()]
+        self.assertEqual(len(rows), ProductionEntry.query.count())
+        self.assertEqual(sorted(rows[0]), sorted(c.name for c in ProductionEntry.__table__.columns))
+
+        gzipped = self.client.get('/api/export/production_entry?format=ndjson&gzip=1')
+        self.assertEqual(gzipped.mimetype, 'application/gzip')
+        self.assertEqual(zlib.decompress(gzipped.data, zlib.MAX_WBITS | 16), plain.data)
+
+    def test_history_views_export(self):
+        self.login()
+        rv = self.client.get('/api/export/order_history')
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.data.startswith('id,name,quantity'))
+
+    def test_unknown_table_or_format(self):
+        self.login()
+        self.assertEqual(self.client.get('/api/export/user').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/production_entry?format=xml').status_code, 404)
+
+    def test_admin_only(self):
+        self.login('lead1@gmail.com', '1ead0ther')
+        self.assertNotEqual(self.client.get('/api/export/production_entry').status_code, 200)
+
+    def test_rows_are_read_in_batches(self):
+        fetched = []
+        class Result(object):
+            def __init__(self, rows):
+                self.rows = rows
+            def fetchmany(self, size):
+                batch, self.rows = self.rows[:size], self.rows[size:]
+                fetched.append(len(batch))
+                return batch
+            def close(self):
+                pass
+
+        rows = export.fetch_batches(Result([(i,) for i in range(5)]), batch=2)
+        self.assertEqual(next(rows), (0,))
+        self.assertEqual(fetched, [2])
+        self.assertEqual(list(rows), [(1,), (2,), (3,), (4,)])
+        self.assertEqual(fetched, [2, 2, 1, 0])
+
+    def test_admin_view_streams_export(self):
+        self.login()
+        rv = self.client.get('/admin/productionentry/export/csv/')
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(rv.is_streamed)
+        self.assertEqual(len(list(csv.reader(StringIO(rv.data)))), 1 + ProductionEntry.query.count())
+
+        rv = self.client.get('/admin/productionentry/export/ndjson/')
+        self.assertEqual(rv.status_code, 200)
+        rows = [json.loads(line) for line in rv.data.splitlines()]
+        self.assertEqual(len(rows), ProductionEntry.query.count())
+        self.assertIn('members', rows[0])
+
+        rv = self.client.get('/admin/order_history/export/ndjson/')
+        self.assertEqual(rv.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
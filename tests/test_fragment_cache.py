@@ -0,0 +1,103 @@
+import unittest
+from datetime import datetime
+
+from flask import g
+from tests.base import AppTestCase
+from app import db, fragment_cache, view
+from app.model import Color, Order, User
+
+
+class FragmentCacheTestCase(AppTestCase):
+
+    def setUp(self):
+        super(FragmentCacheTestCase, self).setUp()
+        self.login()
+        fragment_cache.clear()
+        self.formatted = []
+        self.color_boxes_html = view.color_boxes_html
+        view.color_boxes_html = self.count_color_boxes
+
+    def tearDown(self):
+        view.color_boxes_html = self.color_boxes_html
+        super(FragmentCacheTestCase, self).tearDown()
+
+    def count_color_boxes(self, colors):
+        self.formatted.append(colors)
+        return self.color_boxes_html(colors)
+
+    def render(self, url='/admin/order/'):
+        # The test's app context, and so g, outlives the requests.
+        db.session.remove()
+        g.pop('fragment_versions', None)
+        g.pop('fragment_roles', None)
+        self.formatted = []
+        rv = self.client.get(url)
+        self.assertEqual(rv.status_code, 200)
+        return rv.data
+
+    def test_unchanged_rows_are_not_formatted_again(self):
+        first = self.render()
+        self.assertTrue(self.formatted)
+        self.assertEqual(self.render(), first)
+        self.assertEqual(self.formatted, [])
+
+    def test_an_updated_row_is_formatted_again(self):
+        self.render()
+        order = Order.query.filter(Order.status != 'COMPLETED').order_by(Order.id.desc()).first()
+        row_key = fragment_cache.row_key(order)
+        self.assertIn(row_key, fragment_cache._rows)
+        order.name = name = order.name + ' renamed'
+        db.session.commit()
+        self.assertNotIn(row_key, fragment_cache._rows)
+        rv = self.render()
+        self.assertTrue(self.formatted)
+        self.assertIn(name, rv)
+
+    def test_a_related_table_change_formats_again(self):
+        self.render()
+        color = Color.query.first()
+        color.name = color.name + ' 2'
+        db.session.commit()
+        self.render()
+        self.assertTrue(self.formatted)
+
+    def test_cells_are_cached_per_view_and_roles(self):
+        self.render()
+        admin = User.query.filter_by(email='admin@gmail.com').one()
+        roles = tuple(sorted(r.name for r in admin.roles))
+        cell_keys = [k for cells in fragment_cache._rows.values() for k in cells]
+        self.assertTrue(cell_keys)
+        self.assertEqual(set(k[:2] for k in cell_keys), set([('order', roles)]))
+
+    def test_deleted_row_is_evicted(self):
+        color = Color(name='Cache Test', color_code='#123456')
+        db.session.add(color)
+        db.session.commit()
+        row_key = ('color', color.id)
+        fragment_cache.put(row_key, ('color', ('admin',), 'name'), None, u'Cache Test')
+        db.session.delete(color)
+        db.session.commit()
+        self.assertIs(fragment_cache.get(row_key, ('color', ('admin',), 'name'), None), fragment_cache.MISSING)
+
+    def test_least_recently_used_rows_go_first(self):
+        max_rows, fragment_cache.MAX_ROWS = fragment_cache.MAX_ROWS, 2
+        try:
+            for pk in (1, 2, 3):
+                fragment_cache.put(('order', pk), 'cell', 1, pk)
+            self.assertEqual(fragment_cache.size(), 2)
+            self.assertIs(fragment_cache.get(('order', 1), 'cell', 1), fragment_cache.MISSING)
+            self.assertEqual(fragment_cache.get(('order', 3), 'cell', 1), 3)
+            self.assertIs(fragment_cache.get(('order', 3), 'cell', 2), fragment_cache.MISSING)
+        finally:
+            fragment_cache.MAX_ROWS = max_rows
+
+    def test_timestamps_are_relative_in_the_browser(self):
+        order = Order(production_start_at=datetime(2030, 1, 2, 3, 4, 5))
+        html = view.timestamp_formatter(None, None, order, 'production_start_at')
+        self.assertIn('<time class="timeago" datetime="2030-01-02T03:04:05"', html)
+        self.assertIn('>02.01.2030 03:04:05</time>', html)
+        self.assertNotIn(' ago', html)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from datetime import date, timedelta
+
+from flask import g
+from tests.base import AppTestCase
+from run import app, admin
+from app import db
+from app.model import Team
+from app.roster import generate_teams
+
+
+class KeysetPaginationTestCase(AppTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(KeysetPaginationTestCase, cls).setUpClass()
+        with app.app_context():
+            start = date.today() + timedelta(days=1)
+            generate_teams(db.engine, start, start + timedelta(days=4), '')
+
+    def setUp(self):
+        super(KeysetPaginationTestCase, self).setUp()
+        self.view = [v for v in admin._views if getattr(v, 'endpoint', None) == 'team_history'][0]
+
+    def list_page(self, sort_column=None, sort_desc=False, **args):
+        with app.test_request_context('/admin/team_history/', query_string=args):
+            count, rows = self.view.get_list(0, sort_column, sort_desc, None, [], page_size=7)
+            return [t.id for t in rows], g.keyset_pager
+
+    def walk(self, sort_column=None, sort_desc=False):
+        """Ids of every page going forward, then of every page going back."""
+        pages = []
+        ids, pager = self.list_page(sort_column, sort_desc)
+        pages.append(ids)
+        while pager['has_next'] and len(pages) <= 60:
+            ids, pager = self.list_page(sort_column, sort_desc, after=pager['next_url'].split('after=')[1])
+            pages.append(ids)
+
+        back = [ids]
+        while pager['has_prev'] and len(back) <= 60:
+            ids, pager = self.list_page(sort_column, sort_desc, before=pager['prev_url'].split('before=')[1])
+            back.insert(0, ids)
+        return pages, back
+
+    def test_pages_follow_the_default_sort(self):
+        expected = [t.id for t in Team.query.order_by(Team.date, Team.id)]
+        pages, back = self.walk()
+        self.assertEqual(sum(pages, []), expected)
+        self.assertTrue(all(len(p) == 7 for p in pages[:-1]))
+        self.assertEqual(back, pages)
+
+    def test_pages_follow_a_sort_column(self):
+        expected = [t.id for t in Team.query.order_by(Team.id.desc())]
+        pages, back = self.walk('id', True)
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(back, pages)
+
+    def test_list_page_renders_cursors(self):
+        self.login()
+        rv = self.client.get('/admin/team_history/?page_size=5')
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('after=', rv.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
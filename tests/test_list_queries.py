@@ -0,0 +1,120 @@
+import unittest
+from datetime import date, timedelta
+
+from flask import url_for
+from sqlalchemy import event
+from tests.base import AppTestCase
+from run import admin
+from app import db, count_cache, fragment_cache, view
+from app.model import Machine, Order, ProductionEntry, Shift, Team, User
+
+# Session, current user and roles, count, page rows and one query per
+# eager-loaded collection, whatever the number of rows on the page.
+MAX_LIST_QUERIES = 12
+
+
+class ListQueriesTestCase(AppTestCase):
+    """A list page costs a fixed number of queries, not a few per row."""
+
+    def setUp(self):
+        super(ListQueriesTestCase, self).setUp()
+        self.login()
+        self.selects = []
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record)
+        super(ListQueriesTestCase, self).tearDown()
+
+    def record(self, conn, cursor, statement, *args):
+        if statement.lstrip().startswith('SELECT'):
+            self.selects.append(statement)
+
+    def list_queries(self, url):
+        # The test's app context keeps the session across requests, start
+        # with an empty identity map like a real request.
+        db.session.remove()
+        count_cache.clear()
+        fragment_cache.clear()
+        view._order_strip_cache.clear()
+        self.selects = []
+        rv = self.client.get(url)
+        self.assertEqual(rv.status_code, 200)
+        return len(self.selects)
+
+    def assertFewQueries(self, url):
+        count = self.list_queries(url)
+        self.assertLessEqual(count, MAX_LIST_QUERIES, '%s ran %d queries:\n%s' % (
+            url, count, '\n'.join(self.selects)))
+        # One row or a full page, the same queries.
+        self.assertEqual(self.list_queries(url + '?page_size=1'), count)
+
+    def test_order_list(self):
+        self.assertFewQueries('/admin/order/')
+
+    def test_production_entry_list(self):
+        self.assertFewQueries('/admin/productionentry/')
+
+    def test_active_production_entries_join_their_order_once(self):
+        self.list_queries('/admin/productionentry/')
+        page = [q for q in self.selects if 'ORDER BY production_entry.id' in q]
+        self.assertTrue(page)
+        self.assertTrue(all(q.count('JOIN "order"') == 1 for q in page), page)
+
+    def test_team_list(self):
+        users = User.query.order_by(User.id).limit(9).all()
+        shift, machine = Shift.query.first(), Machine.query.first()
+        teams = [
+            Team(date=date(2030, 1, 1) + timedelta(days=i), shift=shift, machine=machine,
+                 lead=users[3 * i], members=[users[3 * i + 1]], standbys=[users[3 * i + 2]])
+            for i in range(3)
+        ]
+        db.session.add_all(teams)
+        db.session.commit()
+        try:
+            self.assertFewQueries('/admin/team_history/')
+        finally:
+            for team in teams:
+                db.session.delete(db.session.merge(team))
+            db.session.commit()
+
+    def test_user_and_product_lists(self):
+        self.assertFewQueries('/admin/user/')
+        self.assertFewQueries('/admin/product/')
+
+    def test_machine_list(self):
+        self.assertFewQueries('/admin/machine/')
+
+    def test_machine_order_strip_follows_order_changes(self):
+        order = Order.query.filter(Order.status != 'COMPLETED', Order.assigned_machine_id != None).first()
+        url = url_for('order.edit_view', id=order.id, url=url_for('order.index_view'))
+        self.list_queries('/admin/machine/')
+        self.assertIn(url, self.client.get('/admin/machine/').data)
+
+        # Cached strips, no order is read.
+        db.session.remove()
+        count_cache.clear()
+        fragment_cache.clear()
+        self.selects = []
+        self.client.get('/admin/machine/')
+        self.assertFalse([q for q in self.selects if 'FROM "order"' in q])
+
+        order = Order.query.get(order.id)
+        order.status = 'COMPLETED'
+        db.session.commit()
+        try:
+            self.assertNotIn(url, self.client.get('/admin/machine/').data)
+        finally:
+            order = Order.query.get(order.id)
+            order.status = 'NEW'
+            db.session.commit()
+
+    def test_deferred_columns_still_load(self):
+        view = [v for v in admin._views if v.endpoint == 'productionentry'][0]
+        entry = view.get_query().first()
+        self.assertEqual(entry.num_hourly_good,
+                         db.session.query(ProductionEntry.num_hourly_good).filter_by(id=entry.id).scalar())
+
+
+if __name__ == '__main__':
+    unittest.main()
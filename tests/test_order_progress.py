@@ -0,0 +1,50 @@
+import unittest
+
+from tests.base import AppTestCase
+from app import db, db_migrate
+from app.model import Order, ProductionEntry, order_progress_mismatches, refresh_order_progress
+
+
+class OrderProgressTestCase(AppTestCase):
+
+    def test_counters_follow_production_entries(self):
+        entry = ProductionEntry.query.filter_by(order_id=2).first()
+        entry.num_hourly_good = '10,20'
+        entry.num_hourly_bad = '1'
+        db.session.commit()
+        db.session.expire_all()
+
+        order = Order.query.get(2)
+        self.assertEqual((order.completed, order.total_bad), (30, 1))
+        self.assertEqual(order.remaining, 1970)
+
+        db.session.delete(entry)
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(Order.query.get(2).completed, 0)
+
+    def test_order_completes_when_quantity_reached(self):
+        entry = ProductionEntry.query.filter_by(order_id=1).first()
+        entry.num_hourly_good = '600,400'
+        db.session.commit()
+        db.session.expire_all()
+
+        order = Order.query.get(1)
+        self.assertEqual(order.status, 'COMPLETED')
+        self.assertIsNotNone(order.production_end_at)
+
+    def test_rebuild_and_migration_fix_drifted_counters(self):
+        db.session.execute('UPDATE "order" SET completed = 99')
+        db.session.commit()
+        with db.engine.begin() as connection:
+            self.assertTrue(order_progress_mismatches(connection))
+            db_migrate.set_version(connection, 0)
+
+        db_migrate.upgrade(db.engine)
+        with db.engine.begin() as connection:
+            self.assertEqual(db_migrate.current_version(connection), db_migrate.head())
+            self.assertEqual(order_progress_mismatches(connection), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import unittest
+
+from tests.base import AppTestCase
+from app import db
+from app.model import Order, ProductionEntry, ProductionHourlyCount
+
+
+class ProductionBatchTestCase(AppTestCase):
+
+    def post(self, payload):
+        return self.client.post('/api/production_entries/batch', data=json.dumps(payload),
+                                content_type='application/json')
+
+    def test_batch_is_applied_in_one_go(self):
+        self.login()
+        entry = ProductionEntry.query.filter_by(order_id=1).first()
+        result = self.post(dict(shift_id=1, date='2017-10-20', entries=[
+            dict(id=entry.id, num_hourly_good=[300, 300, 400], num_hourly_bad='1,0,0'),
+            dict(order_id=4, user_id=3, members=[7, 8], num_hourly_good='5,5'),
+        ]))
+        self.assertEqual(result.status_code, 200)
+        saved = json.loads(result.data)['entries']
+        self.assertEqual([s['index'] for s in saved], [0, 1])
+
+        db.session.expire_all()
+        self.assertEqual(Order.query.get(1).status, 'COMPLETED')
+        order = Order.query.get(4)
+        self.assertEqual((order.status, order.completed), ('IN_PROGRESS', 10))
+        self.assertEqual(ProductionHourlyCount.query.filter_by(entry_id=saved[1]['id']).count(), 2)
+
+    def test_invalid_entries_reject_the_whole_batch(self):
+        self.login()
+        before = ProductionEntry.query.count()
+        result = self.post(dict(shift_id=1, entries=[
+            dict(order_id=2, user_id=3, num_hourly_good='1,2'),
+            dict(order_id=999, user_id=7, num_hourly_good='1,x'),
+            dict(order_id=2, user_id=3, members=[1], num_hourly_good=list(range(9))),
+        ]))
+        self.assertEqual(result.status_code, 400)
+        errors = json.loads(result.data)['errors']
+        self.assertEqual([e['index'] for e in errors], [1, 2])
+        self.assertEqual(sorted(errors[0]['errors']), ['num_hourly_good', 'order_id', 'user_id'])
+        self.assertEqual(sorted(errors[1]['errors']), ['members', 'num_hourly_good'])
+        self.assertEqual(ProductionEntry.query.count(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import unittest
+
+from tests.base import AppTestCase
+from app import db, db_migrate
+from app.model import ProductionEntry, ProductionHourlyCount
+
+
+class ProductionReportTestCase(AppTestCase):
+
+    def test_hourly_counts_follow_entry_strings(self):
+        entry = ProductionEntry.query.filter_by(order_id=2).first()
+        entry.num_hourly_good = '10,20,30'
+        entry.num_hourly_damage = '0,2'
+        db.session.commit()
+
+        rows = ProductionHourlyCount.query.filter_by(entry_id=entry.id).order_by('hour_index').all()
+        self.assertEqual([(r.good, r.bad, r.damage) for r in rows], [(10, 0, 0), (20, 0, 2), (30, 0, 0)])
+        self.assertEqual((entry.num_good, entry.num_bad), (60, 2))
+
+    def test_reports_group_by_hour_and_shift(self):
+        entry = ProductionEntry.query.filter_by(order_id=2).first()
+        entry.num_hourly_good = '5,7'
+        db.session.commit()
+        day = entry.date.isoformat()
+        self.login()
+
+        hourly = json.loads(self.client.get('/api/report/hourly?start=%s' % day).data)
+        # Morning shift starts at 8
+        self.assertEqual([(h['hour'], h['good']) for h in hourly], [(8, 5), (9, 7)])
+
+        shift = json.loads(self.client.get('/api/report/shift?start=%s' % day).data)
+        self.assertEqual([(s['shift'], s['good']) for s in shift], [('Morning', 12)])
+
+    def test_migration_backfills_from_strings(self):
+        entry = ProductionEntry.query.filter_by(order_id=2).first()
+        entry.num_hourly_good = '1,2'
+        db.session.commit()
+        db.session.execute('DELETE FROM production_hourly_count')
+        db.session.commit()
+        with db.engine.begin() as connection:
+            db_migrate.set_version(connection, 1)
+
+        db_migrate.upgrade(db.engine)
+        self.assertEqual(ProductionHourlyCount.query.filter_by(entry_id=entry.id).count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
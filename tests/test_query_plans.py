@@ -0,0 +1,88 @@
+import re
+import unittest
+from datetime import date
+
+from tests.base import AppTestCase
+from run import admin
+from app import db, db_migrate, dashboard, report
+from app.model import Order, ProductionEntry, Role, User, roles_users, user_team_table, \
+    user_team_standbys_table, users_production_entries_table
+
+
+class QueryPlanTestCase(AppTestCase):
+    """The hot queries search an index instead of scanning their tables."""
+
+    def view(self, endpoint):
+        return [v for v in admin._views if getattr(v, 'endpoint', None) == endpoint][0]
+
+    def plan(self, query):
+        statement = query.with_labels().statement
+        compiled = statement.compile(dialect=db.engine.dialect)
+        # The plan does not depend on the parameter values.
+        params = [None] * len(compiled.positiontup)
+        # SQLite before 3.36 says 'SEARCH TABLE x' and 'SCAN TABLE x'.
+        return [re.sub(r'^(SEARCH|SCAN) TABLE ', r'\1 ', row[-1])
+                for row in db.engine.execute('EXPLAIN QUERY PLAN ' + str(compiled), *params)]
+
+    def assertSearches(self, query, table, index):
+        plan = self.plan(query)
+        self.assertFalse([step for step in plan if step.startswith('SCAN ')], plan)
+        self.assertTrue([step for step in plan if step.startswith('SEARCH %s USING ' % table) and index in step],
+                        plan)
+
+    def test_active_lists(self):
+        order_view = self.view('order')
+        self.assertSearches(order_view.get_query().order_by(Order.id.desc()).limit(20), 'order', 'ix_order_status')
+        self.assertSearches(order_view.get_count_query(), 'order', 'ix_order_status')
+
+        entry_view = self.view('productionentry')
+        query = entry_view.get_query().order_by(ProductionEntry.id.desc()).limit(20)
+        self.assertSearches(query, 'order', 'ix_order_status')
+        self.assertSearches(query, 'production_entry', 'ix_production_entry_order_id')
+        self.assertSearches(entry_view.get_count_query(), 'production_entry', 'ix_production_entry_order_id')
+
+        team_view = self.view('team')
+        self.assertSearches(team_view.get_query().order_by(team_view.model.date).limit(20),
+                            'team', 'ux_team_date_shift_machine')
+        self.assertSearches(team_view.get_count_query(), 'team', 'ux_team_date_shift_machine')
+
+    def test_order_strips(self):
+        self.assertSearches(self.view('machine')._open_orders_query([1, 2, 3]), 'order', 'ix_order_machine_status')
+
+    def test_dashboard_and_reports(self):
+        self.assertSearches(dashboard.dashboard_query(db.session), 'order', 'ix_order_status')
+        # The report's view of live and archived counts is materialized with the dates pushed down.
+        plan = self.plan(report.hourly_output(db.session, date.today(), date.today()))
+        self.assertFalse([step for step in plan
+                          if step.startswith('SCAN ') and step != 'SCAN production_hourly_count_all'], plan)
+        for index in ('ix_production_entry_date_shift', 'ix_production_hourly_count_history_date_shift'):
+            self.assertTrue([step for step in plan if step.startswith('SEARCH ') and index in step], plan)
+
+    def test_many_to_many_loads(self):
+        self.assertSearches(db.session.query(Role).join(roles_users).filter(roles_users.c.user_id == 1),
+                            'roles_users', 'ix_roles_users_user_role')
+        self.assertSearches(db.session.query(User).join(roles_users).filter(roles_users.c.role_id == 1),
+                            'roles_users', 'ix_roles_users_role_user')
+        for table, index in ((user_team_table, 'ix_user_team_team_user'),
+                             (user_team_standbys_table, 'ix_user_team_standbys_team_user')):
+            self.assertSearches(db.session.query(User).join(table).filter(table.c.team_id == 1), table.name, index)
+        link = users_production_entries_table
+        self.assertSearches(db.session.query(User).join(link).filter(link.c.production_entry_id == 1),
+                            link.name, 'ix_users_production_entries_entry_user')
+
+    def test_migration_adds_the_indexes(self):
+        names = ('ix_order_status', 'ix_order_machine_status', 'ix_production_entry_date_shift',
+                 'ix_user_team_team_user', 'ix_roles_users_user_role')
+        with db.engine.connect() as connection:
+            for name in names:
+                connection.execute('DROP INDEX %s' % name)
+            version = db_migrate.MIGRATIONS.index(db_migrate.add_hot_query_indexes)
+            db_migrate.set_version(connection, version)
+        self.assertEqual(db_migrate.upgrade(db.engine), db_migrate.head() - version)
+        with db.engine.connect() as connection:
+            self.assertTrue(all(db_migrate.index_exists(connection, name) for name in names))
+        self.assertSearches(self.view('order').get_count_query(), 'order', 'ix_order_status')
+
+
+if __name__ == '__main__':
+    unittest.main()
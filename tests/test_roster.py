@@ -0,0 +1,180 @@
+import json
+import sqlite3
+import unittest
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from tests.base import AppTestCase
+from app import db, roster
+from app.model import Team, TeamRequest, Machine
+from app.roster import worker, worker_id, allocate_seats, assign_leads, assign_shift, Fairness
+
+MachineRow = namedtuple('MachineRow', 'id average_num_workers machine_to_lead_ratio')
+
+
+class RosterTestCase(AppTestCase):
+
+    def tearDown(self):
+        db.session.execute('DELETE FROM user_team')
+        db.session.execute('DELETE FROM user_team_standbys')
+        db.session.execute('DELETE FROM team')
+        db.session.commit()
+        super(RosterTestCase, self).tearDown()
+
+    def request_teams(self, days, day_off='', wait=True):
+        # Start on a Monday so the day off weekdays are predictable.
+        start = date.today() + timedelta(days=7 - date.today().weekday())
+        team_request = TeamRequest(start_date=start, end_date=start + timedelta(days=days - 1), day_off=day_off)
+        db.session.add(team_request)
+        db.session.commit()
+        if wait:
+            worker.wait()
+            db.session.expire_all()
+        return team_request
+
+    def test_teams_are_written_in_the_background(self):
+        team_request = self.request_teams(10, day_off='6')
+        self.assertEqual(team_request.status, 'DONE')
+        self.assertEqual((team_request.num_days, team_request.num_days_done), (9, 9))
+        self.assertEqual(team_request.num_teams, 9 * 4 * 3)
+
+        teams = Team.query.all()
+        # 9 working days, 4 machines of 2 assemblers on each of the 3 shifts.
+        self.assertEqual(len(set(t.date for t in teams)), 9)
+        self.assertTrue(all(t.date.weekday() != 6 for t in teams))
+        self.assertEqual(len(teams), 9 * 4 * 3)
+        # The night shift only has 6 assemblers: every machine runs, two of them short.
+        self.assertTrue(all(len(t.members) in (1, 2) for t in teams))
+        self.assertTrue(all(t.lead.shift_id == t.shift_id for t in teams))
+
+    def snapshot(self):
+        return dict((t.id, (t.date, t.shift_id, t.machine_id, t.user_id,
+                            sorted(u.id for u in t.members), sorted(u.id for u in t.standbys)))
+                    for t in Team.query)
+
+    def test_overlapping_request_keeps_existing_teams(self):
+        self.request_teams(3)
+        before = self.snapshot()
+        team_request = self.request_teams(5)
+        after = self.snapshot()
+        self.assertEqual(team_request.num_teams, 2 * 4 * 3)
+        self.assertEqual(len(after), 5 * 4 * 3)
+        for team_id, team in before.items():
+            self.assertEqual(after[team_id], team)
+
+    def test_machine_out_of_use_only_drops_its_teams(self):
+        self.request_teams(3)
+        before = self.snapshot()
+        machine = Machine.query.first()
+        machine.status = 'NOT_IN_USE'
+        db.session.commit()
+        try:
+            team_request = self.request_teams(3)
+        finally:
+            machine.status = 'ON'
+            db.session.commit()
+
+        after = self.snapshot()
+        self.assertEqual(team_request.num_teams, 0)
+        self.assertEqual(set(before) - set(after),
+                         set(i for i, t in before.items() if t[2] == machine.id))
+        for team_id, team in after.items():
+            self.assertEqual(before[team_id], team)
+
+    def test_status_endpoint(self):
+        self.login()
+        team_request = self.request_teams(1)
+        rv = self.client.get('/api/team_request/%d/status' % team_request.id)
+        self.assertEqual(rv.status_code, 200)
+        status = json.loads(rv.data)
+        self.assertEqual(status['status'], 'DONE')
+        self.assertEqual(status['num_teams'], 4 * 3)
+        self.assertEqual(self.client.get('/api/team_request/0/status').status_code, 404)
+
+    def test_resume_runs_requests_of_gone_workers_again(self):
+        start = date.today() + timedelta(days=7 - date.today().weekday())
+        gone = TeamRequest(start_date=start, end_date=start, day_off='', status='RUNNING',
+                           worker_id='elsewhere:1', heartbeat_at=datetime.now() - timedelta(hours=1))
+        running = TeamRequest(start_date=start, end_date=start, day_off='', status='RUNNING',
+                              worker_id=worker_id(), heartbeat_at=datetime.now())
+        db.session.add_all([gone, running])
+        db.session.commit()
+        worker.resume(db.engine)
+        worker.wait()
+        db.session.expire_all()
+        self.assertEqual(gone.status, 'DONE')
+        self.assertEqual(gone.num_teams, 4 * 3)
+        # Still being run by this process.
+        self.assertEqual(running.status, 'RUNNING')
+        running.status = 'DONE'
+        db.session.commit()
+
+    def test_stored_teams_are_read_under_the_write_lock(self):
+        load_teams = roster.load_teams
+        locked = []
+
+        def load_teams_locked(connection, first, last):
+            other = sqlite3.connect(connection.engine.url.database, timeout=0)
+            try:
+                other.execute('BEGIN IMMEDIATE')
+                locked.append(False)
+            except sqlite3.OperationalError:
+                locked.append(True)
+            finally:
+                other.close()
+            return load_teams(connection, first, last)
+
+        roster.load_teams = load_teams_locked
+        try:
+            self.request_teams(2)
+        finally:
+            roster.load_teams = load_teams
+        self.assertTrue(locked)
+        self.assertTrue(all(locked))
+
+    def test_every_assembler_is_placed_once_per_shift(self):
+        start = self.request_teams(1).start_date
+        for team in Team.query.filter_by(date=start):
+            self.assertTrue(all(u.shift_id == team.shift_id for u in team.members))
+        placed = [u.id for t in Team.query.filter_by(date=start) for u in t.members + t.standbys
+                  if u.has_role('assembler')]
+        self.assertEqual(len(placed), len(set(placed)))
+
+
+class AssignmentTestCase(unittest.TestCase):
+
+    machines = [MachineRow(1, '4', '1-2'), MachineRow(2, '2', '1-2'), MachineRow(3, '2', '1-1')]
+
+    def test_seats_are_balanced_when_short_of_workers(self):
+        self.assertEqual(allocate_seats(self.machines, 4), [2, 1, 1])
+        self.assertEqual(allocate_seats(self.machines, 20), [4, 2, 2])
+        self.assertEqual(allocate_seats(self.machines, 0), [0, 0, 0])
+
+    def test_seats_minimize_the_squared_shortfall(self):
+        machines = [MachineRow(1, '10', '1-1'), MachineRow(2, '1', '1-1')]
+        # 1 + (9/10) ** 2 = 1.81 seating the big machine, 1.0 seating the small one.
+        self.assertEqual(allocate_seats(machines, 1), [0, 1])
+        self.assertEqual(allocate_seats(machines, 3), [2, 1])
+
+    def test_leads_share_machines_by_ratio(self):
+        slots, spare = assign_leads(self.machines, [10, 11, 12])
+        self.assertEqual(slots, [10, 10, 11])
+        self.assertEqual(spare, [12])
+
+    def test_standbys_take_turns(self):
+        fairness = Fairness()
+        day = date(2017, 11, 6)
+        standby_days = dict((u, 0) for u in range(1, 13))
+        for d in range(4):
+            teams = assign_shift(day + timedelta(days=d), 1, self.machines, range(1, 13), [20, 21], fairness)
+            self.assertEqual(sorted(len(t.standbys) for t in teams), [1, 1, 2])
+            for t in teams:
+                for u in t.standbys:
+                    if u in standby_days:
+                        standby_days[u] += 1
+        # 4 standbys a day over 4 days for 12 assemblers.
+        self.assertTrue(max(standby_days.values()) - min(standby_days.values()) <= 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import unittest
+
+from sqlalchemy import event
+from tests.base import AppTestCase
+from app import db, staff_cache
+from app.model import User
+
+
+class StaffCacheTestCase(AppTestCase):
+
+    def setUp(self):
+        super(StaffCacheTestCase, self).setUp()
+        staff_cache.clear()
+
+    def names(self, role, term, offset=0, limit=10):
+        return [c.name for c in staff_cache.search(role, term, offset, limit)]
+
+    def test_prefix_search_ignores_case(self):
+        self.assertEqual(self.names('lead', 'lead'), ['Lead 1', 'Lead 2', 'Lead 3'])
+        self.assertEqual(self.names('assembler', 'ja'), ['Jack Jones', 'Jacob Roberts', 'James Rose'])
+        self.assertEqual(self.names('assembler', 'JAC'), ['Jack Jones', 'Jacob Roberts'])
+        # A prefix, not a substring.
+        self.assertEqual(self.names('assembler', 'jones'), [])
+        # Only users of the role.
+        self.assertEqual(self.names('lead', 'ja'), [])
+
+    def test_offset_and_limit(self):
+        everyone = self.names('assembler', '', limit=0)
+        self.assertEqual(len(everyone), 25)
+        self.assertEqual(everyone, sorted(everyone, key=lambda n: n.lower()))
+        self.assertEqual(self.names('assembler', '', offset=5, limit=3), everyone[5:8])
+        self.assertEqual(self.names('lead', 'lead', offset=2, limit=10), ['Lead 3'])
+
+    def test_cached_until_users_change(self):
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        self.names('lead', '')
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.names('lead', 'l')
+            self.names('lead', 'lead 2')
+            self.assertEqual(statements, [])
+
+            user = User.query.filter_by(name='Lead 2').one()
+            user.active = False
+            db.session.commit()
+            self.assertEqual(self.names('lead', 'lead'), ['Lead 1', 'Lead 3'])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+            user.active = True
+            db.session.commit()
+        self.assertEqual(self.names('lead', 'lead'), ['Lead 1', 'Lead 2', 'Lead 3'])
+
+    def test_ajax_lookup(self):
+        self.login()
+        rv = self.client.get('/admin/team/ajax/lookup/?name=members&query=ja&limit=2')
+        self.assertEqual(rv.status_code, 200)
+        choices = json.loads(rv.data)
+        self.assertEqual([c[1] for c in choices], ['Jack Jones', 'Jacob Roberts'])
+        jack = User.query.filter_by(name='Jack Jones').one()
+        self.assertEqual(choices[0][0], jack.id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import logging
+import os
+import shutil
+import unittest
+
+from flask import url_for
+from PIL import Image
+from tests.base import AppTestCase
+from app import thumbnails
+
+SOURCE = os.path.join(os.path.dirname(__file__), '..', 'app', 'files')
+
+
+class ThumbnailsTestCase(AppTestCase):
+
+    def setUp(self):
+        super(ThumbnailsTestCase, self).setUp()
+        shutil.rmtree(thumbnails.base_path, ignore_errors=True)
+        os.makedirs(thumbnails.base_path)
+        thumbnails.set_directory(thumbnails.base_path)
+        for name in ('chair.jpg', 'chair_thumb.jpg', 'lead.png'):
+            shutil.copy(os.path.join(SOURCE, name), thumbnails.base_path)
+
+    def test_all_sizes_are_generated_in_the_background(self):
+        # The old Flask-Admin thumbnail until the new ones are there.
+        self.assertEqual(thumbnails.thumbnail_name('chair.jpg', 'list'), 'chair_thumb.jpg')
+        thumbnails.wait()
+
+        digest = thumbnails.digest('chair.jpg')
+        original = os.path.getsize(os.path.join(thumbnails.base_path, 'chair.jpg'))
+        for size, edge in thumbnails.SIZES.items():
+            name = thumbnails.thumbnail_name('chair.jpg', size)
+            self.assertEqual(name, thumbnails.cache_name(digest, size))
+            path = os.path.join(thumbnails.base_path, name)
+            self.assertEqual(Image.open(path).size, (edge, edge))
+            self.assertLess(os.path.getsize(path), original)
+        self.assertEqual(thumbnails.thumbnail_url('chair.jpg', 'icon'),
+                         url_for('static', filename=thumbnails.cache_name(digest, 'icon')))
+
+    def test_cache_is_content_addressed(self):
+        self.assertTrue(thumbnails.schedule('lead.png'))
+        thumbnails.wait()
+        self.assertTrue(thumbnails.is_ready('lead.png'))
+
+        # Same picture under another name, nothing to make.
+        shutil.copy(os.path.join(thumbnails.base_path, 'lead.png'), os.path.join(thumbnails.base_path, 'copy.png'))
+        self.assertFalse(thumbnails.schedule('copy.png'))
+        self.assertEqual(thumbnails.thumbnail_name('copy.png'), thumbnails.thumbnail_name('lead.png'))
+
+    def test_failed_generation_is_not_queued_again(self):
+        path = os.path.join(thumbnails.base_path, 'broken.jpg')
+        with open(path, 'wb') as fp:
+            fp.write(b'not an image')
+        errors = []
+        handler = logging.Handler(logging.ERROR)
+        handler.emit = errors.append
+        thumbnails.LOG.addHandler(handler)
+        try:
+            self.assertTrue(thumbnails.schedule('broken.jpg'))
+            # The callback has run once the job is ready.
+            thumbnails.wait()
+            # The original is served, nothing is queued or logged again.
+            self.assertFalse(thumbnails.schedule('broken.jpg'))
+            self.assertEqual(thumbnails.thumbnail_name('broken.jpg'), 'broken.jpg')
+        finally:
+            thumbnails.LOG.removeHandler(handler)
+        self.assertEqual([r.args[0] for r in errors], ['broken.jpg'])
+        self.assertIn('IOError', errors[0].args[1])
+        self.assertNotIn('broken.jpg', thumbnails._pending)
+
+        # A new upload under the name gets its try.
+        shutil.copy(os.path.join(thumbnails.base_path, 'lead.png'), path)
+        self.assertTrue(thumbnails.schedule('broken.jpg'))
+        thumbnails.wait()
+        self.assertTrue(thumbnails.is_ready('broken.jpg'))
+
+    def test_missing_photo(self):
+        self.assertFalse(thumbnails.schedule('nope.jpg'))
+        self.assertEqual(thumbnails.thumbnail_name('nope.jpg'), 'nope.jpg')
+        self.assertEqual(thumbnails.thumbnail_url(None), '')
+
+
+if __name__ == '__main__':
+    unittest.main()